@@ -1 +1,11 @@
-from .linux_device import LinIOCTLDevice
+import sys
+
+## Submodules are imported on first use, importing the package stays cheap
+if sys.version_info < (3, 7):
+    from .linux_device import LinIOCTLDevice
+else:
+    def __getattr__(name):
+        if name == "LinIOCTLDevice":
+            from .linux_device import LinIOCTLDevice
+            return LinIOCTLDevice
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
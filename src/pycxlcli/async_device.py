@@ -0,0 +1,228 @@
+import asyncio
+import weakref
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .cxl import CXLMemDevice
+from .linux_device import LinIOCTLDevice
+from .linux_utils import get_cxl_mem_name
+
+## Worker threads of the default executor, the most ioctls in flight at the same time
+DEFAULT_MAX_WORKERS = 64
+
+_default_executor = None
+_default_executor_lock = threading.Lock()
+
+
+def get_default_executor():
+    """
+    The process wide executor running the blocking ioctls of the async devices.
+    """
+    global _default_executor
+    with _default_executor_lock:
+        if _default_executor is None:
+            _default_executor = ThreadPoolExecutor(max_workers=DEFAULT_MAX_WORKERS,
+                                                   thread_name_prefix="pycxl-async")
+        return _default_executor
+
+
+def shutdown_default_executor(wait=True):
+    global _default_executor
+    with _default_executor_lock:
+        executor, _default_executor = _default_executor, None
+    if executor is not None:
+        executor.shutdown(wait)
+
+
+## (loop, device path) -> asyncio.Lock, one mailbox lock per device and event loop
+_device_locks = weakref.WeakValueDictionary()
+
+
+def _get_device_lock(loop, dev_path):
+    key = (id(loop), dev_path)
+    lock = _device_locks.get(key)
+    if lock is None:
+        lock = asyncio.Lock()
+        _device_locks[key] = lock
+    return lock
+
+
+class _AsyncDeviceBase(object):
+    """
+    Run the calls of a blocking device in an executor, one call at a time per
+    device, the mailbox handles one command at a time, while calls to different
+    devices run concurrently.
+
+    A call that times out or is cancelled stops being awaited at once, but the
+    device stays locked until the ioctl already issued returns, so the next call
+    never overlaps it.
+    """
+    def __init__(self, dev_path, executor=None, loop=None, timeout=None):
+        self._loop = loop or asyncio.get_event_loop()
+        self._executor = executor
+        self._lock = _get_device_lock(self._loop, dev_path)
+        self.timeout = timeout
+
+    async def _call(self, func, *args, timeout=None):
+        """
+        Run func(*args) in the executor with the device locked.
+
+        :param timeout: seconds, default self.timeout, None to wait forever
+        """
+        if timeout is None:
+            timeout = self.timeout
+        await self._lock.acquire()
+        try:
+            future = self._loop.run_in_executor(self._executor or get_default_executor(), func, *args)
+        except BaseException:
+            self._lock.release()
+            raise
+        # Hold the lock until the ioctl returns, even if the caller gives up waiting
+        future.add_done_callback(lambda f: self._lock.release())
+        return await asyncio.wait_for(asyncio.shield(future), timeout)
+
+
+class AsyncLinIOCTLDevice(_AsyncDeviceBase):
+    """
+    asyncio wrapper of a LinIOCTLDevice.
+    """
+    def __init__(self, device, executor=None, loop=None, timeout=None, **kwargs):
+        """
+        :param device: the device path, see LinIOCTLDevice for the other keyword arguments
+        :param executor: the executor running the ioctls, default get_default_executor()
+        :param timeout: default timeout in seconds of each command, None to wait forever
+        """
+        super(AsyncLinIOCTLDevice, self).__init__(device, executor, loop, timeout)
+        self._device = LinIOCTLDevice(device, **kwargs)
+
+    @property
+    def device(self):
+        """ The blocking LinIOCTLDevice """
+        return self._device
+
+    async def execute(self, op, cdb, timeout=None):
+        return await self._call(self._device.execute, op, cdb, timeout=timeout)
+
+    async def close(self):
+        await self._call(self._device.close)
+
+
+class AsyncCXLMemDevice(_AsyncDeviceBase):
+    """
+    asyncio API of a CXLMemDevice, every method is a coroutine taking an optional
+    timeout in seconds, on timeout asyncio.TimeoutError is raised.
+
+    Open with: device = await AsyncCXLMemDevice.open("mem0")
+    """
+    def __init__(self, cxl_device, executor=None, loop=None, timeout=None):
+        """
+        :param cxl_device: the blocking CXLMemDevice, only use it through this object
+        """
+        super(AsyncCXLMemDevice, self).__init__(cxl_device.dev_path, executor, loop, timeout)
+        self._cxl_device = cxl_device
+
+    @classmethod
+    async def open(cls, dev_name, metadata_cache=None, executor=None, loop=None, timeout=None):
+        """
+        Open a device without blocking the event loop.
+        """
+        loop = loop or asyncio.get_event_loop()
+        cxl_device = await loop.run_in_executor(executor or get_default_executor(),
+                                                CXLMemDevice, dev_name, metadata_cache)
+        return cls(cxl_device, executor, loop, timeout)
+
+    @property
+    def device(self):
+        """ The blocking CXLMemDevice """
+        return self._cxl_device
+
+    @property
+    def dev_name(self):
+        return self._cxl_device.dev_name
+
+    @property
+    def dev_path(self):
+        return self._cxl_device.dev_path
+
+    async def call(self, func, *args, timeout=None):
+        """
+        Run func(cxl_device, *args) with the device locked, for what has no
+        coroutine here.
+        """
+        return await self._call(func, self._cxl_device, *args, timeout=timeout)
+
+    async def send(self, command_id, in_buf=None, out_buf=None, opcode=None, check_retval=True, validate=True, timeout=None):
+        """
+        See CXLMemDevice.send, the buffers must not be touched until it returns.
+        """
+        return await self._call(self._cxl_device.send, command_id, in_buf, out_buf, opcode, check_retval, validate, timeout=timeout)
+
+    async def get_query_commands(self, n_commands=0, use_cache=True, timeout=None):
+        return await self._call(self._cxl_device.get_query_commands, n_commands, use_cache, timeout=timeout)
+
+    async def get_identify(self, use_cache=True, timeout=None):
+        return await self._call(self._cxl_device.get_identify, use_cache, timeout=timeout)
+
+    async def get_supported_logs(self, use_cache=True, timeout=None):
+        return await self._call(self._cxl_device.get_supported_logs, use_cache, timeout=timeout)
+
+    async def get_fw_info(self, timeout=None):
+        return await self._call(self._cxl_device.get_fw_info, timeout=timeout)
+
+    async def get_background_status(self, timeout=None):
+        return await self._call(self._cxl_device.get_background_status, timeout=timeout)
+
+    async def iter_log(self, uuid, log_size=None, chunk_size=None, timeout=None):
+        """
+        async for chunk in device.iter_log(uuid): ...
+
+        Each Get Log runs in the executor, the chunks are bytes, the device stays
+        usable by other calls between chunks.
+
+        :param timeout: seconds for each chunk
+        """
+        chunks = self._cxl_device.iter_log(uuid, log_size, chunk_size)
+        def next_chunk():
+            chunk = next(chunks, None)
+            return None if chunk is None else bytes(chunk)
+        try:
+            while True:
+                chunk = await self._call(next_chunk, timeout=timeout)
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            await self._call(chunks.close)
+
+    async def close(self):
+        await self._call(self._cxl_device.close)
+
+
+async def iter_cxl_mem_devices(dev_names=None, metadata_cache=None, executor=None, timeout=None, on_error=None):
+    """
+    async for device in iter_cxl_mem_devices(): ...
+
+    Open the devices concurrently and yield an AsyncCXLMemDevice for each, as
+    they are opened.
+
+    :param dev_names: the device names, default all the CXL memory devices
+    :param on_error: on_error(dev_name, exception) is called for a device failing to
+    open, by default the exception is raised
+    """
+    loop = asyncio.get_event_loop()
+    if dev_names is None:
+        dev_names = sorted(await loop.run_in_executor(executor or get_default_executor(), get_cxl_mem_name))
+
+    async def open_device(dev_name):
+        try:
+            return dev_name, await AsyncCXLMemDevice.open(dev_name, metadata_cache, executor, loop, timeout), None
+        except Exception as e:
+            return dev_name, None, e
+
+    for future in asyncio.as_completed([open_device(i) for i in dev_names]):
+        dev_name, device, error = await future
+        if error is None:
+            yield device
+        elif on_error is not None:
+            on_error(dev_name, error)
+        else:
+            raise error
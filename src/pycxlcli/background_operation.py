@@ -0,0 +1,50 @@
+import time
+from ctypes import *
+
+## Background Operation Status, sent by the raw command
+BackgroundOperationStatusOPCode = 0x0002
+
+
+class cxlmi_cmd_bg_op_status_payload(Structure):
+    _fields_ = [
+        ("status", c_uint8),
+        ("rsvd", c_uint8),
+        ("opcode", c_uint16),
+        ("return_code", c_uint16),
+        ("vendor_status", c_uint16),
+    ]
+    _pack_ = 1
+
+    @property
+    def in_progress(self):
+        return bool(self.status & 0x01)
+
+    @property
+    def percent_complete(self):
+        return self.status >> 1
+
+
+def wait_background(get_status, timeout=None, initial_interval=0.01, max_interval=5.0):
+    """
+    Wait for a background operation to complete, polling its status with an
+    exponential backoff, from initial_interval up to max_interval seconds.
+
+    :param get_status: returns a cxlmi_cmd_bg_op_status_payload
+    :param timeout: seconds to wait at most, None to wait forever
+    :return: (the final status, number of polls), raise TimeoutError on timeout
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    interval = initial_interval
+    polls = 0
+    while True:
+        status = get_status()
+        polls += 1
+        if not status.in_progress:
+            return status, polls
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("background operation %#x still running, %d%% complete" % (status.opcode, status.percent_complete))
+            interval = min(interval, remaining)
+        time.sleep(interval)
+        interval = min(interval * 2, max_interval)
@@ -0,0 +1,187 @@
+import time
+import errno
+from collections import namedtuple
+from ctypes import sizeof, c_uint8
+from .cxl import CXLCommandError
+from .linux_cxl_ioctl import (
+    cxl_mem_command_id,
+    CXL_MBOX_CMD_RC_BACKGROUND,
+    CXL_MBOX_CMD_RC_BUSY,
+    )
+from .media_operations import (
+    cxlmi_cmd_scan_media_input,
+    cxlmi_scan_media_results_header,
+    cxlmi_media_error_record,
+    CXL_POISON_ALIGNMENT,
+    CXL_CAPACITY_MULTIPLIER,
+    CXL_SCAN_MEDIA_FLAG_NO_EVENT_LOG,
+    CXL_SCAN_MEDIA_FLAG_MORE_RECORDS,
+    CXL_SCAN_MEDIA_FLAG_STOPPED,
+    )
+from .background_operation import wait_background
+from .poison_list import PoisonRecordStore
+from .parallel import run_on_devices, DEFAULT_JOBS
+
+SCAN_MEDIA_RESULTS_HEADER_SIZE = sizeof(cxlmi_scan_media_results_header)
+MEDIA_ERROR_RECORD_SIZE = sizeof(cxlmi_media_error_record)
+
+
+class BackgroundResult(namedtuple('BackgroundResult', ['dev_name', 'elapsed', 'retries', 'polls', 'value'])):
+    """
+    dev_name: the device.
+
+    elapsed: seconds spent on the device, from the first attempt to completion.
+
+    retries: times the command was re-sent because the device or the kernel was busy.
+
+    polls: times Background Operation Status was polled.
+
+    value: the result of the operation, e.g. the media error records found by Scan Media.
+    """
+    __slots__ = ()
+
+
+def send_background(cxl_device, command_id, in_buf=None, timeout=None, retry_retvals=(CXL_MBOX_CMD_RC_BUSY,)):
+    """
+    Send a command, retrying with a backoff while the device or the kernel is busy
+    (mailbox Busy, or EBUSY while the kernel holds an exclusive command), and wait
+    for it to complete if it runs in the background.
+
+    :param timeout: seconds to wait at most, None to wait forever
+    :param retry_retvals: the mailbox return codes the command is re-sent on
+    :return: (retries, polls), raise TimeoutError on timeout
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    delay = 0.01
+    retries = 0
+    while True:
+        try:
+            cmd = cxl_device.send(command_id, in_buf, None)
+            break
+        except CXLCommandError as e:
+            if e.retval not in retry_retvals:
+                raise
+        except OSError as e:
+            if e.errno != errno.EBUSY:
+                raise
+        if deadline is not None and time.monotonic() + delay > deadline:
+            raise TimeoutError("device %s stays busy" % cxl_device.dev_path)
+        time.sleep(delay)
+        delay = min(delay * 2, 1.0)
+        retries += 1
+    polls = 0
+    if cmd.retval == CXL_MBOX_CMD_RC_BACKGROUND:
+        remaining = None if deadline is None else max(0, deadline - time.monotonic())
+        status, polls = wait_background(cxl_device.get_background_status, remaining)
+        if status.return_code != 0:
+            raise CXLCommandError(command_id, status.return_code)
+    return retries, polls
+
+
+def get_scan_media_results(cxl_device, store=None):
+    """
+    Send Get Scan Media Results while the device reports more media error records.
+
+    :param store: the PoisonRecordStore to add the records to, default a new one
+    :return: (the store, the last output header)
+    """
+    if store is None:
+        store = PoisonRecordStore()
+    max_records = (cxl_device.payload_max - SCAN_MEDIA_RESULTS_HEADER_SIZE) // MEDIA_ERROR_RECORD_SIZE
+    with cxl_device.buffer_pool.borrow(c_uint8 * (SCAN_MEDIA_RESULTS_HEADER_SIZE + max_records * MEDIA_ERROR_RECORD_SIZE)) as out_buf:
+        header = cxlmi_scan_media_results_header.from_buffer(out_buf)
+        records = memoryview(out_buf).cast('B')[SCAN_MEDIA_RESULTS_HEADER_SIZE:]
+        while True:
+            cxl_device.send(cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_SCAN_MEDIA, None, out_buf)
+            count = min(header.count, max_records)
+            store.extend_from_payload(records, count)
+            if count == 0 or not (header.flags & CXL_SCAN_MEDIA_FLAG_MORE_RECORDS):
+                break
+        header = cxlmi_scan_media_results_header.from_buffer_copy(header)
+        records.release()
+    return store, header
+
+
+def scan_media(cxl_device, start=0, length=None, no_event_log=False, timeout=None):
+    """
+    Scan a DPA range for media errors, and collect the media error records found.
+    A scan stopped prematurely by the device is restarted where it stopped.
+
+    :param length: bytes, default up to the total capacity of the device
+    :return: a BackgroundResult, value is the PoisonRecordStore of the records found
+    """
+    begin = time.monotonic()
+    deadline = None if timeout is None else begin + timeout
+    if length is None:
+        length = cxl_device.get_identify().total_capacity * CXL_CAPACITY_MULTIPLIER - start
+    in_buf = cxlmi_cmd_scan_media_input()
+    in_buf.address = start // CXL_POISON_ALIGNMENT * CXL_POISON_ALIGNMENT
+    in_buf.length = -(-length // CXL_POISON_ALIGNMENT)
+    in_buf.flags = CXL_SCAN_MEDIA_FLAG_NO_EVENT_LOG if no_event_log else 0
+    store = PoisonRecordStore()
+    total_retries = total_polls = 0
+    while True:
+        remaining = None if deadline is None else max(0, deadline - time.monotonic())
+        retries, polls = send_background(cxl_device, cxl_mem_command_id.CXL_MEM_COMMAND_ID_SCAN_MEDIA, in_buf, remaining)
+        total_retries += retries
+        total_polls += polls
+        _, header = get_scan_media_results(cxl_device, store)
+        if not (header.flags & CXL_SCAN_MEDIA_FLAG_STOPPED) or header.restart_length == 0:
+            break
+        in_buf.address = header.restart_address
+        in_buf.length = header.restart_length
+    return BackgroundResult(cxl_device.dev_name, time.monotonic() - begin, total_retries, total_polls, store)
+
+
+def sanitize(cxl_device, timeout=None):
+    """
+    Sanitize a memory device, all the user data is erased.
+
+    :return: a BackgroundResult
+    """
+    begin = time.monotonic()
+    retries, polls = send_background(cxl_device, cxl_mem_command_id.CXL_MEM_COMMAND_ID_SANITIZE, None, timeout)
+    return BackgroundResult(cxl_device.dev_name, time.monotonic() - begin, retries, polls, None)
+
+
+class FleetReport(namedtuple('FleetReport', ['results', 'wall_clock'])):
+    """
+    results: a DeviceResult per device, value is a BackgroundResult on success.
+
+    wall_clock: seconds from the first device started to the last one finished.
+    """
+    __slots__ = ()
+
+    @property
+    def device_time(self):
+        """ Seconds spent on all the devices, as if they ran one after another """
+        return sum(i.elapsed for i in self.results)
+
+    @property
+    def longest(self):
+        return max([i.elapsed for i in self.results] or [0])
+
+    @property
+    def failed(self):
+        return [i for i in self.results if not i.ok]
+
+
+def run_background_operation(dev_names, open_device, operation, jobs=DEFAULT_JOBS, timeout=None, on_result=None):
+    """
+    Run a background operation on many devices, at most jobs devices at the same time.
+
+    :param open_device: open_device(dev_name) returns a CXLMemDevice
+    :param operation: operation(cxl_device) runs the operation, e.g. scan_media or sanitize,
+    and returns a BackgroundResult
+    :param timeout: per-device timeout in seconds
+    :param on_result: on_result(DeviceResult) is called for each device as it finishes, in
+    the order of dev_names
+    :return: a FleetReport
+    """
+    start = time.monotonic()
+    results = []
+    for result in run_on_devices(dev_names, lambda dev_name: operation(open_device(dev_name)), jobs, timeout):
+        results.append(result)
+        if on_result is not None:
+            on_result(result)
+    return FleetReport(results, time.monotonic() - start)
@@ -0,0 +1,49 @@
+import shlex
+import threading
+
+
+class CXLDevicePool(object):
+    """
+    Keep one CXLMemDevice open per device, and hand it out again on the next
+    command instead of opening the device node for every command.
+    """
+    def __init__(self, open_device):
+        """
+        :param open_device: open_device(dev_name, use_cache) returns a new CXLMemDevice
+        """
+        self._open_device = open_device
+        self._devices = {}
+        self._lock = threading.Lock()
+
+    def get(self, dev_name, use_cache=False):
+        key = (dev_name, bool(use_cache))
+        with self._lock:
+            cxl_device = self._devices.get(key)
+        if cxl_device is None:
+            cxl_device = self._open_device(dev_name, use_cache)
+            with self._lock:
+                cxl_device = self._devices.setdefault(key, cxl_device)
+        return cxl_device
+
+    def __len__(self):
+        return len(self._devices)
+
+    def close(self):
+        with self._lock:
+            devices, self._devices = self._devices, {}
+        for cxl_device in devices.values():
+            cxl_device.close()
+
+
+def iter_batch_commands(f):
+    """
+    Read a batch script, one command per line in the sub-command syntax, '#'
+    starts a comment.
+
+    :return: a generator yielding (line number, the line, the argument list)
+    """
+    for line_no, line in enumerate(f, 1):
+        line = line.strip()
+        argv = shlex.split(line, comments=True)
+        if argv:
+            yield line_no, line, argv
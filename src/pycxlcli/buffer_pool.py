@@ -0,0 +1,81 @@
+import threading
+from contextlib import contextmanager
+from ctypes import c_uint8, sizeof, memset, addressof
+
+
+class CommandBufferPool(object):
+    """
+    Pool of preallocated ctypes command structures and payload buffers, reused
+    across commands instead of allocating new ones for every command.
+
+    Buffers are kept per ctypes type, and cleared to zero when they are handed out
+    again. The pool tracks the high-water mark of the buffers in use at the same time.
+    """
+    def __init__(self):
+        self._free = {}
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._in_use_bytes = 0
+        self._high_water_mark = 0
+        self._high_water_mark_bytes = 0
+        self._allocated = 0
+
+    def acquire(self, ctype):
+        """
+        Get a zeroed buffer of ctype, release() it after use.
+        """
+        size = sizeof(ctype)
+        with self._lock:
+            free = self._free.get(ctype)
+            buf = free.pop() if free else None
+            self._in_use += 1
+            self._in_use_bytes += size
+            self._high_water_mark = max(self._high_water_mark, self._in_use)
+            self._high_water_mark_bytes = max(self._high_water_mark_bytes, self._in_use_bytes)
+            if buf is None:
+                self._allocated += 1
+        if buf is None:
+            buf = ctype()
+        else:
+            memset(addressof(buf), 0, size)
+        return buf
+
+    def acquire_payload(self, size):
+        """
+        Get a zeroed payload buffer of size bytes(a c_uint8 array).
+        """
+        return self.acquire(c_uint8 * size)
+
+    def release(self, buf):
+        with self._lock:
+            self._in_use -= 1
+            self._in_use_bytes -= sizeof(buf)
+            self._free.setdefault(type(buf), []).append(buf)
+
+    @contextmanager
+    def borrow(self, ctype):
+        """
+        with pool.borrow(cxl_send_command) as cmd: ...
+        """
+        buf = self.acquire(ctype)
+        try:
+            yield buf
+        finally:
+            self.release(buf)
+
+    @property
+    def stats(self):
+        """
+        in_use/in_use_bytes: buffers handed out now.
+
+        high_water_mark/high_water_mark_bytes: the most buffers handed out at the same time.
+
+        allocated: buffers ever created by the pool.
+        """
+        with self._lock:
+            return {"in_use": self._in_use,
+                    "in_use_bytes": self._in_use_bytes,
+                    "high_water_mark": self._high_water_mark,
+                    "high_water_mark_bytes": self._high_water_mark_bytes,
+                    "allocated": self._allocated,
+                    }
@@ -0,0 +1,244 @@
+import time
+import threading
+from .linux_cxl_ioctl import (
+    cxl_mem_command_ioctl,
+    cxl_mem_command_id,
+    cxl_command_names,
+    )
+
+## Latency histogram buckets: bucket i counts the latencies in [2^(i-1), 2^i) microseconds,
+## bucket 0 those under 1us, the last one everything from about 36 minutes up
+HISTOGRAM_BUCKETS = 32
+
+_QUERY_COMMANDS = cxl_mem_command_ioctl.CXL_MEM_QUERY_COMMANDS.value
+_SEND_COMMAND = cxl_mem_command_ioctl.CXL_MEM_SEND_COMMAND.value
+
+
+class LatencyHistogram(object):
+    """
+    Power of two latency histogram, adding a sample is a bit_length() and an increment.
+    """
+    __slots__ = ("buckets", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.buckets = [0] * HISTOGRAM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+
+    def add(self, elapsed):
+        """
+        :param elapsed: seconds
+        """
+        self.buckets[min(int(elapsed * 1e6).bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += elapsed
+        if self.min is None or elapsed < self.min:
+            self.min = elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    @staticmethod
+    def bucket_upper_bound(index):
+        """ The upper bound of a bucket in seconds """
+        return (1 << index) / 1e6
+
+    def percentile(self, p):
+        """
+        The upper bound of the bucket holding the p-th percentile(0-100), capped by
+        the largest sample, 0 if empty.
+        """
+        if not self.count:
+            return 0.0
+        rank = max(1, int(self.count * p / 100.0 + 0.5))
+        seen = 0
+        for index, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return min(LatencyHistogram.bucket_upper_bound(index), self.max)
+        return self.max
+
+    def to_dict(self):
+        return {"count": self.count,
+                "total": self.total,
+                "min": self.min or 0.0,
+                "max": self.max,
+                "mean": self.mean,
+                "p50": self.percentile(50),
+                "p99": self.percentile(99),
+                "buckets": {"%g" % LatencyHistogram.bucket_upper_bound(i): n for i, n in enumerate(self.buckets) if n},
+                }
+
+
+class CommandCounters(object):
+    """
+    The latency histogram, the ioctl errors by errno and the non-zero mailbox
+    return codes of one command.
+    """
+    __slots__ = ("latency", "errors", "retvals")
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.errors = {}
+        self.retvals = {}
+
+    @property
+    def failed(self):
+        return sum(self.errors.values()) + sum(self.retvals.values())
+
+
+def get_command_key(op, cmd):
+    """
+    The name statistics of an ioctl are kept under: the command name of
+    CXL_MEM_SEND_COMMAND, with the opcode for raw commands.
+    """
+    if op == _SEND_COMMAND:
+        command_id = cmd.id
+        if command_id == cxl_mem_command_id.CXL_MEM_COMMAND_ID_RAW:
+            return "Raw %#06x" % cmd.union.raw.opcode
+        if 0 <= command_id < len(cxl_command_names):
+            return cxl_command_names[command_id]
+        return "Command %d" % command_id
+    if op == _QUERY_COMMANDS:
+        return "Query Commands"
+    return "ioctl %#x" % op
+
+
+class CommandStats(object):
+    """
+    Per-command ioctl statistics and tracing hooks, shared by the devices it is
+    attached to(see InstrumentedTransport).
+
+    Hooks are called around each ioctl on the thread sending it:
+
+        pre_hook(dev_name, op, cmd)
+        post_hook(dev_name, op, cmd, elapsed, error)
+
+    error is the OSError the ioctl raised, None if it succeeded, cmd.retval then
+    holds the mailbox return code. Exceptions raised by hooks propagate to the caller.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._commands = {}
+        self.pre_hooks = []
+        self.post_hooks = []
+
+    def add_pre_hook(self, hook):
+        self.pre_hooks.append(hook)
+
+    def add_post_hook(self, hook):
+        self.post_hooks.append(hook)
+
+    def record(self, op, cmd, elapsed, error=None):
+        key = get_command_key(op, cmd)
+        with self._lock:
+            counters = self._commands.get(key)
+            if counters is None:
+                counters = self._commands[key] = CommandCounters()
+            counters.latency.add(elapsed)
+            if error is not None:
+                counters.errors[error.errno] = counters.errors.get(error.errno, 0) + 1
+            elif op == _SEND_COMMAND and cmd.retval:
+                counters.retvals[cmd.retval] = counters.retvals.get(cmd.retval, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self._commands = {}
+
+    @property
+    def commands(self):
+        """ A snapshot: command name -> CommandCounters """
+        with self._lock:
+            return dict(self._commands)
+
+    def to_dict(self):
+        result = {}
+        for key, counters in sorted(self.commands.items()):
+            entry = counters.latency.to_dict()
+            entry["errors"] = {str(k): v for k, v in counters.errors.items()}
+            entry["retvals"] = {str(k): v for k, v in counters.retvals.items()}
+            result[key] = entry
+        return result
+
+    def format_summary(self):
+        """
+        A table of the commands sent, latencies in microseconds.
+        """
+        lines = ["%-36s %8s %8s %10s %10s %10s %10s" % ("Command", "Count", "Failed", "Mean(us)", "P50(us)", "P99(us)", "Max(us)")]
+        for key, counters in sorted(self.commands.items()):
+            latency = counters.latency
+            lines.append("%-36s %8d %8d %10.1f %10.1f %10.1f %10.1f" % (key[:36], latency.count, counters.failed,
+                                                                      latency.mean * 1e6,
+                                                                      latency.percentile(50) * 1e6,
+                                                                      latency.percentile(99) * 1e6,
+                                                                      latency.max * 1e6))
+        return "\n".join(lines)
+
+
+class InstrumentedTransport(object):
+    """
+    Wrap a transport(LinIOCTLDevice, EmulatedCXLMemdev...) to time each execute()
+    into a CommandStats and call its hooks. Everything else goes to the transport.
+    """
+    def __init__(self, transport, stats, dev_name=None):
+        self._transport = transport
+        self._stats = stats
+        self._dev_name = dev_name
+
+    @property
+    def transport(self):
+        return self._transport
+
+    def execute(self, op, cmd):
+        stats = self._stats
+        for hook in stats.pre_hooks:
+            hook(self._dev_name, op, cmd)
+        start = time.perf_counter()
+        try:
+            result = self._transport.execute(op, cmd)
+        except OSError as e:
+            elapsed = time.perf_counter() - start
+            stats.record(op, cmd, elapsed, e)
+            for hook in stats.post_hooks:
+                hook(self._dev_name, op, cmd, elapsed, e)
+            raise
+        elapsed = time.perf_counter() - start
+        stats.record(op, cmd, elapsed)
+        for hook in stats.post_hooks:
+            hook(self._dev_name, op, cmd, elapsed, None)
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self._transport, name)
+
+
+_command_stats = None
+
+def enable_command_stats(stats=None):
+    """
+    Instrument the devices opened from now on, see CXLMemDevice.open_device().
+    Devices opened while disabled are not instrumented and pay nothing.
+
+    :param stats: the CommandStats to record into, default a new one
+    :return: the CommandStats
+    """
+    global _command_stats
+    _command_stats = stats if stats is not None else CommandStats()
+    return _command_stats
+
+
+def disable_command_stats():
+    global _command_stats
+    _command_stats = None
+
+
+def get_command_stats():
+    """
+    The CommandStats of enable_command_stats(), None if disabled
+    """
+    return _command_stats
@@ -1,4 +1,22 @@
 from ctypes import *
+from functools import lru_cache
+
+
+@lru_cache(maxsize=256)
+def get_variable_length_type(name, header_fields, array_name, array_type, n_entries):
+    """
+    Create(once, later calls return the same type) a packed Structure type made of
+    a fixed header followed by an array of n_entries entries.
+
+    :param name: the name of the structure type
+    :param header_fields: the header _fields_, as a tuple of (name, type) tuples
+    :param array_name: the field name of the array
+    :param array_type: the type of the array entries
+    :param n_entries: the number of array entries
+    """
+    return type(name, (Structure,), {"_fields_": list(header_fields) + [(array_name, array_type * n_entries)],
+                                     "_pack_": 1})
+
 ##
 # struct cxl_command_info {
 #     __u32 id;
@@ -48,19 +66,23 @@ class cxl_command_info(Structure):
 #     __u32 rsvd;
 #     struct cxl_command_info __user commands[];
 # };
+def get_cxl_mem_query_commands_type(n_commands):
+    """
+    The cxl_mem_query_commands type with n_commands entries.
+
+    n_commands:
+    Number of commands in the commands array."
+    """
+    return get_variable_length_type("cxl_mem_query_commands",
+                                    (("n_commands", c_uint32),
+                                     ("rsvd", c_uint32)),
+                                    "commands",
+                                    cxl_command_info,
+                                    n_commands)
+
+
 def get_cxl_mem_query_commands(n_commands):
-    class cxl_mem_query_commands(Structure):
-        """
-        n_commands:
-        Number of commands in the commands array."
-        """
-        _fields_ = [
-            ("n_commands", c_uint32),
-            ("rsvd", c_uint32),
-            ("commands", cxl_command_info * n_commands),
-        ]
-        _pack_ = 1
-    command = cxl_mem_query_commands()
+    command = get_cxl_mem_query_commands_type(n_commands)()
     command.n_commands = n_commands
     return command
 
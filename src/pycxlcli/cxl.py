@@ -1,13 +1,43 @@
 import os
+from collections import namedtuple
 from .linux_device import LinIOCTLDevice
 from .command_structure import (
     get_cxl_mem_query_commands,
     cxl_send_command,
     sizeof,
-    addressof)
+    addressof,
+    cast,
+    c_uint8,
+    c_char,
+    c_char_p,
+    c_void_p,
+    Structure,
+    Union,
+    Array)
+from ctypes import _SimpleCData
+from .buffer_pool import CommandBufferPool
+from . import command_stats
 from .linux_utils import CXLBusInfo
-from .linux_cxl_ioctl import cxl_mem_command_ioctl
+from .linux_cxl_ioctl import (
+    cxl_mem_command_ioctl,
+    cxl_mem_command_id,
+    cxl_mbox_return_codes,
+    CXL_VARIABLE_PAYLOAD_SIZE,
+    CXL_MBOX_CMD_RC_SUCCESS,
+    CXL_MBOX_CMD_RC_BACKGROUND,
+    )
 from .identify_memory_device import cxlmi_cmd_memdev_identify_payload
+from .firmware_management import cxlmi_cmd_get_fw_info_payload
+from .health_info import cxlmi_cmd_get_health_info_payload
+from .background_operation import (
+    cxlmi_cmd_bg_op_status_payload,
+    BackgroundOperationStatusOPCode,
+    )
+from .logs_gcc import (
+    get_supported_logs_payload_type,
+    cxlmi_cmd_get_log_input,
+    cxlmi_supported_log_entry,
+    GetSupportedLogsPayload)
 from pycxlcli.linux_cxl_ioctl import cxl_command_names
 
 
@@ -33,29 +63,120 @@ class cxl_command_info(object):
 
     @property
     def name(self):
-        return cxl_command_names.get(self.id)
+        if 0 <= self.id < len(cxl_command_names):
+            return cxl_command_names[self.id]
 
 def format_structure(structure):
     return ' '.join(["%X" % i for i in bytes(structure)])
 
 
+def get_buffer_address(buf, writable=False):
+    """
+    Get the address and size of a buffer without copying it.
+
+    :param buf: a ctypes instance, or an object supporting the buffer protocol, writable
+    ones(bytearray, memoryview, mmap) are used in place, a read-only one is
+    used in place if it is bytes, else copied.
+    :param writable: the buffer receives data, raise TypeError if it is read-only
+    :return: (address, size, keepalive), keep keepalive referenced while the address is used
+    """
+    if buf is None:
+        return 0, 0, None
+    if isinstance(buf, (_SimpleCData, Structure, Union, Array)):
+        return addressof(buf), sizeof(buf), buf
+    view = memoryview(buf)
+    if writable and view.readonly:
+        raise TypeError("a writable buffer is required, got a read-only %s" % type(buf).__name__)
+    size = view.nbytes
+    if size == 0:
+        return 0, 0, None
+    if not view.readonly:
+        keepalive = (c_char * size).from_buffer(view)
+        return addressof(keepalive), size, keepalive
+    if isinstance(buf, bytes):
+        keepalive = c_char_p(buf)
+        return cast(keepalive, c_void_p).value, size, keepalive
+    keepalive = (c_char * size).from_buffer_copy(view)
+    return addressof(keepalive), size, keepalive
+
+
+class CXLCommandError(RuntimeError):
+    """
+    The device completed a mailbox command with a non-zero return code.
+    """
+    def __init__(self, command_id, retval):
+        super(CXLCommandError, self).__init__("command %s failed, return retval %d(%s)" % (cxl_command_names[command_id],
+                                                                                       retval,
+                                                                                       cxl_mbox_return_codes.get(retval, "unknown")))
+        self.command_id = command_id
+        self.retval = retval
+
+
+class CXLSendResult(namedtuple('CXLSendResult', ['id', 'retval', 'out_size'])):
+    """
+    The outcome of a command sent, owned by the caller.
+
+    id: the command id.
+
+    retval: the mailbox return code.
+
+    out_size: the output payload size.
+    """
+    __slots__ = ()
+
+
 class CXLMemDevice(object):
     dev_path_prefix = "/dev/cxl/"
-    def __init__(self, dev_name: str):
+    ## Output buffer size used for variable length output if payload_max is unknown
+    default_payload_max = 4096
+    ## transport_factory(dev_path) opens the transport of the devices created without
+    ## one, None opens a LinIOCTLDevice
+    transport_factory = None
+    def __init__(self, dev_name: str, metadata_cache=None, transport=None):
+        """
+        :param dev_name: the memory device name, like mem0
+        :param metadata_cache: a DeviceMetadataCache to serve the static metadata(command
+        table, Identify, supported logs) from, None to always ask the device.
+        :param transport: what the ioctls go through, any object with execute(op, cmd) and
+        close() like LinIOCTLDevice(e.g. an EmulatedCXLMemdev), default see transport_factory
+        """
         self._dev_name = dev_name
         self.cxl_bus_info = CXLBusInfo(self._dev_name)
+        self._metadata_cache = metadata_cache
+        self._transport = transport
+        self._cxl_device = None
+        ## Command and payload buffers reused across commands
+        self.buffer_pool = CommandBufferPool()
         #
         self.open_device()
         ##
         self._mailbox_support_cmds = {}
 
     def __del__(self):
-        if self._cxl_device is not None:
+        self.close()
+
+    def close(self):
+        if getattr(self, "_cxl_device", None) is not None:
             self._cxl_device.close()
             self._cxl_device = None
 
     def open_device(self):
-        self._cxl_device = LinIOCTLDevice(self.dev_path)
+        if self._transport is not None:
+            self._cxl_device = self._transport
+        elif CXLMemDevice.transport_factory is not None:
+            self._cxl_device = CXLMemDevice.transport_factory(self.dev_path)
+        else:
+            self._cxl_device = LinIOCTLDevice(self.dev_path)
+        stats = command_stats.get_command_stats()
+        if stats is not None:
+            self._cxl_device = command_stats.InstrumentedTransport(self._cxl_device, stats, self._dev_name)
+
+    @property
+    def transport(self):
+        """ The opened transport, a LinIOCTLDevice by default """
+        if isinstance(self._cxl_device, command_stats.InstrumentedTransport):
+            return self._cxl_device.transport
+        return self._cxl_device
 
     def execute(self, op_code, cmd, check_retval=False, raise_on_error=False):
         if self._cxl_device:
@@ -68,14 +189,66 @@ class CXLMemDevice(object):
         else:
             raise RuntimeError("Open device firstly")
 
+    def _get_cached_metadata(self, key):
+        if self._metadata_cache is not None:
+            return self._metadata_cache.get(self.cxl_bus_info.serial,
+                                            self.cxl_bus_info.firmware_version,
+                                            key)
+
+    def _put_cached_metadata(self, key, value):
+        if self._metadata_cache is not None:
+            self._metadata_cache.put(self.cxl_bus_info.serial,
+                                     self.cxl_bus_info.firmware_version,
+                                     key,
+                                     value)
+
     def _device_query_commands(self):
-        cmd = self.cxl_mem_query_commands(0)
-        if cmd.n_commands > 0:
-            n_commands = cmd.n_commands
-            cmd = self.cxl_mem_query_commands(n_commands)
-            for i in cmd.commands:
-                if i.id != 0:
-                    self._mailbox_support_cmds[i.id] = cxl_command_info(i)
+        cmd = self.get_query_commands()
+        for i in cmd.commands:
+            if i.id != 0:
+                self._mailbox_support_cmds[i.id] = cxl_command_info(i)
+
+    @property
+    def supported_commands(self):
+        """
+        The commands supported by both the driver and the device, command id -> cxl_command_info
+        """
+        if not self._mailbox_support_cmds:
+            self._device_query_commands()
+        return self._mailbox_support_cmds
+
+    def get_query_commands(self, n_commands=0, use_cache=True):
+        """
+        Like cxl_mem_query_commands, but n_commands of 0 returns all the commands, and
+        the command table is served from the metadata cache if possible.
+        """
+        commands = self._get_cached_metadata("commands") if use_cache else None
+        if commands is None:
+            if n_commands == 0:
+                cmd = self.cxl_mem_query_commands(self.cxl_mem_query_commands(0).n_commands)
+                self._put_cached_metadata("commands", [(i.id, i.flags, i.size_in, i.size_out) for i in cmd.commands])
+                return cmd
+            return self.cxl_mem_query_commands(n_commands)
+        if n_commands == 0 or n_commands > len(commands):
+            n_commands = len(commands)
+        cmd = get_cxl_mem_query_commands(n_commands)
+        for i, (cmd_id, flags, size_in, size_out) in enumerate(commands[:n_commands]):
+            cmd.commands[i].id = cmd_id
+            cmd.commands[i].flags = flags
+            cmd.commands[i].size_in = size_in
+            cmd.commands[i].size_out = size_out
+        return cmd
+
+    @property
+    def payload_max(self):
+        """
+        The maximum mailbox payload size of the device
+        """
+        return self.cxl_bus_info.payload_max or CXLMemDevice.default_payload_max
+
+    @property
+    def dev_name(self):
+        return self._dev_name
 
     @property
     def dev_path(self):
@@ -86,7 +259,28 @@ class CXLMemDevice(object):
         self._cxl_device.execute(cxl_mem_command_ioctl.CXL_MEM_QUERY_COMMANDS.value, cmd)
         return cmd
 
+    def _send_ioctl(self, command_id, in_addr=0, in_size=0, out_addr=0, out_size=0, opcode=None):
+        """
+        Send a command through a cxl_send_command borrowed from the buffer pool for the
+        ioctl only, so threads sharing the device do not share it.
+
+        :return: a CXLSendResult
+        """
+        with self.buffer_pool.borrow(cxl_send_command) as cmd:
+            cmd.id = command_id
+            if opcode is not None:
+                cmd.union.raw.opcode = opcode
+            getattr(cmd, "in").size = in_size
+            getattr(cmd, "in").payload = in_addr
+            cmd.out.size = out_size
+            cmd.out.payload = out_addr
+            self._cxl_device.execute(cxl_mem_command_ioctl.CXL_MEM_SEND_COMMAND.value, cmd)
+            return CXLSendResult(cmd.id, cmd.retval, cmd.out.size)
+
     def identify(self, data_buffer):
+        """
+        :return: the cxl_send_command, a new one owned by the caller
+        """
         cmd = cxl_send_command()
         cmd.id = 0x0001
         cmd.flags = 0x0001
@@ -94,3 +288,184 @@ class CXLMemDevice(object):
         cmd.out.payload = addressof(data_buffer)
         self._cxl_device.execute(cxl_mem_command_ioctl.CXL_MEM_SEND_COMMAND.value, cmd)
         return cmd
+
+    def get_identify(self, use_cache=True):
+        """
+        Return the Identify payload(cxlmi_cmd_memdev_identify_payload), served from
+        the metadata cache if possible.
+
+        :return: the payload, raise CXLCommandError if the device returned an error
+        """
+        cached = self._get_cached_metadata("identify") if use_cache else None
+        if cached is not None:
+            return cxlmi_cmd_memdev_identify_payload.from_buffer_copy(bytes.fromhex(cached))
+        data_buffer = cxlmi_cmd_memdev_identify_payload()
+        cmd = self.identify(data_buffer)
+        if cmd.retval != 0:
+            raise CXLCommandError(cmd.id, cmd.retval)
+        self._put_cached_metadata("identify", bytes(data_buffer).hex())
+        return data_buffer
+
+    def get_supported_logs(self, use_cache=True):
+        """
+        Send Get Supported Logs, served from the metadata cache if possible.
+
+        :return: a list of (uuid in hex, log size), raise CXLCommandError if the device
+        returned an error
+        """
+        cached = self._get_cached_metadata("supported_logs") if use_cache else None
+        if cached is not None:
+            return [tuple(i) for i in cached]
+        out_size = self.payload_max
+        with self.buffer_pool.borrow(c_uint8 * out_size) as data_buffer:
+            cmd = self._send_ioctl(cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_SUPPORTED_LOGS,
+                                   out_addr=addressof(data_buffer), out_size=out_size)
+            if cmd.retval != 0:
+                raise CXLCommandError(cmd.id, cmd.retval)
+            n_entries = min(GetSupportedLogsPayload.from_buffer(data_buffer).num_supported_log_entries,
+                            (out_size - GetSupportedLogsPayload.entries.offset) // sizeof(cxlmi_supported_log_entry))
+            payload = get_supported_logs_payload_type(n_entries).from_buffer(data_buffer)
+            result = [(bytes(i.uuid).hex(), i.log_size) for i in payload.entries]
+        self._put_cached_metadata("supported_logs", result)
+        return result
+
+    def send(self, command_id, in_buf=None, out_buf=None, opcode=None, check_retval=True, validate=True):
+        """
+        Send any command of cxl_mem_command_id.
+
+        The input and output buffers are passed to the driver in place: any ctypes
+        instance or writable buffer(bytearray, memoryview, mmap) works, including a
+        slice of a bigger buffer.
+
+        :param command_id: the command id, CXL_MEM_COMMAND_ID_RAW to send opcode
+        :param in_buf: the input payload, None if no input
+        :param out_buf: the buffer receiving the output payload, None if no output, raise
+        TypeError if it is read-only
+        :param opcode: the mailbox opcode of a raw command
+        :param check_retval: raise CXLCommandError if the device completed the command with
+        an error(a background command started is not an error)
+        :param validate: check the command is supported and the payload sizes against the
+        command table and payload_max before the ioctl, raise ValueError if not
+        :return: a CXLSendResult, its out_size is the output payload size
+        """
+        in_addr, in_size, in_keepalive = get_buffer_address(in_buf)
+        out_addr, out_size, out_keepalive = get_buffer_address(out_buf, writable=True)
+        if validate:
+            self._validate_send(command_id, in_size, out_size)
+        cmd = self._send_ioctl(command_id, in_addr, in_size, out_addr, min(out_size, self.payload_max), opcode)
+        if check_retval and cmd.retval not in (CXL_MBOX_CMD_RC_SUCCESS, CXL_MBOX_CMD_RC_BACKGROUND):
+            raise CXLCommandError(command_id, cmd.retval)
+        return cmd
+
+    def _validate_send(self, command_id, in_size, out_size):
+        info = self.supported_commands.get(command_id)
+        if info is None:
+            raise ValueError("command %d is not supported by %s" % (command_id, self._dev_name))
+        if in_size > self.payload_max:
+            raise ValueError("input payload %d bytes exceeds payload_max %d" % (in_size, self.payload_max))
+        if info.size_in != CXL_VARIABLE_PAYLOAD_SIZE and in_size != info.size_in:
+            raise ValueError("command %s takes %d input bytes, got %d" % (info.name, info.size_in, in_size))
+        if info.size_out != CXL_VARIABLE_PAYLOAD_SIZE and out_size < info.size_out:
+            raise ValueError("command %s returns %d output bytes, buffer has %d" % (info.name, info.size_out, out_size))
+
+    def iter_chunks(self, command_id, make_input, out_buf, chunk_size=None, opcode=None):
+        """
+        Read len(out_buf) bytes with a command taking an (offset, length) input, like
+        Get Log or Get LSA, in chunks of at most payload_max bytes, each chunk goes
+        straight into its slice of out_buf.
+
+        :param make_input: make_input(offset, length) returns the input payload of a chunk
+        :param out_buf: a writable buffer, raise TypeError if it is read-only
+        :param chunk_size: the chunk size, default payload_max
+        :return: a generator yielding (offset, memoryview of the chunk) as each chunk arrives
+        """
+        view = memoryview(out_buf).cast('B')
+        if view.readonly:
+            raise TypeError("a writable buffer is required, got a read-only %s" % type(out_buf).__name__)
+        chunk_size = min(chunk_size or self.payload_max, self.payload_max)
+        offset = 0
+        while offset < view.nbytes:
+            length = min(chunk_size, view.nbytes - offset)
+            chunk = view[offset:offset+length]
+            cmd = self.send(command_id, make_input(offset, length), chunk, opcode)
+            yield offset, chunk[:cmd.out_size]
+            offset += length
+
+    def read_chunked(self, command_id, make_input, out_buf, chunk_size=None, opcode=None):
+        """
+        iter_chunks() until out_buf is filled.
+
+        :return: the number of bytes read
+        """
+        total = 0
+        for _, chunk in self.iter_chunks(command_id, make_input, out_buf, chunk_size, opcode):
+            total += chunk.nbytes
+        return total
+
+    def iter_log(self, uuid, log_size=None, chunk_size=None):
+        """
+        Read a log by Get Log, in chunks of at most payload_max bytes.
+
+        Only one chunk buffer is used for the whole log, each yielded chunk is only
+        valid until the next one is requested.
+
+        :param uuid: the log uuid, hex string
+        :param log_size: the log size, default the size reported by Get Supported Logs
+        :param chunk_size: the chunk size, default payload_max
+        :return: a generator yielding a memoryview of each chunk
+        """
+        if log_size is None:
+            log_size = dict(self.get_supported_logs()).get(uuid)
+            if log_size is None:
+                raise ValueError("log %s is not supported by %s" % (uuid, self._dev_name))
+        chunk_size = min(chunk_size or self.payload_max, self.payload_max)
+        in_buf = self.buffer_pool.acquire(cxlmi_cmd_get_log_input)
+        out_buf = self.buffer_pool.acquire_payload(chunk_size)
+        try:
+            in_buf.uuid[:] = bytes.fromhex(uuid)
+            view = memoryview(out_buf).cast('B')
+            offset = 0
+            while offset < log_size:
+                in_buf.offset = offset
+                in_buf.length = min(chunk_size, log_size - offset)
+                cmd = self.send(cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_LOG, in_buf, view[:in_buf.length])
+                if cmd.out_size == 0:
+                    break
+                offset += cmd.out_size
+                yield view[:cmd.out_size]
+        finally:
+            self.buffer_pool.release(in_buf)
+            self.buffer_pool.release(out_buf)
+
+    def get_fw_info(self):
+        """
+        Send Get FW Info.
+
+        :return: a cxlmi_cmd_get_fw_info_payload
+        """
+        data_buffer = cxlmi_cmd_get_fw_info_payload()
+        self.send(cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_FW_INFO, None, data_buffer)
+        return data_buffer
+
+    def get_health_info(self):
+        """
+        Send Get Health Info.
+
+        :return: a cxlmi_cmd_get_health_info_payload
+        """
+        data_buffer = cxlmi_cmd_get_health_info_payload()
+        self.send(cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_HEALTH_INFO, None, data_buffer)
+        return data_buffer
+
+    def get_background_status(self):
+        """
+        Send Background Operation Status by the raw command.
+
+        :return: a cxlmi_cmd_bg_op_status_payload
+        """
+        data_buffer = cxlmi_cmd_bg_op_status_payload()
+        self.send(cxl_mem_command_id.CXL_MEM_COMMAND_ID_RAW,
+                  None,
+                  data_buffer,
+                  opcode=BackgroundOperationStatusOPCode)
+        return data_buffer
@@ -1,17 +1,15 @@
 import os
 import sys
+import time
 import argparse
-from pycxlcli.cxl import CXLMemDevice
-from pycxlcli.linux_utils import (
-    get_cxl_mem_name,
-    get_cxl_dev_bdf_by_name,
-    CXLBusInfo,
-    PCIBusInfo,
-    )
-from pycxlcli.linux_cxl_ioctl import cxl_command_names
-from pycxlcli.identify_memory_device import cxlmi_cmd_memdev_identify_payload
+## Only the light modules are imported here, each sub-command imports what it needs
+from pycxlcli.parallel import DEFAULT_JOBS
+from pycxlcli.get_log import compression_table
 from pycxlcli.__version__ import version
 
+## -o/--output-format choices
+output_format_choices = ("text", "json", "ndjson", "csv")
+
 return_code_table = {
     0: "success",
     1: "NOT_SUPPORTED",
@@ -35,87 +33,808 @@ def get_human_size(value: int):
             target_value = value
     return "%d %s" % (target_value, target_unit)
 
+def _get_dev_name(device: str):
+    """
+    Accept both a device name(mem0) and a device path(/dev/cxl/mem0)
+    """
+    return os.path.basename(device.rstrip("/"))
+
+def _get_target_devices(args):
+    from pycxlcli.linux_utils import get_cxl_mem_name
+    if args.all:
+        return sorted(get_cxl_mem_name())
+    return [_get_dev_name(i) for i in args.device]
+
+def _run_per_device(args, worker, printer, device_timeout=True):
+    """
+    Run worker(dev_name) on all the target devices in parallel, and print
+    the results in the order of the target devices by printer(dev_name, value),
+    which returns the return code of the device.
+
+    :param device_timeout: give up on a device after args.timeout seconds, its worker
+    is abandoned, not stopped
+    """
+    from pycxlcli.cxl import CXLMemDevice
+    from pycxlcli.parallel import run_on_devices
+    dev_names = _get_target_devices(args)
+    if not dev_names:
+        print ("No device specified, give a device or use --all")
+        return 2
+    ret = 0
+    for result in run_on_devices(dev_names, worker, args.jobs, args.timeout if device_timeout else None):
+        if len(dev_names) > 1:
+            print ("%s:" % os.path.join(CXLMemDevice.dev_path_prefix, result.dev_name))
+        if isinstance(result.error, FileNotFoundError):
+            print ("Device %s not exist" % result.dev_name)
+            ret = max(ret, 3)
+        elif result.error is not None:
+            print ("Failed to execute on device %s: %s" % (result.dev_name, result.error))
+            ret = 255
+        else:
+            ret = max(ret, printer(result.dev_name, result.value) or 0)
+        if len(dev_names) > 1:
+            print ("")
+    return ret
+
+def _write_records(args, worker, to_records, fieldnames=None, dev_names=None):
+    """
+    Machine readable counterpart of _run_per_device: write the records of each
+    device in args.format as soon as the device is done. to_records(dev_name, value)
+    returns (return code, list of records), a failed device gives a record with an
+    error.
+    """
+    from pycxlcli.output_format import get_record_writer
+    from pycxlcli.parallel import run_on_devices
+    if dev_names is None:
+        dev_names = _get_target_devices(args)
+        if not dev_names:
+            print ("No device specified, give a device or use --all")
+            return 2
+    writer = get_record_writer(args.format, sys.stdout, fieldnames)
+    ret = 0
+    try:
+        for result in run_on_devices(dev_names, worker, args.jobs, args.timeout):
+            if isinstance(result.error, FileNotFoundError):
+                writer.write({"device": result.dev_name, "error": "device not exist"})
+                ret = max(ret, 3)
+            elif result.error is not None:
+                writer.write({"device": result.dev_name, "error": str(result.error)})
+                ret = 255
+            else:
+                rc, records = to_records(result.dev_name, result.value)
+                for record in records:
+                    writer.write(record)
+                ret = max(ret, rc)
+            writer.flush()
+    finally:
+        writer.close()
+    return ret
+
+## The CXLDevicePool of the batch sub-command, devices are opened per command without it
+_device_pool = None
+
+def _open_cxl_device(dev_name, use_cache=False):
+    from pycxlcli.cxl import CXLMemDevice
+    from pycxlcli.metadata_cache import get_default_metadata_cache
+    dev_path = os.path.join(CXLMemDevice.dev_path_prefix, dev_name)
+    if not os.path.exists(dev_path):
+        raise FileNotFoundError(dev_path)
+    if _device_pool is not None:
+        return _device_pool.get(dev_name, use_cache)
+    return CXLMemDevice(dev_name, get_default_metadata_cache() if use_cache else None)
+
 def list_cxl_devices(args):
     """
     List all CXL devices on the system"
     """
+    from pycxlcli.cxl import CXLMemDevice
+    from pycxlcli.linux_utils import get_cxl_mem_name, CXLBusInfo
+    from pycxlcli.parallel import run_on_devices
     print_format = "%-16s %-15s %-20s %s"
     if args.type == "cxl_memdev":
+        def worker(cxl_dev_name):
+            cxl_bus_info = CXLBusInfo(cxl_dev_name)
+            if not os.path.isdir(cxl_bus_info.bus_info_path):
+                raise FileNotFoundError(cxl_bus_info.bus_info_path)
+            return (cxl_bus_info.uevent.get("DEVTYPE") or "unknown",
+                    cxl_bus_info.pmem_size,
+                    cxl_bus_info.ram_size,
+                    cxl_bus_info.firmware_version)
+        dev_names = [_get_dev_name(i) for i in args.device] or sorted(get_cxl_mem_name())
+        if args.format != "text":
+            def to_records(dev_name, value):
+                dev_type, pmem_size, ram_size, firmware_version = value
+                return 0, [{"device": dev_name,
+                            "node": os.path.join(CXLMemDevice.dev_path_prefix, dev_name),
+                            "type": dev_type,
+                            "pmem_size": pmem_size,
+                            "ram_size": ram_size,
+                            "firmware_version": firmware_version,
+                            }]
+            fieldnames = ["device", "node", "type", "pmem_size", "ram_size", "firmware_version", "error"]
+            return _write_records(args, worker, to_records, fieldnames, dev_names)
         print_format = "%-16s %-15s %-20s %s"
         print (print_format % ("Node", "Type", "Size(pmem/mem)", "FW Ver"))
         print (print_format % ("-"*16, "-"*15, "-"*20, "-"*20))
-        for cxl_dev_name in get_cxl_mem_name():
-            cxl_bus_info = CXLBusInfo(cxl_dev_name)
-            print (print_format % ("/dev/cxl/%s" % cxl_dev_name, 
-                                cxl_bus_info.uevent.get("DEVTYPE") if cxl_bus_info.uevent.get("DEVTYPE") else "unknown", 
-                                " %-7s /  %-7s" % (get_human_size(cxl_bus_info.pmem_size), get_human_size(cxl_bus_info.ram_size)), 
-                                cxl_bus_info.firmware_version))
+        ret = 0
+        for result in run_on_devices(dev_names, worker, args.jobs, args.timeout):
+            if isinstance(result.error, FileNotFoundError):
+                print ("Device %s not exist" % result.dev_name)
+                ret = 3
+                continue
+            elif result.error is not None:
+                print ("Failed to list device %s: %s" % (result.dev_name, result.error))
+                ret = 255
+                continue
+            dev_type, pmem_size, ram_size, firmware_version = result.value
+            print (print_format % ("/dev/cxl/%s" % result.dev_name, 
+                                dev_type, 
+                                " %-7s /  %-7s" % tuple(get_human_size(i) if i is not None else "N/A" for i in (pmem_size, ram_size)), 
+                                firmware_version))
     else:
         print ("Only support cxl_memdev type for now")
         return 3
-    return 0
+    return ret
 
 def query_commands(args):
-    if not os.path.exists(args.device):
-        print ("Device %s not exist" % args.device)
-        return 3
-    cxl_device = CXLMemDevice(args.device)
-    n_commands = args.number
-    if args.number == 0:
-        cmd = cxl_device.cxl_mem_query_commands(0)
-        n_commands = cmd.n_commands
-    print ("Command support:", n_commands)
-    print ("")
-    cmd = cxl_device.cxl_mem_query_commands(n_commands)
-    print_format = "%-3s %-30s flags(%-12s|%-9s)   %-12s %s"
-    print (print_format % ("ID", "Name", "USER_ENABLED", "EXCLUSIVE", "size_in", "size_out"))
-    for i in cmd.commands:
-        if i.id != 0:
-            print (print_format % (i.id,
-                                cxl_command_names[i.id],
-                                i.flags & 0x01,
-                                i.flags & 0x02,
-                                "%#x" % i.size_in,
-                                "%#x" % i.size_out
-                                )
-                )
+    from pycxlcli.linux_cxl_ioctl import cxl_command_names
+    def worker(dev_name):
+        cxl_device = _open_cxl_device(dev_name, not args.no_cache)
+        return cxl_device.get_query_commands(args.number, not args.no_cache)
+    def printer(dev_name, cmd):
+        print ("Command support:", cmd.n_commands)
+        print ("")
+        print_format = "%-3s %-30s flags(%-12s|%-9s)   %-12s %s"
+        print (print_format % ("ID", "Name", "USER_ENABLED", "EXCLUSIVE", "size_in", "size_out"))
+        for i in cmd.commands:
+            if i.id != 0:
+                print (print_format % (i.id,
+                                    cxl_command_names[i.id],
+                                    i.flags & 0x01,
+                                    i.flags & 0x02,
+                                    "%#x" % i.size_in,
+                                    "%#x" % i.size_out
+                                    )
+                    )
+        return 0
+    if args.format != "text":
+        def to_records(dev_name, cmd):
+            return 0, [{"device": dev_name,
+                        "id": i.id,
+                        "name": cxl_command_names[i.id],
+                        "flags": i.flags,
+                        "user_enabled": bool(i.flags & 0x01),
+                        "exclusive": bool(i.flags & 0x02),
+                        "size_in": i.size_in,
+                        "size_out": i.size_out,
+                        } for i in cmd.commands if i.id != 0]
+        fieldnames = ["device", "id", "name", "flags", "user_enabled", "exclusive", "size_in", "size_out", "error"]
+        return _write_records(args, worker, to_records, fieldnames)
+    return _run_per_device(args, worker, printer)
 
 def identify(args):
-    if not os.path.exists(args.device):
+    from pycxlcli.cxl import CXLCommandError
+    from pycxlcli.identify_memory_device import cxlmi_cmd_memdev_identify_payload
+    from pycxlcli.output_format import structure_fields, structure_to_dict
+    def worker(dev_name):
+        cxl_device = _open_cxl_device(dev_name, not args.no_cache)
+        try:
+            return 0, cxl_device.get_identify(not args.no_cache)
+        except CXLCommandError as e:
+            return e.retval, None
+    def printer(dev_name, value):
+        retval, data_buffer = value
+        if retval != 0:
+            print ("Failed to identify device %s, return code %d" % (dev_name, retval))
+            return (retval+3)
+        print ("FW Revision: %s" % data_buffer.fw_revision.decode())
+        print ("Total Capacity: %s" % data_buffer.total_capacity)
+        print ("Volatile Capacity: %s" % data_buffer.volatile_capacity)
+        print ("Persistent Capacity: %s" % data_buffer.persistent_capacity)
+        print ("Partition Align: %s" % data_buffer.partition_align)
+        print ("Info Event Log Size: %s" % data_buffer.info_event_log_size)
+        print ("Warning Event Log Size: %s" % data_buffer.warning_event_log_size)
+        print ("Failure Event Log Size: %s" % data_buffer.failure_event_log_size)
+        print ("Fatal Event Log Size: %s" % data_buffer.fatal_event_log_size)
+        print ("LSA Size: %s" % data_buffer.lsa_size)
+        print ("Poison List Max MER: %s" % ','.join(["%#x" % i for i in data_buffer.poison_list_max_mer]))
+        print ("Inject Poison Limit: %s" % data_buffer.inject_poison_limit)
+        print ("Poison Caps: %s" % data_buffer.poison_caps)
+        print ("QoS Telemetry Caps: %#x" % data_buffer.qos_telemetry_caps)
+        print ("DC Event Log Size: %s" % data_buffer.dc_event_log_size)
+        return 0
+    if args.format != "text":
+        def to_records(dev_name, value):
+            retval, data_buffer = value
+            if retval != 0:
+                return retval+3, [{"device": dev_name, "error": "return code %d" % retval}]
+            record = {"device": dev_name}
+            record.update(structure_to_dict(data_buffer))
+            return 0, [record]
+        fieldnames = ["device"] + structure_fields(cxlmi_cmd_memdev_identify_payload) + ["error"]
+        return _write_records(args, worker, to_records, fieldnames)
+    return _run_per_device(args, worker, printer)
+
+    
+
+def send_command(args):
+    import mmap
+    from pycxlcli.linux_cxl_ioctl import (
+        cxl_mem_command_id,
+        cxl_mbox_return_codes,
+        CXL_VARIABLE_PAYLOAD_SIZE,
+        )
+    dev_name = _get_dev_name(args.device)
+    try:
+        cxl_device = _open_cxl_device(dev_name, not args.no_cache)
+    except FileNotFoundError:
         print ("Device %s not exist" % args.device)
         return 3
-    cxl_device = CXLMemDevice(args.device)
-    data_buffer = cxlmi_cmd_memdev_identify_payload()
-    cmd = cxl_device.identify(data_buffer)
-    if cmd.retval != 0:
-        print ("Failed to identify device %s, return code %d" % (args.device, cmd.retval))
-        return (cmd.retval+3)
-    print ("FW Revision: %s" % data_buffer.fw_revision.decode())
-    print ("Total Capacity: %s" % data_buffer.total_capacity)
-    print ("Volatile Capacity: %s" % data_buffer.volatile_capacity)
-    print ("Persistent Capacity: %s" % data_buffer.persistent_capacity)
-    print ("Partition Align: %s" % data_buffer.partition_align)
-    print ("Info Event Log Size: %s" % data_buffer.info_event_log_size)
-    print ("Warning Event Log Size: %s" % data_buffer.warning_event_log_size)
-    print ("Failure Event Log Size: %s" % data_buffer.failure_event_log_size)
-    print ("Fatal Event Log Size: %s" % data_buffer.fatal_event_log_size)
-    print ("LSA Size: %s" % data_buffer.lsa_size)
-    print ("Poison List Max MER: %s" % ','.join(["%#x" % i for i in data_buffer.poison_list_max_mer]))
-    print ("Inject Poison Limit: %s" % data_buffer.inject_poison_limit)
-    print ("Poison Caps: %s" % data_buffer.poison_caps)
-    print ("QoS Telemetry Caps: %#x" % data_buffer.qos_telemetry_caps)
-    print ("DC Event Log Size: %s" % data_buffer.dc_event_log_size)
+    command_id = args.id
+    if args.opcode is not None:
+        command_id = cxl_mem_command_id.CXL_MEM_COMMAND_ID_RAW
+    elif command_id is None:
+        print ("Give a command id or an opcode")
+        return 2
+    in_buf = None
+    if args.input_file:
+        # A copy-on-write mapping is writable, so it is passed to the driver in place
+        with open(args.input_file, "rb") as f:
+            if os.fstat(f.fileno()).st_size > 0:
+                in_buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    out_size = args.out_size
+    if out_size is None:
+        info = cxl_device.supported_commands.get(command_id)
+        if info is not None and info.size_out != CXL_VARIABLE_PAYLOAD_SIZE:
+            out_size = info.size_out
+        else:
+            out_size = cxl_device.payload_max
+    out_buf = bytearray(out_size)
+    try:
+        cmd = cxl_device.send(command_id,
+                              in_buf,
+                              out_buf,
+                              opcode=args.opcode,
+                              check_retval=False,
+                              validate=not args.force)
+    except ValueError as e:
+        print ("Invalid command: %s" % e)
+        return 2
+    out_view = memoryview(out_buf)[:cmd.out_size]
+    print ("Return code: %#x(%s)" % (cmd.retval, cxl_mbox_return_codes.get(cmd.retval, "unknown")))
+    print ("Output size: %d" % cmd.out_size)
+    if args.output_file:
+        with open(args.output_file, "wb") as f:
+            f.write(out_view)
+    else:
+        for offset in range(0, cmd.out_size, 16):
+            print ("%08x: %s" % (offset, ' '.join(["%02x" % i for i in out_view[offset:offset+16]])))
+    return 0 if cmd.retval in (0, 1) else (cmd.retval+3)
+
+def get_log(args):
+    from pycxlcli.logs_gcc import LogUUIDTable, get_log_uuid
+    from pycxlcli.get_log import save_log
+    if args.list:
+        def worker(dev_name):
+            return _open_cxl_device(dev_name, not args.no_cache).get_supported_logs(not args.no_cache)
+        def printer(dev_name, logs):
+            print_format = "%-32s %-36s %s"
+            print (print_format % ("UUID", "Name", "Size"))
+            for uuid, log_size in logs:
+                print (print_format % (uuid, LogUUIDTable.get(uuid, "unknown"), log_size))
+            return 0
+        return _run_per_device(args, worker, printer)
+    if not args.log or not args.output:
+        print ("Give the log(--log) and the output file(-O)")
+        return 2
+    try:
+        uuid = get_log_uuid(args.log)
+    except ValueError as e:
+        print (e)
+        return 2
+    if len(_get_target_devices(args)) > 1 and "{dev}" not in args.output:
+        print ("Output file must contain {dev} when getting the log from several devices")
+        return 2
+    def worker(dev_name):
+        cxl_device = _open_cxl_device(dev_name, not args.no_cache)
+        return save_log(cxl_device, uuid, args.output.format(dev=dev_name), chunk_size=args.chunk_size)
+    def printer(dev_name, result):
+        print ("Saved %s, %d bytes in %.3fs(%.1f KB/s)" % (result.path,
+                                                         result.size,
+                                                         result.elapsed,
+                                                         result.throughput / 1024))
+        return 0
+    return _run_per_device(args, worker, printer)
+
+def fw_update(args):
+    from pycxlcli.fw_update import update_firmware
+    from pycxlcli.metadata_cache import get_default_metadata_cache
+    if not os.path.isfile(args.file):
+        print ("FW package %s not exist" % args.file)
+        return 2
+    metadata_cache = get_default_metadata_cache()
+    def worker(dev_name):
+        cxl_device = _open_cxl_device(dev_name)
+        return update_firmware(cxl_device,
+                               args.file,
+                               slot=args.slot,
+                               activate=None if args.activate == "none" else args.activate,
+                               resume=not args.no_resume,
+                               metadata_cache=metadata_cache,
+                               timeout=args.timeout)
+    def printer(dev_name, result):
+        print ("Transferred %d/%d bytes%s in %.3fs(%.1f KB/s)%s" % (result.transferred,
+                                                                 result.size,
+                                                                 (", resumed from %d" % result.resumed_from) if result.resumed_from else "",
+                                                                 result.elapsed,
+                                                                 result.throughput / 1024,
+                                                                 ", activated" if result.activated else ""))
+        return 0
+    start = time.monotonic()
+    # An abandoned worker would go on transferring until the process exits and
+    # kills it mid-transfer, args.timeout bounds each part instead
+    ret = _run_per_device(args, worker, printer, device_timeout=False)
+    print ("Total time: %.3fs" % (time.monotonic() - start))
+    return ret
+
+def drain_events(args):
+    from pycxlcli.event_drain import EventDrainDaemon
+    from pycxlcli.output_format import NDJSONWriter
+    dev_names = _get_target_devices(args)
+    if not dev_names:
+        print ("No device specified, give a device or use --all")
+        return 2
+    output = open(args.output, "a") if args.output else sys.stdout
+    daemon = EventDrainDaemon(dev_names,
+                              _open_cxl_device,
+                              NDJSONWriter(output),
+                              min_interval=args.min_interval,
+                              max_interval=args.max_interval,
+                              clear=not args.no_clear,
+                              jobs=args.jobs)
+    failed = []
+    def on_error(result):
+        failed.append(result.dev_name)
+        sys.stderr.write("Failed to drain device %s: %s\n" % (result.dev_name, result.error))
+    try:
+        daemon.run(cycles=1 if args.once else None, on_error=on_error)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 255 if failed else 0
+
+def poison_list(args):
+    from pycxlcli.poison_list import read_poison_list
+    from pycxlcli.media_operations import PoisonSourceNames
+    if args.output and not args.output.endswith((".csv", ".json")):
+        print ("Output file must end with .csv or .json")
+        return 2
+    if args.output and len(_get_target_devices(args)) > 1 and "{dev}" not in args.output:
+        print ("Output file must contain {dev} when getting the poison list of several devices")
+        return 2
+    def worker(dev_name):
+        cxl_device = _open_cxl_device(dev_name, not args.no_cache)
+        store, overflow = read_poison_list(cxl_device, args.start, args.length)
+        if args.merge or args.range:
+            store = store.merged()
+        if args.range:
+            store = store.query(*args.range)
+        if args.output:
+            path = args.output.format(dev=dev_name)
+            with open(path, "w") as f:
+                if path.endswith(".csv"):
+                    store.export_csv(f)
+                else:
+                    store.export_json(f)
+        return store, overflow
+    def printer(dev_name, value):
+        store, overflow = value
+        print ("Media Error Records: %d, %s%s" % (len(store),
+                                                  get_human_size(store.total_bytes),
+                                                  ", list overflowed" if overflow else ""))
+        if not args.output:
+            print_format = "%-18s %-12s %s"
+            print (print_format % ("DPA", "Length", "Source"))
+            for address, length, source in store:
+                print (print_format % ("%#x" % address, "%#x" % length, PoisonSourceNames.get(source, source)))
+        return 0
+    return _run_per_device(args, worker, printer)
+
+def _run_background(args, operation, printer):
+    """
+    Run operation(cxl_device) on the target devices, print each result by
+    printer(dev_name, BackgroundResult), then the wall-clock and device time.
+    """
+    from pycxlcli.cxl import CXLMemDevice
+    from pycxlcli.background_orchestrator import run_background_operation
+    dev_names = _get_target_devices(args)
+    if not dev_names:
+        print ("No device specified, give a device or use --all")
+        return 2
+    rets = []
+    def on_result(result):
+        if len(dev_names) > 1:
+            print ("%s:" % os.path.join(CXLMemDevice.dev_path_prefix, result.dev_name))
+        if isinstance(result.error, FileNotFoundError):
+            print ("Device %s not exist" % result.dev_name)
+            rets.append(3)
+        elif result.error is not None:
+            print ("Failed to execute on device %s: %s" % (result.dev_name, result.error))
+            rets.append(255)
+        else:
+            value = result.value
+            print ("Completed in %.3fs, %d busy retries, %d status polls" % (value.elapsed, value.retries, value.polls))
+            rets.append(printer(result.dev_name, value) or 0)
+        if len(dev_names) > 1:
+            print ("")
+    report = run_background_operation(dev_names, _open_cxl_device, operation, args.jobs, args.timeout, on_result)
+    print ("Wall clock: %.3fs, device time: %.3fs, longest device: %.3fs" % (report.wall_clock,
+                                                                            report.device_time,
+                                                                            report.longest))
+    return max(rets)
+
+def scan_media_cmd(args):
+    from pycxlcli.background_orchestrator import scan_media
+    from pycxlcli.media_operations import PoisonSourceNames
+    if args.output and len(_get_target_devices(args)) > 1 and "{dev}" not in args.output:
+        print ("Output file must contain {dev} when scanning several devices")
+        return 2
+    def operation(cxl_device):
+        return scan_media(cxl_device, args.start, args.length, args.no_event_log, args.timeout)
+    def printer(dev_name, result):
+        store = result.value.merged()
+        print ("Media Error Records: %d, %s" % (len(store), get_human_size(store.total_bytes)))
+        if args.output:
+            with open(args.output.format(dev=dev_name), "w") as f:
+                store.export_csv(f)
+        else:
+            for address, length, source in store:
+                print ("  %#x %#x %s" % (address, length, PoisonSourceNames.get(source, source)))
+        return 0
+    return _run_background(args, operation, printer)
+
+def sanitize_cmd(args):
+    from pycxlcli.background_orchestrator import sanitize
+    if not args.yes:
+        print ("Sanitize erases all the user data, give --yes to go on")
+        return 2
+    return _run_background(args, lambda cxl_device: sanitize(cxl_device, args.timeout), lambda dev_name, result: 0)
+
+def pci_reset(args):
+    from pycxlcli.linux_utils import get_cxl_dev_bdf_by_name, CXLMemBDFIndex
+    from pycxlcli.pci_bulk import bulk_pci_operation, DEFAULT_READY_TIMEOUT
+    if not args.yes:
+        print ("%s interrupts all the traffic of the devices, give --yes to go on" % args.method)
+        return 2
+    bdfs = []
+    for dev_name in _get_target_devices(args):
+        # Take a BDF as is
+        bdf = dev_name if CXLMemBDFIndex.bdf_pattern.fullmatch(dev_name) else get_cxl_dev_bdf_by_name(dev_name)
+        if bdf is None:
+            print ("No PCI device found for %s" % dev_name)
+            return 3
+        if bdf not in bdfs:
+            bdfs.append(bdf)
+    if not bdfs:
+        print ("No device specified, give a device or use --all")
+        return 2
+    start = time.monotonic()
+    ret = 0
+    for result in bulk_pci_operation(bdfs, args.method, args.jobs, args.timeout or DEFAULT_READY_TIMEOUT):
+        if result.error is not None:
+            print ("%s: %s failed: %s" % (result.dev_name, args.method, result.error))
+            ret = 255
+            continue
+        value = result.value
+        print ("%s: %s, ready in %.3fs, memory devices %s" % (value.bdf, value.operation, value.ready_time,
+                                                              " ".join(value.memdevs_after) or "none"))
+    print ("Wall clock: %.3fs" % (time.monotonic() - start))
+    return ret
+
+def export_metrics(args):
+    from pycxlcli.linux_utils import get_cxl_mem_name
+    from pycxlcli.metrics_exporter import (
+        HealthCollector,
+        make_metrics_server,
+        write_textfile,
+        DEFAULT_LISTEN_PORT,
+        )
+    dev_names = [_get_dev_name(i) for i in args.device] or sorted(get_cxl_mem_name())
+    if not dev_names:
+        print ("No CXL memory device found")
+        return 3
+    if args.textfile:
+        on_collected = lambda text: write_textfile(args.textfile, text)
+    elif args.once:
+        on_collected = lambda text: sys.stdout.write(text)
+    else:
+        on_collected = None
+    collector = HealthCollector(dev_names,
+                                _open_cxl_device,
+                                interval=args.interval,
+                                jobs=args.jobs,
+                                timeout=args.timeout,
+                                on_collected=on_collected)
+    if args.once:
+        collector.collect()
+        return 0
+    collector.start()
+    try:
+        if args.textfile:
+            while True:
+                time.sleep(3600)
+        host, _, port = (args.listen or "127.0.0.1:%d" % DEFAULT_LISTEN_PORT).rpartition(":")
+        server = make_metrics_server(collector, host or "127.0.0.1", int(port))
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        collector.stop()
     return 0
 
-    
+def serve(args):
+    import signal
+    from pycxlcli.rpc_server import CXLRPCServer, CXLRPCService, get_default_socket_path
+    service = CXLRPCService(lambda dev_name: _open_cxl_device(dev_name, True), args.request_timeout, args.allow_raw)
+    server = CXLRPCServer(args.socket or get_default_socket_path(), service, args.mode)
+    print ("Serving on %s" % server.socket_path)
+    sys.stdout.flush()
+    # Clean up the socket on SIGTERM too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+def watch_links(args):
+    from pycxlcli.linux_utils import get_cxl_mem_name, get_cxl_dev_bdf_by_name
+    from pycxlcli.pci_watch import watch_links
+    from pycxlcli.output_format import get_record_writer
+    dev_names = [_get_dev_name(i) for i in args.device] or sorted(get_cxl_mem_name())
+    bdf_to_dev = {}
+    for dev_name in dev_names:
+        bdf = get_cxl_dev_bdf_by_name(dev_name)
+        if bdf is None:
+            print ("No PCI device found for %s" % dev_name)
+            return 3
+        bdf_to_dev[bdf] = dev_name
+    if not bdf_to_dev:
+        print ("No CXL memory device found")
+        return 3
+    writer = get_record_writer(args.format, sys.stdout) if args.format != "text" else None
+    print_format = "%-8s %-14s %-11s %-9s %-10s %12s %12s %12s"
+    try:
+        for samples in watch_links(list(bdf_to_dev), args.interval, args.count):
+            if writer is None:
+                print (print_format % ("Device", "BDF", "Speed(GT/s)", "Width", "Link", "Cor/s", "NonFatal/s", "Fatal/s"))
+            for sample in samples:
+                if writer is not None:
+                    record = sample.to_dict()
+                    record["device"] = bdf_to_dev[sample.bdf]
+                    writer.write(record)
+                    continue
+                print (print_format % (bdf_to_dev[sample.bdf],
+                                       sample.bdf,
+                                       "%s/%s" % (sample.link_speed, sample.max_link_speed),
+                                       "x%s/x%s" % (sample.link_width, sample.max_link_width),
+                                       "DOWN" if sample.link_down else "DEGRADED" if sample.degraded else "ok",
+                                       "%.2f" % sample.rates.get("correctable.TOTAL_ERR_COR", 0),
+                                       "%.2f" % sample.rates.get("nonfatal.TOTAL_ERR_NONFATAL", 0),
+                                       "%.2f" % sample.rates.get("fatal.TOTAL_ERR_FATAL", 0)))
+            if writer is not None:
+                writer.flush()
+            else:
+                print ("")
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if writer is not None:
+            writer.close()
+    return 0
+
+def pci_config(args):
+    from pycxlcli.linux_utils import get_cxl_mem_name, get_cxl_dev_bdf_by_name, PCIBusInfo
+    from pycxlcli.pci_config import format_pci_config
+    dev_names = [_get_dev_name(i) for i in args.device] or sorted(get_cxl_mem_name())
+    if not dev_names:
+        print ("No CXL memory device found")
+        return 3
+    def worker(dev_name):
+        bdf = get_cxl_dev_bdf_by_name(dev_name)
+        if bdf is None:
+            raise FileNotFoundError(dev_name)
+        config = PCIBusInfo(bdf).decode_pci_config()
+        if config is None:
+            raise RuntimeError("can not read the configuration space of %s" % bdf)
+        return bdf, config
+    if args.format != "text":
+        def to_records(dev_name, value):
+            bdf, config = value
+            record = {"device": dev_name, "bdf": bdf}
+            record.update(config.to_dict())
+            return 0, [record]
+        return _write_records(args, worker, to_records, dev_names=dev_names)
+    def printer(dev_name, value):
+        bdf, config = value
+        print ("%s %s" % (dev_name, bdf))
+        for line in format_pci_config(config):
+            print ("  " + line)
+        return 0
+    args.all = False
+    args.device = dev_names
+    return _run_per_device(args, worker, printer)
+
+def show_topology(args):
+    import json
+    from pycxlcli.topology import CXLTopology, format_topology
+    topology = CXLTopology().scan()
+    if not len(topology):
+        print ("No CXL device found")
+        return 3
+    if args.memdev:
+        dev_name = _get_dev_name(args.memdev)
+        try:
+            backing = topology.get_backing(dev_name)
+        except KeyError:
+            print ("Device %s not exist" % dev_name)
+            return 3
+        if args.format == "json":
+            print (json.dumps({k: ([i.to_dict(False) for i in v] if isinstance(v, list) else v and v.to_dict(False))
+                               for k, v in backing.items()}, indent=2))
+            return 0
+        print ("Memory device: %s" % backing["memdev"].name)
+        print ("Endpoint: %s" % (backing["endpoint"].name if backing["endpoint"] else "none"))
+        print ("Ports: %s" % (" -> ".join(i.name for i in backing["ports"][1:]) or "none"))
+        print ("Decoders: %s" % (" ".join(i.name for i in backing["decoders"]) or "none"))
+        print ("Regions: %s" % (" ".join(i.name for i in backing["regions"]) or "none"))
+        return 0
+    if args.node and args.node not in topology:
+        print ("Device %s not exist" % args.node)
+        return 3
+    if args.format == "json":
+        print (json.dumps(topology.get(args.node).to_dict() if args.node else topology.to_dict(), indent=2))
+        return 0
+    for line in format_topology(topology, args.node):
+        print (line)
+    return 0
+
+def _parse_dpa_range(value):
+    start, sep, end = value.partition(":")
+    if not sep:
+        raise argparse.ArgumentTypeError("range must be START:END")
+    return int(start, 0), int(end, 0)
 
 def get_ver(args):
     print ("pycxl version: %s" % version)
     return 0
 
-def CXLCli():
+def _add_parallel_arguments(parser):
+    parser.add_argument('-j', '--jobs', type=int, default=DEFAULT_JOBS, help='number of devices to handle in parallel, default %d' % DEFAULT_JOBS)
+    parser.add_argument('--timeout', type=float, default=None, help='per-device timeout in seconds')
+
+def _add_device_arguments(parser):
+    parser.add_argument('device', nargs='*', help='The device path(s) to send command')
+    parser.add_argument('-a', '--all', action='store_true', help='Send command to all the CXL memory devices')
+    parser.add_argument('--no-cache', dest='no_cache', action='store_true', help='Always ask the device, bypass the metadata cache')
+    _add_parallel_arguments(parser)
+
+def _add_output_format_argument(parser):
+    parser.add_argument("-o", "--output-format", dest="format", choices=output_format_choices, default="text", help="Output format, default text")
+
+def _is_long_running(args):
+    """
+    True if the sub-command runs until interrupted, set by long_running in set_defaults,
+    a bool or a function of the arguments.
+    """
+    long_running = getattr(args, "long_running", False)
+    return long_running(args) if callable(long_running) else long_running
+
+def _run_batch_command(parser, argv):
+    """
+    Run one sub-command of a batch with its output captured, the sub-commands running
+    until interrupted(and batch itself) are refused.
+
+    :return: (return code, the captured output, the parsed arguments or None)
+    """
+    import io
+    import contextlib
+    output = io.StringIO()
+    args = None
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        try:
+            args = parser.parse_args(argv)
+            if getattr(args, "func", None) is None:
+                ret = 2
+            elif args.func is batch_commands:
+                print ("batch can not run within batch")
+                ret = 2
+            elif _is_long_running(args):
+                print ("%s runs until interrupted, it can not run within batch" % argv[0])
+                ret = 2
+            else:
+                ret = args.func(args)
+        except SystemExit as e:
+            # Invalid arguments, or the help
+            ret = e.code if isinstance(e.code, int) else 2
+        except Exception as e:
+            print ("Failed: %s" % e)
+            ret = 255
+    return ret or 0, output.getvalue(), args
+
+def _parse_batch_output(args, text):
+    """
+    Decode the output of a sub-command run with -o json or ndjson.
+    """
+    import json
+    output_format = getattr(args, "format", "text")
+    try:
+        if output_format == "json":
+            return json.loads(text)
+        if output_format == "ndjson":
+            return [json.loads(i) for i in text.splitlines() if i]
+    except ValueError:
+        pass
+    return None
+
+def batch_commands(args):
+    global _device_pool
+    from pycxlcli.batch import CXLDevicePool, iter_batch_commands
+    from pycxlcli.cxl import CXLMemDevice
+    from pycxlcli.metadata_cache import get_default_metadata_cache
+    from pycxlcli.output_format import get_record_writer
+    parser = build_parser()
+    try:
+        script = open(args.script, "r") if args.script not in (None, "-") else sys.stdin
+    except OSError as e:
+        print ("Failed to open the script: %s" % e)
+        return 2
+    writer = get_record_writer(args.format, sys.stdout)
+    _device_pool = CXLDevicePool(lambda dev_name, use_cache: CXLMemDevice(dev_name, get_default_metadata_cache() if use_cache else None))
+    ret = 0
+    try:
+        for line_no, line, argv in iter_batch_commands(script):
+            start = time.monotonic()
+            rc, output, cmd_args = _run_batch_command(parser, argv)
+            record = {"line": line_no,
+                      "command": line,
+                      "rc": rc,
+                      "elapsed": time.monotonic() - start,
+                      }
+            result = _parse_batch_output(cmd_args, output) if rc == 0 else None
+            if result is not None:
+                record["result"] = result
+            else:
+                record["output"] = output
+            writer.write(record)
+            writer.flush()
+            if rc != 0:
+                ret = ret or rc
+                if args.stop_on_error:
+                    break
+    finally:
+        writer.close()
+        _device_pool.close()
+        _device_pool = None
+        if script is not sys.stdin:
+            script.close()
+    return ret
+
+def build_parser():
+    """
+    The argument parser of all the sub-commands.
+    """
     # create the top-level parser
     parser = argparse.ArgumentParser(description='CXL CLI to get CXL device information')
+    parser.add_argument('--stats', action='store_true', help='Print the count and latency of each command sent to stderr at exit')
     subparsers = parser.add_subparsers(help='The following are all implemented sub-commands:')
     def get_help(args):
         parser.print_help()
@@ -123,26 +842,167 @@ def CXLCli():
     # create the parser for the "list" command
     parser_list = subparsers.add_parser('list', help='list all CXL devices on the system')
     parser_list.set_defaults(func=list_cxl_devices)
+    parser_list.add_argument('device', nargs='*', help='The devices to list, default all devices')
     parser_list.add_argument("--type", default="cxl_memdev", help="Show devices of specified type")
-    parser_list.add_argument("-o", "--output-format", dest="format", help="Output format")
+    _add_output_format_argument(parser_list)
+    _add_parallel_arguments(parser_list)
     # create the parser for the "query" command
     parser_query = subparsers.add_parser('query-command', help='query commands for CXL devices')
     parser_query.set_defaults(func=query_commands)
-    parser_query.add_argument('device', help='The device path to send command')
+    _add_device_arguments(parser_query)
     parser_query.add_argument('-n', '--number', type=int, default=0, help='number of support commands should return')
+    _add_output_format_argument(parser_query)
     # create the parser for the "identify" command
     parser_query = subparsers.add_parser('identify', help='identify commands for CXL devices')
     parser_query.set_defaults(func=identify)
-    parser_query.add_argument('device', help='The device path to send command')
+    _add_device_arguments(parser_query)
+    _add_output_format_argument(parser_query)
+    # create the parser for the "send" command
+    parser_send = subparsers.add_parser('send', help='send a mailbox command to a CXL device')
+    parser_send.set_defaults(func=send_command)
+    parser_send.add_argument('device', help='The device path to send command')
+    parser_send.add_argument('-i', '--id', type=int, help='command id to send, see query-command')
+    parser_send.add_argument('--opcode', type=lambda x: int(x, 0), help='mailbox opcode to send by the raw command')
+    parser_send.add_argument('--input-file', dest='input_file', help='file holding the input payload')
+    parser_send.add_argument('--out-size', dest='out_size', type=lambda x: int(x, 0), help='size of the output buffer, default size_out of the command or payload_max')
+    parser_send.add_argument('--output-file', dest='output_file', help='write the raw output payload to this file instead of a hex dump')
+    parser_send.add_argument('--force', action='store_true', help='skip the checks of command table and payload sizes')
+    parser_send.add_argument('--no-cache', dest='no_cache', action='store_true', help='Always ask the device, bypass the metadata cache')
+    # create the parser for the "get-log" command
+    parser_log = subparsers.add_parser('get-log', help='get a log from CXL devices')
+    parser_log.set_defaults(func=get_log)
+    _add_device_arguments(parser_log)
+    parser_log.add_argument('-l', '--log', help='the log uuid, or a log name like cel')
+    parser_log.add_argument('-O', '--output', help='the output file, compressed if ends with %s, {dev} is replaced by the device name' % ', '.join(compression_table))
+    parser_log.add_argument('--chunk-size', dest='chunk_size', type=lambda x: int(x, 0), help='bytes per Get Log command, default payload_max')
+    parser_log.add_argument('--list', action='store_true', help='list the supported logs')
+    # create the parser for the "fw-update" command
+    parser_fw = subparsers.add_parser('fw-update', help='transfer and activate FW on CXL devices')
+    parser_fw.set_defaults(func=fw_update, no_cache=True)
+    parser_fw.add_argument('device', nargs='*', help='The device path(s) to update')
+    parser_fw.add_argument('-a', '--all', action='store_true', help='Update all the CXL memory devices')
+    parser_fw.add_argument('-f', '--file', required=True, help='the FW package file')
+    parser_fw.add_argument('-s', '--slot', type=int, help='the FW slot to transfer to, default the first inactive slot')
+    parser_fw.add_argument('--activate', choices=('none', 'online', 'reset'), default='none', help='activate the FW online, or on the next cold reset')
+    parser_fw.add_argument('--no-resume', dest='no_resume', action='store_true', help='start over instead of resuming an interrupted transfer')
+    parser_fw.add_argument('-j', '--jobs', type=int, default=DEFAULT_JOBS, help='number of devices to handle in parallel, default %d' % DEFAULT_JOBS)
+    parser_fw.add_argument('--timeout', type=float, default=None, help='seconds each Transfer FW part and the activation may take at most')
+    # create the parser for the "drain-events" command
+    parser_drain = subparsers.add_parser('drain-events', help='drain the event logs of CXL devices as NDJSON')
+    parser_drain.set_defaults(func=drain_events, long_running=lambda args: not args.once)
+    parser_drain.add_argument('device', nargs='*', help='The device path(s) to drain')
+    parser_drain.add_argument('-a', '--all', action='store_true', help='Drain all the CXL memory devices')
+    parser_drain.add_argument('-O', '--output', help='append the records to this file, default stdout')
+    parser_drain.add_argument('--once', action='store_true', help='drain once and exit')
+    parser_drain.add_argument('--no-clear', dest='no_clear', action='store_true', help='do not clear the records read')
+    parser_drain.add_argument('--min-interval', dest='min_interval', type=float, default=0.1, help='shortest poll interval in seconds when logs are filling, default 0.1')
+    parser_drain.add_argument('--max-interval', dest='max_interval', type=float, default=30.0, help='longest poll interval in seconds when idle, default 30')
+    parser_drain.add_argument('-j', '--jobs', type=int, default=DEFAULT_JOBS, help='number of devices to handle in parallel, default %d' % DEFAULT_JOBS)
+    # create the parser for the "poison-list" command
+    parser_poison = subparsers.add_parser('poison-list', help='get the poison list of CXL devices')
+    parser_poison.set_defaults(func=poison_list)
+    _add_device_arguments(parser_poison)
+    parser_poison.add_argument('--start', type=lambda x: int(x, 0), default=0, help='the first DPA to get, default 0')
+    parser_poison.add_argument('--length', type=lambda x: int(x, 0), help='bytes of DPA to get, default up to the total capacity')
+    parser_poison.add_argument('--merge', action='store_true', help='sort the records and coalesce overlapping ranges')
+    parser_poison.add_argument('--range', type=_parse_dpa_range, help='only show the records overlapping START:END, implies --merge')
+    parser_poison.add_argument('-O', '--output', help='export the records to a .csv or .json file, {dev} is replaced by the device name')
+    # create the parser for the "scan-media" command
+    parser_scan = subparsers.add_parser('scan-media', help='scan the media of CXL devices for errors')
+    parser_scan.set_defaults(func=scan_media_cmd)
+    parser_scan.add_argument('device', nargs='*', help='The device path(s) to scan')
+    parser_scan.add_argument('-a', '--all', action='store_true', help='Scan all the CXL memory devices')
+    parser_scan.add_argument('--start', type=lambda x: int(x, 0), default=0, help='the first DPA to scan, default 0')
+    parser_scan.add_argument('--length', type=lambda x: int(x, 0), help='bytes of DPA to scan, default up to the total capacity')
+    parser_scan.add_argument('--no-event-log', dest='no_event_log', action='store_true', help='do not log the media errors found in the event log')
+    parser_scan.add_argument('-O', '--output', help='export the records to a CSV file, {dev} is replaced by the device name')
+    _add_parallel_arguments(parser_scan)
+    # create the parser for the "sanitize" command
+    parser_sanitize = subparsers.add_parser('sanitize', help='sanitize CXL devices, erasing all the user data')
+    parser_sanitize.set_defaults(func=sanitize_cmd)
+    parser_sanitize.add_argument('device', nargs='*', help='The device path(s) to sanitize')
+    parser_sanitize.add_argument('-a', '--all', action='store_true', help='Sanitize all the CXL memory devices')
+    parser_sanitize.add_argument('-y', '--yes', action='store_true', help='confirm erasing all the user data')
+    _add_parallel_arguments(parser_sanitize)
+    # create the parser for the "pci-reset" command
+    parser_pci_reset = subparsers.add_parser('pci-reset', help='reset, or remove and rescan, the PCI functions of CXL devices')
+    parser_pci_reset.set_defaults(func=pci_reset)
+    parser_pci_reset.add_argument('device', nargs='*', help='The device path(s) or PCI BDF(s) to reset')
+    parser_pci_reset.add_argument('-a', '--all', action='store_true', help='Reset all the CXL memory devices')
+    parser_pci_reset.add_argument('-m', '--method', choices=('reset', 'remove-rescan'), default='reset', help='reset the function, or remove it and rescan its parent, default reset')
+    parser_pci_reset.add_argument('-y', '--yes', action='store_true', help='confirm interrupting the traffic of the devices')
+    parser_pci_reset.add_argument('-j', '--jobs', type=int, default=DEFAULT_JOBS, help='number of devices to handle in parallel, default %d' % DEFAULT_JOBS)
+    parser_pci_reset.add_argument('--timeout', type=float, default=None, help='seconds each device has to be ready again, default 30')
+    # create the parser for the "export" command
+    parser_export = subparsers.add_parser('export', help='export the health metrics of CXL devices for Prometheus')
+    parser_export.set_defaults(func=export_metrics, long_running=lambda args: not args.once)
+    parser_export.add_argument('device', nargs='*', help='The device path(s) to export, default all devices')
+    parser_export.add_argument('--listen', help='serve /metrics on HOST:PORT, default 127.0.0.1:9813')
+    parser_export.add_argument('--textfile', help='write the metrics to this file for the node_exporter textfile collector, instead of serving them')
+    parser_export.add_argument('--interval', type=float, default=15.0, help='seconds between two collections, default 15')
+    parser_export.add_argument('--once', action='store_true', help='collect once, print the metrics(or write the textfile) and exit')
+    _add_parallel_arguments(parser_export)
+    # create the parser for the "watch" command
+    parser_watch = subparsers.add_parser('watch', help='watch the AER error rates and the link state of CXL devices')
+    parser_watch.set_defaults(func=watch_links, long_running=lambda args: args.count is None)
+    parser_watch.add_argument('device', nargs='*', help='The device path(s) to watch, default all devices')
+    parser_watch.add_argument('-i', '--interval', type=float, default=1.0, help='seconds between two samples, default 1')
+    parser_watch.add_argument('-c', '--count', type=int, default=None, help='number of samples, default until interrupted')
+    parser_watch.add_argument("-o", "--output-format", dest="format", choices=("text", "json", "ndjson"), default="text", help="Output format, default text")
+    # create the parser for the "pci-config" command
+    parser_pci_config = subparsers.add_parser('pci-config', help='decode the PCI configuration space of CXL devices')
+    parser_pci_config.set_defaults(func=pci_config)
+    parser_pci_config.add_argument('device', nargs='*', help='The device path(s) to decode, default all devices')
+    parser_pci_config.add_argument("-o", "--output-format", dest="format", choices=("text", "json", "ndjson"), default="text", help="Output format, default text")
+    _add_parallel_arguments(parser_pci_config)
+    # create the parser for the "topology" command
+    parser_topology = subparsers.add_parser('topology', help='show the CXL ports, decoders, regions and memory devices')
+    parser_topology.set_defaults(func=show_topology)
+    parser_topology.add_argument('node', nargs='?', help='show the subtree of this device only, like root0 or port1')
+    parser_topology.add_argument('-m', '--memdev', help='show the endpoint, ports, decoders and regions backing this memory device')
+    parser_topology.add_argument("-o", "--output-format", dest="format", choices=("text", "json"), default="text", help="Output format, default text")
+    # create the parser for the "serve" command
+    parser_serve = subparsers.add_parser('serve', help='serve CXL device queries as JSON-RPC over a Unix socket')
+    parser_serve.set_defaults(func=serve, long_running=True)
+    parser_serve.add_argument('--socket', help='the Unix socket path, default $PYCXL_SOCKET, $XDG_RUNTIME_DIR/pycxl.sock, /run/pycxl.sock for root')
+    parser_serve.add_argument('--mode', type=lambda x: int(x, 8), default=0o660, help='permissions of the socket, default 660')
+    parser_serve.add_argument('--request-timeout', dest='request_timeout', type=float, default=60.0, help='seconds a request waits at most for its device, default 60')
+    parser_serve.add_argument('--allow-raw', dest='allow_raw', action='store_true', help='let clients send any command or raw opcode, default only the commands reading the device')
+    # create the parser for the "batch" command
+    parser_batch = subparsers.add_parser('batch', help='run the sub-commands of a script in one process')
+    parser_batch.set_defaults(func=batch_commands)
+    parser_batch.add_argument('script', nargs='?', help='the script, one sub-command per line, default stdin')
+    parser_batch.add_argument('-o', '--output-format', dest='format', choices=('ndjson', 'json'), default='ndjson', help='Output format of the results, default ndjson')
+    parser_batch.add_argument('--stop-on-error', dest='stop_on_error', action='store_true', help='stop at the first command failing, default run them all')
     # create the parser for the "version" command
     parser_version = subparsers.add_parser('version', help='Shows the program version')
     parser_version.set_defaults(func=get_ver)
     # create the parser for the "help" command
     parser_help = subparsers.add_parser('help', help='Display this help')
     parser_help.set_defaults(func=get_help)
-    ##
+    return parser
+
+def CXLCli():
+    parser = build_parser()
     args = parser.parse_args()
-    if len(sys.argv) > 1:
+    if getattr(args, "func", None) is not None:
+        if not _is_long_running(args):
+            # A one-shot run opens each device once, checking the device node is cheaper
+            # than starting the replug monitor thread and socket
+            from .linux_device import LinIOCTLDevice
+            LinIOCTLDevice.replug_events = False
+        if args.stats:
+            from .command_stats import enable_command_stats
+            stats = enable_command_stats()
+            import atexit
+            atexit.register(lambda: sys.stderr.write(stats.format_summary() + "\n"))
+        n_emulated = os.environ.get("PYCXL_EMULATE")
+        if n_emulated:
+            # Run against N in-process emulated devices, for load testing
+            from .emulated_device import EmulatedCXLBus
+            with EmulatedCXLBus(int(n_emulated)):
+                sys.exit(args.func(args))
         sys.exit(args.func(args))
     else:
-        sys.exit(get_help(args))
+        parser.print_help()
+        sys.exit(0)
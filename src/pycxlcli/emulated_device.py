@@ -0,0 +1,356 @@
+import os
+import time
+import errno
+import random
+import struct
+import tempfile
+import threading
+from ctypes import addressof, memmove, string_at, sizeof
+from .command_structure import cxl_command_info, cxl_send_command
+from .linux_cxl_ioctl import (
+    cxl_mem_command_ioctl,
+    cxl_mem_command_id,
+    cxl_command_opcodes,
+    CXL_MEM_COMMAND_FLAG_ENABLED,
+    CXL_MEM_COMMAND_FLAG_EXCLUSIVE,
+    CXL_VARIABLE_PAYLOAD_SIZE,
+    CXL_MBOX_CMD_RC_SUCCESS,
+    CXL_MBOX_CMD_RC_UNSUPPORTED,
+    )
+from .logs_gcc import LogNameTable
+from .health_info import cxlmi_cmd_get_health_info_payload
+from .identify_memory_device import cxlmi_cmd_memdev_identify_payload
+from .firmware_management import cxlmi_cmd_get_fw_info_payload
+from .media_operations import CXL_CAPACITY_MULTIPLIER, CXL_POISON_FLAG_MORE_RECORDS
+
+V = CXL_VARIABLE_PAYLOAD_SIZE
+## The command table of the kernel driver: id -> (size_in, size_out)
+DefaultCommandSizes = {
+    cxl_mem_command_id.CXL_MEM_COMMAND_ID_IDENTIFY: (0, 0x43),
+    cxl_mem_command_id.CXL_MEM_COMMAND_ID_RAW: (V, V),
+    cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_SUPPORTED_LOGS: (0, V),
+    cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_FW_INFO: (0, 0x50),
+    cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_PARTITION_INFO: (0, 0x20),
+    cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_LSA: (0x8, V),
+    cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_HEALTH_INFO: (0, 0x12),
+    cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_LOG: (0x18, V),
+    cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_POISON: (0x10, V),
+    cxl_mem_command_id.CXL_MEM_COMMAND_ID_SCAN_MEDIA: (0x11, 0),
+    cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_SCAN_MEDIA: (0, V),
+    cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_TIMESTAMP: (0, 0x8),
+    cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_EVENT_RECORD: (0x1, V),
+    cxl_mem_command_id.CXL_MEM_COMMAND_ID_CLEAR_EVENT_RECORD: (V, 0),
+    cxl_mem_command_id.CXL_MEM_COMMAND_ID_TRANSFER_FW: (V, 0),
+    cxl_mem_command_id.CXL_MEM_COMMAND_ID_ACTIVATE_FW: (0x2, 0),
+    cxl_mem_command_id.CXL_MEM_COMMAND_ID_SANITIZE: (0, 0),
+}
+
+## The cxl_send_command.flags the kernel accepts
+CXL_MEM_COMMAND_FLAG_MASK = CXL_MEM_COMMAND_FLAG_ENABLED | CXL_MEM_COMMAND_FLAG_EXCLUSIVE
+
+
+class EmulatedCXLMemdev(object):
+    """
+    In-process stand-in for a CXL memory device node, with the CXL_MEM_QUERY_COMMANDS
+    and CXL_MEM_SEND_COMMAND semantics of the kernel driver: it validates the command
+    id, flags and payload sizes, fails like the ioctl does(OSError with ENOTTY, EINVAL,
+    ENOMEM or EBUSY), then answers the mailbox command from its own state.
+
+    It has the interface of LinIOCTLDevice, pass it as the transport of a CXLMemDevice:
+
+        CXLMemDevice("mem0", transport=EmulatedCXLMemdev("mem0"))
+
+    Identify, Get Supported Logs, Get Log(the CEL and the logs given), Get FW Info,
+    Get Health Info, Get Poison List, Get Timestamp, Get Event Records and Background
+    Operation Status are answered, other enabled commands succeed with no output, raw
+    opcodes the emulator does not know return Unsupported.
+    """
+    def __init__(self,
+                 dev_name="mem0",
+                 payload_max=4096,
+                 commands=None,
+                 exclusive=(),
+                 latency=None,
+                 default_latency=0.0,
+                 busy_rate=0.0,
+                 seed=None,
+                 total_capacity=1 << 30,
+                 fw_revision="EMU-1.0",
+                 logs=None):
+        """
+        :param commands: command id -> (size_in, size_out), default DefaultCommandSizes
+        :param exclusive: the command ids the kernel holds, sending them fails with EBUSY
+        :param latency: mailbox opcode -> seconds each command takes
+        :param default_latency: seconds the other commands take
+        :param busy_rate: probability of a send failing with EBUSY
+        :param seed: the seed of the EBUSY injection
+        :param total_capacity: bytes, a multiple of 256MB
+        :param logs: log uuid in hex -> the log bytes, in addition to the CEL
+        """
+        self.dev_name = dev_name
+        self.payload_max = payload_max
+        self._commands = dict(DefaultCommandSizes if commands is None else commands)
+        self._exclusive = set(exclusive)
+        self.latency = dict(latency or {})
+        self.default_latency = default_latency
+        self.busy_rate = busy_rate
+        self._random = random.Random(seed)
+        self._forced_busy = 0
+        self.total_capacity = total_capacity
+        self.fw_revision = fw_revision
+        self.health = cxlmi_cmd_get_health_info_payload(life_used=1, device_temperature=40)
+        self.poison = []
+        ## (start, length, records returned) of the Get Poison List to continue
+        self._poison_continuation = None
+        self.event_records = {}
+        self._logs = {LogNameTable["cel"]: self._build_cel()}
+        self._logs.update(logs or {})
+        self._lock = threading.Lock()
+        self.stats = {}
+
+    ## The LinIOCTLDevice interface
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def execute(self, op, cmd):
+        if op == cxl_mem_command_ioctl.CXL_MEM_QUERY_COMMANDS.value:
+            return self._query_commands(cmd)
+        if op == cxl_mem_command_ioctl.CXL_MEM_SEND_COMMAND.value:
+            with self._lock:
+                return self._send_command(cmd)
+        raise OSError(errno.ENOTTY, os.strerror(errno.ENOTTY))
+
+    ## Fault injection
+
+    def inject_busy(self, count=1):
+        """ The next count sends fail with EBUSY """
+        self._forced_busy += count
+
+    ## The ioctls
+
+    def _get_command_table(self):
+        table = []
+        for cmd_id, (size_in, size_out) in sorted(self._commands.items()):
+            flags = CXL_MEM_COMMAND_FLAG_ENABLED
+            if cmd_id in self._exclusive:
+                flags |= CXL_MEM_COMMAND_FLAG_EXCLUSIVE
+            table.append((cmd_id, flags, size_in, size_out))
+        return table
+
+    def _query_commands(self, cmd):
+        table = self._get_command_table()
+        n_commands = cmd.n_commands
+        if n_commands == 0:
+            cmd.n_commands = len(table)
+            return 0
+        n_commands = min(n_commands, len(table), (sizeof(cmd) - 8) // sizeof(cxl_command_info))
+        entries = b"".join(struct.pack("<4I", *i) for i in table[:n_commands])
+        memmove(addressof(cmd) + 8, entries, len(entries))
+        cmd.n_commands = n_commands
+        return 0
+
+    def _send_command(self, cmd):
+        if not isinstance(cmd, cxl_send_command):
+            cmd = cxl_send_command.from_address(addressof(cmd))
+        cmd_id = cmd.id
+        if cmd_id == 0 or cmd_id >= cxl_mem_command_id.CXL_MEM_COMMAND_ID_MAX or cmd_id not in self._commands:
+            raise OSError(errno.ENOTTY, os.strerror(errno.ENOTTY))
+        if cmd.flags & ~CXL_MEM_COMMAND_FLAG_MASK or cmd.union.raw.rsvd or getattr(cmd, "in").rsvd or cmd.out.rsvd:
+            raise OSError(errno.EINVAL, os.strerror(errno.EINVAL))
+        if cmd_id in self._exclusive:
+            raise OSError(errno.EBUSY, os.strerror(errno.EBUSY))
+        size_in, size_out = self._commands[cmd_id]
+        in_size = getattr(cmd, "in").size
+        if in_size > self.payload_max or (size_in != V and in_size != size_in):
+            raise OSError(errno.EINVAL, os.strerror(errno.EINVAL))
+        if size_out != V and cmd.out.size < size_out:
+            raise OSError(errno.ENOMEM, os.strerror(errno.ENOMEM))
+        if cmd_id == cxl_mem_command_id.CXL_MEM_COMMAND_ID_RAW:
+            opcode = cmd.union.raw.opcode
+        else:
+            opcode = cxl_command_opcodes[cmd_id]
+        if self._forced_busy or (self.busy_rate and self._random.random() < self.busy_rate):
+            self._forced_busy = max(0, self._forced_busy - 1)
+            raise OSError(errno.EBUSY, os.strerror(errno.EBUSY))
+        latency = self.latency.get(opcode, self.default_latency)
+        if latency:
+            time.sleep(latency)
+        self.stats[opcode] = self.stats.get(opcode, 0) + 1
+        in_payload = string_at(getattr(cmd, "in").payload, in_size) if in_size else b""
+        out_capacity = min(cmd.out.size, self.payload_max)
+        handler = getattr(self, "_opcode_%04x" % opcode, None)
+        if handler is None:
+            retval = CXL_MBOX_CMD_RC_UNSUPPORTED if cmd_id == cxl_mem_command_id.CXL_MEM_COMMAND_ID_RAW else CXL_MBOX_CMD_RC_SUCCESS
+            output = b""
+        else:
+            retval, output = handler(in_payload, out_capacity)
+        # The driver copies out at most the output size of its command table
+        output = output[:out_capacity if size_out == V else min(out_capacity, size_out)]
+        if output:
+            memmove(cmd.out.payload, output, len(output))
+        cmd.out.size = len(output)
+        cmd.retval = retval
+        return 0
+
+    ## The mailbox commands: handler(input payload, output capacity) returns (retval, output)
+
+    def _build_cel(self):
+        return b"".join(struct.pack("<HH", cxl_command_opcodes[i], 0)
+                        for i in sorted(self._commands) if cxl_command_opcodes[i] is not None)
+
+    def _opcode_0002(self, payload, capacity):
+        # Background Operation Status, nothing runs in the background
+        return CXL_MBOX_CMD_RC_SUCCESS, bytes(8)
+
+    def _opcode_4000(self, payload, capacity):
+        identify = cxlmi_cmd_memdev_identify_payload()
+        identify.fw_revision = self.fw_revision.encode()
+        identify.total_capacity = self.total_capacity // CXL_CAPACITY_MULTIPLIER
+        identify.volatile_capacity = identify.total_capacity
+        identify.info_event_log_size = identify.warning_event_log_size = 0x100
+        identify.failure_event_log_size = identify.fatal_event_log_size = 0x100
+        return CXL_MBOX_CMD_RC_SUCCESS, bytes(identify)
+
+    def _opcode_0400(self, payload, capacity):
+        entries = b"".join(bytes.fromhex(uuid) + struct.pack("<I", len(data)) for uuid, data in self._logs.items())
+        return CXL_MBOX_CMD_RC_SUCCESS, struct.pack("<H6x", len(self._logs)) + entries
+
+    def _opcode_0401(self, payload, capacity):
+        uuid = payload[:16].hex()
+        offset, length = struct.unpack_from("<II", payload, 16)
+        data = self._logs.get(uuid)
+        if data is None:
+            return 0x02, b""
+        return CXL_MBOX_CMD_RC_SUCCESS, data[offset:offset+min(length, capacity)]
+
+    def _opcode_0200(self, payload, capacity):
+        fw_info = cxlmi_cmd_get_fw_info_payload()
+        fw_info.slots_supported = 2
+        fw_info.slot_info = 1
+        fw_info.slot_fw_revision[0].value = self.fw_revision.encode()
+        return CXL_MBOX_CMD_RC_SUCCESS, bytes(fw_info)
+
+    def _opcode_4200(self, payload, capacity):
+        return CXL_MBOX_CMD_RC_SUCCESS, bytes(self.health)
+
+    def _opcode_4300(self, payload, capacity):
+        # The records not fitting in the output payload are returned by the next
+        # Get Poison List of the same range, the More flag is set until then
+        start, length = struct.unpack("<QQ", payload)
+        end = start + length * 0x40
+        records = [(a, l, s) for a, l, s in self.poison if a < end and a + l * 0x40 > start]
+        returned = 0
+        if self._poison_continuation is not None and self._poison_continuation[:2] == (start, length):
+            returned = self._poison_continuation[2]
+        n_records = max(0, (capacity - 0x20) // 0x10)
+        flags = 0
+        if len(records) - returned > n_records:
+            flags = CXL_POISON_FLAG_MORE_RECORDS
+            self._poison_continuation = (start, length, returned + n_records)
+        else:
+            self._poison_continuation = None
+        records = records[returned:returned+n_records]
+        header = struct.pack("<BxQH20x", flags, 0, len(records))
+        return CXL_MBOX_CMD_RC_SUCCESS, header + b"".join(struct.pack("<QI4x", a | s, l) for a, l, s in records)
+
+    def _opcode_0300(self, payload, capacity):
+        return CXL_MBOX_CMD_RC_SUCCESS, struct.pack("<Q", time.time_ns() if hasattr(time, "time_ns") else int(time.time() * 1e9))
+
+    def _opcode_0100(self, payload, capacity):
+        # No event records
+        return CXL_MBOX_CMD_RC_SUCCESS, bytes(0x20)
+
+
+def build_sysfs_tree(root, emulated_devices):
+    """
+    Create a fake /sys/bus/cxl/devices and /dev/cxl under root for emulated devices.
+
+    :return: (the bus/cxl/devices directory, the dev/cxl directory)
+    """
+    bus_dir = os.path.join(root, "bus", "cxl", "devices")
+    dev_dir = os.path.join(root, "dev", "cxl")
+    os.makedirs(dev_dir, exist_ok=True)
+    for minor, device in enumerate(emulated_devices):
+        dev_name = device.dev_name
+        attrs = {"dev": "252:%d" % minor,
+                 "firmware_version": device.fw_revision,
+                 "label_storage_size": "0",
+                 "numa_node": "0",
+                 "payload_max": str(device.payload_max),
+                 "serial": "%#x" % (0xE0000 + minor),
+                 "security/state": "disabled",
+                 "ram/size": "%#x" % device.total_capacity,
+                 "pmem/size": "0x0",
+                 "uevent": "MAJOR=252\nMINOR=%d\nDEVNAME=cxl/%s\nDEVTYPE=cxl_memdev" % (minor, dev_name),
+                 }
+        for attr, value in attrs.items():
+            path = os.path.join(bus_dir, dev_name, attr)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(value + "\n")
+        open(os.path.join(dev_dir, dev_name), "w").close()
+    return bus_dir, dev_dir
+
+
+class EmulatedCXLBus(object):
+    """
+    A set of emulated memory devices with their fake sysfs tree. install() points
+    CXLMemDevice, CXLBusInfo and get_cxl_mem_name() at them, so the library and the
+    CLI run against the emulator:
+
+        with EmulatedCXLBus(16, default_latency=0.001):
+            CXLMemDevice("mem3").get_identify()
+    """
+    def __init__(self, n_devices=1, root=None, **kwargs):
+        """
+        :param root: where to create the fake sysfs tree, default a temporary directory
+        :param kwargs: passed to each EmulatedCXLMemdev
+        """
+        self._tmp = None
+        if root is None:
+            self._tmp = tempfile.TemporaryDirectory(prefix="pycxl-emu-")
+            root = self._tmp.name
+        self.root = root
+        self.devices = {"mem%d" % i: EmulatedCXLMemdev("mem%d" % i, **kwargs) for i in range(n_devices)}
+        self.bus_dir, self.dev_dir = build_sysfs_tree(root, self.devices.values())
+        self._saved = None
+
+    def open_transport(self, dev_path):
+        """ The CXLMemDevice.transport_factory of the bus """
+        device = self.devices.get(os.path.basename(dev_path))
+        if device is None:
+            raise FileNotFoundError(dev_path)
+        return device
+
+    def install(self):
+        from . import linux_utils
+        from .cxl import CXLMemDevice
+        from .linux_utils import CXLBusInfo
+        self._saved = (linux_utils.CXL_DEV_DIR, CXLBusInfo.bus_info_prefix,
+                       CXLMemDevice.dev_path_prefix, CXLMemDevice.transport_factory)
+        linux_utils.CXL_DEV_DIR = self.dev_dir + os.sep
+        CXLBusInfo.bus_info_prefix = self.bus_dir + os.sep
+        CXLMemDevice.dev_path_prefix = self.dev_dir + os.sep
+        CXLMemDevice.transport_factory = self.open_transport
+
+    def uninstall(self):
+        from . import linux_utils
+        from .cxl import CXLMemDevice
+        from .linux_utils import CXLBusInfo
+        if self._saved is not None:
+            (linux_utils.CXL_DEV_DIR, CXLBusInfo.bus_info_prefix,
+             CXLMemDevice.dev_path_prefix, CXLMemDevice.transport_factory) = self._saved
+            self._saved = None
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.uninstall()
+        if self._tmp is not None:
+            self._tmp.cleanup()
@@ -0,0 +1,192 @@
+import time
+from ctypes import sizeof
+from .linux_cxl_ioctl import cxl_mem_command_id
+from .event_records import (
+    cxlmi_get_event_records_header,
+    cxlmi_event_record,
+    get_event_records_payload_type,
+    get_clear_event_records_input_type,
+    decode_event_record,
+    EventLogNames,
+    CXL_EVENT_RECORD_FLAG_OVERFLOW,
+    CXL_EVENT_RECORD_FLAG_MORE_RECORDS,
+    )
+from .parallel import run_on_devices, DEFAULT_JOBS
+
+## n_handles of Clear Event Records is one byte
+MAX_CLEAR_HANDLES = 0xFF
+
+
+class EventLogDrainer(object):
+    """
+    Read all the records of the event logs of one device, as many records per
+    Get Event Records as payload_max allows, write them as NDJSON, then clear them
+    by handle, as many handles per Clear Event Records as possible.
+    """
+    def __init__(self, cxl_device, writer, clear=True):
+        self._cxl_device = cxl_device
+        self._writer = writer
+        self._clear = clear
+        self._dev_name = cxl_device.dev_name
+        header_size = sizeof(cxlmi_get_event_records_header)
+        self._max_records = max(1, (cxl_device.payload_max - header_size) // sizeof(cxlmi_event_record))
+        self._max_handles = max(1, min(MAX_CLEAR_HANDLES,
+                                       (cxl_device.payload_max - sizeof(get_clear_event_records_input_type(0))) // 2))
+        ## The capacity of each log, used to tell how full the logs are
+        self._log_sizes = None
+
+    @property
+    def log_sizes(self):
+        """
+        The capacity in records of each event log, from Identify
+        """
+        if self._log_sizes is None:
+            identify = self._cxl_device.get_identify()
+            self._log_sizes = (identify.info_event_log_size,
+                               identify.warning_event_log_size,
+                               identify.failure_event_log_size,
+                               identify.fatal_event_log_size)
+        return self._log_sizes
+
+    def _clear_handles(self, event_log, handles):
+        for i in range(0, len(handles), self._max_handles):
+            batch = handles[i:i+self._max_handles]
+            in_buf = get_clear_event_records_input_type(len(batch))()
+            in_buf.event_log = event_log
+            in_buf.n_handles = len(batch)
+            in_buf.handles[:] = batch
+            self._cxl_device.send(cxl_mem_command_id.CXL_MEM_COMMAND_ID_CLEAR_EVENT_RECORD, in_buf, None)
+
+    def drain_log(self, event_log):
+        """
+        Drain one event log.
+
+        :return: the number of records drained
+        """
+        payload_type = get_event_records_payload_type(self._max_records)
+        total = 0
+        with self._cxl_device.buffer_pool.borrow(payload_type) as out_buf:
+            in_buf = bytes((event_log,))
+            while True:
+                self._cxl_device.send(cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_EVENT_RECORD, in_buf, out_buf)
+                count = min(out_buf.record_count, self._max_records)
+                if out_buf.flags & CXL_EVENT_RECORD_FLAG_OVERFLOW:
+                    self._writer.write({"device": self._dev_name,
+                                        "log": EventLogNames[event_log],
+                                        "overflow_err_count": out_buf.overflow_err_count,
+                                        "first_overflow_timestamp": out_buf.first_overflow_timestamp,
+                                        "last_overflow_timestamp": out_buf.last_overflow_timestamp,
+                                        })
+                handles = []
+                for record in out_buf.records[:count]:
+                    decoded = decode_event_record(record)
+                    decoded["device"] = self._dev_name
+                    decoded["log"] = EventLogNames[event_log]
+                    self._writer.write(decoded)
+                    handles.append(record.handle)
+                total += count
+                if handles and self._clear:
+                    # Records must be on disk before they are cleared from the device
+                    self._writer.flush()
+                    self._clear_handles(event_log, handles)
+                if count == 0 or not (out_buf.flags & CXL_EVENT_RECORD_FLAG_MORE_RECORDS):
+                    break
+                if not self._clear:
+                    # Without clearing, the device returns the same records again
+                    break
+        return total
+
+    def drain(self):
+        """
+        Drain the four event logs.
+
+        :return: the fill level of the fullest log drained, records drained over log capacity
+        """
+        fill = 0.0
+        for event_log in range(len(EventLogNames)):
+            count = self.drain_log(event_log)
+            if count:
+                fill = max(fill, count / max(1, self.log_sizes[event_log]))
+        return fill
+
+
+class AdaptiveInterval(object):
+    """
+    Poll interval that halves when logs are filling and doubles when idle, within
+    [min_interval, max_interval]. A log found more than half full drops it to
+    min_interval at once.
+    """
+    def __init__(self, min_interval, max_interval):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+
+    def update(self, fill):
+        if fill >= 0.5:
+            self.interval = self.min_interval
+        elif fill > 0:
+            self.interval = max(self.min_interval, self.interval / 2)
+        else:
+            self.interval = min(self.max_interval, self.interval * 2)
+        return self.interval
+
+
+class EventDrainDaemon(object):
+    """
+    Drain the event logs of many devices, each polled with its own adaptive
+    interval, the devices due are drained concurrently.
+    """
+    def __init__(self, dev_names, open_device, writer, min_interval=0.1, max_interval=30.0, clear=True, jobs=DEFAULT_JOBS):
+        """
+        :param dev_names: the devices to drain
+        :param open_device: open_device(dev_name) returns a CXLMemDevice, each device is
+        opened once and kept open
+        :param writer: the output_format.NDJSONWriter
+        """
+        self._dev_names = list(dev_names)
+        self._open_device = open_device
+        self._writer = writer
+        self._clear = clear
+        self._jobs = jobs
+        self._drainers = {}
+        self._intervals = {i: AdaptiveInterval(min_interval, max_interval) for i in self._dev_names}
+        self._next_due = {i: 0 for i in self._dev_names}
+
+    def _drain_device(self, dev_name):
+        drainer = self._drainers.get(dev_name)
+        if drainer is None:
+            drainer = EventLogDrainer(self._open_device(dev_name), self._writer, self._clear)
+            self._drainers[dev_name] = drainer
+        return drainer.drain()
+
+    def run_once(self):
+        """
+        Drain the devices that are due.
+
+        :return: a list of DeviceResult
+        """
+        now = time.monotonic()
+        due = [i for i in self._dev_names if self._next_due[i] <= now]
+        results = []
+        for result in run_on_devices(due, self._drain_device, self._jobs):
+            fill = result.value if result.ok else 0
+            self._next_due[result.dev_name] = time.monotonic() + self._intervals[result.dev_name].update(fill)
+            results.append(result)
+        self._writer.flush()
+        return results
+
+    def run(self, cycles=None, on_error=None):
+        """
+        Drain forever, or for the given number of cycles.
+
+        :param on_error: on_error(DeviceResult) is called for each failed device
+        """
+        cycle = 0
+        while cycles is None or cycle < cycles:
+            for result in self.run_once():
+                if not result.ok and on_error is not None:
+                    on_error(result)
+            cycle += 1
+            if cycles is not None and cycle >= cycles:
+                break
+            time.sleep(max(0, min(self._next_due.values()) - time.monotonic()))
@@ -0,0 +1,107 @@
+from ctypes import *
+from .command_structure import get_variable_length_type
+
+GetEventRecordsOPCode = 0x0100
+ClearEventRecordsOPCode = 0x0101
+
+## Event logs, the input of Get Event Records
+CXL_EVENT_LOG_INFO = 0
+CXL_EVENT_LOG_WARN = 1
+CXL_EVENT_LOG_FAIL = 2
+CXL_EVENT_LOG_FATAL = 3
+EventLogNames = ("info", "warning", "failure", "fatal")
+
+## cxlmi_get_event_records_header.flags
+CXL_EVENT_RECORD_FLAG_OVERFLOW = 0x01
+CXL_EVENT_RECORD_FLAG_MORE_RECORDS = 0x02
+
+EventRecordUUIDTable = {
+    "fbcd0a77c260417f85a9088b1621eba6": "General Media Event Record",
+    "601dcbb39c064eabb8af4e9bfb5c9624": "DRAM Event Record",
+    "fe927475dd594339a58679bab113b774": "Memory Module Event Record",
+}
+
+
+class cxlmi_event_record(Structure):
+    _fields_ = [
+        ("uuid", c_uint8 * 0x10),
+        ("length", c_uint8),
+        ("flags", c_uint8 * 3),
+        ("handle", c_uint16),
+        ("related_handle", c_uint16),
+        ("timestamp", c_uint64),
+        ("maint_op_class", c_uint8),
+        ("rsvd", c_uint8 * 0xF),
+        ("data", c_uint8 * 0x50),
+    ]
+    _pack_ = 1
+
+
+class cxlmi_media_event_data(Structure):
+    """
+    The leading fields shared by the data of General Media and DRAM event records
+    """
+    _fields_ = [
+        ("dpa", c_uint64),
+        ("descriptor", c_uint8),
+        ("type", c_uint8),
+        ("transaction_type", c_uint8),
+    ]
+    _pack_ = 1
+
+
+class cxlmi_get_event_records_header(Structure):
+    _fields_ = [
+        ("flags", c_uint8),
+        ("rsvd", c_uint8),
+        ("overflow_err_count", c_uint16),
+        ("first_overflow_timestamp", c_uint64),
+        ("last_overflow_timestamp", c_uint64),
+        ("record_count", c_uint16),
+        ("rsvd2", c_uint8 * 0xA),
+    ]
+    _pack_ = 1
+
+
+def get_event_records_payload_type(n_records):
+    return get_variable_length_type("cxlmi_get_event_records_payload",
+                                    tuple(cxlmi_get_event_records_header._fields_),
+                                    "records",
+                                    cxlmi_event_record,
+                                    n_records)
+
+
+def get_clear_event_records_input_type(n_handles):
+    return get_variable_length_type("cxlmi_clear_event_records_input",
+                                    (("event_log", c_uint8),
+                                     ("clear_flags", c_uint8),
+                                     ("n_handles", c_uint8),
+                                     ("rsvd", c_uint8 * 3)),
+                                    "handles",
+                                    c_uint16,
+                                    n_handles)
+
+
+def decode_event_record(record):
+    """
+    Decode a cxlmi_event_record into a dict
+    """
+    uuid = bytes(record.uuid).hex()
+    result = {
+        "uuid": uuid,
+        "type": EventRecordUUIDTable.get(uuid, "unknown"),
+        "length": record.length,
+        "flags": int.from_bytes(bytes(record.flags), "little"),
+        "handle": record.handle,
+        "related_handle": record.related_handle,
+        "timestamp": record.timestamp,
+        "maint_op_class": record.maint_op_class,
+    }
+    if uuid in ("fbcd0a77c260417f85a9088b1621eba6", "601dcbb39c064eabb8af4e9bfb5c9624"):
+        media = cxlmi_media_event_data.from_buffer(record.data)
+        result["dpa"] = media.dpa & ~0x3F
+        result["descriptor"] = media.descriptor
+        result["media_event_type"] = media.type
+        result["transaction_type"] = media.transaction_type
+    result["data"] = bytes(record.data).hex()
+    return result
@@ -0,0 +1,65 @@
+from ctypes import *
+
+GetFWInfoOPCode = 0x0200
+TransferFWOPCode = 0x0201
+ActivateFWOPCode = 0x0202
+
+## Transfer FW actions
+FW_TRANSFER_ACTION_FULL = 0x00
+FW_TRANSFER_ACTION_INITIATE = 0x01
+FW_TRANSFER_ACTION_CONTINUE = 0x02
+FW_TRANSFER_ACTION_END = 0x03
+FW_TRANSFER_ACTION_ABORT = 0x04
+## Transfer FW offsets are in units of 128 bytes
+FW_TRANSFER_ALIGNMENT = 0x80
+
+## Activate FW actions
+FW_ACTIVATE_ONLINE = 0x00
+FW_ACTIVATE_ON_COLD_RESET = 0x01
+
+
+class cxlmi_cmd_get_fw_info_payload(Structure):
+    _fields_ = [
+        ("slots_supported", c_uint8),
+        ("slot_info", c_uint8),
+        ("caps", c_uint8),
+        ("rsvd", c_uint8 * 0xD),
+        ("slot_fw_revision", (c_char * 0x10) * 4),
+    ]
+    _pack_ = 1
+
+    @property
+    def active_slot(self):
+        return self.slot_info & 0x07
+
+    @property
+    def staged_slot(self):
+        return (self.slot_info >> 3) & 0x07
+
+    @property
+    def online_activation_capable(self):
+        return bool(self.caps & 0x01)
+
+
+class cxlmi_cmd_transfer_fw_header(Structure):
+    """
+    The header of the Transfer FW input payload, the FW data follows it.
+
+    offset: the offset of the data in the FW package, in units of 128 bytes.
+    """
+    _fields_ = [
+        ("action", c_uint8),
+        ("slot", c_uint8),
+        ("rsvd", c_uint8 * 2),
+        ("offset", c_uint32),
+        ("rsvd2", c_uint8 * 0x78),
+    ]
+    _pack_ = 1
+
+
+class cxlmi_cmd_activate_fw_input(Structure):
+    _fields_ = [
+        ("action", c_uint8),
+        ("slot", c_uint8),
+    ]
+    _pack_ = 1
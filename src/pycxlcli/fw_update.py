@@ -0,0 +1,249 @@
+import os
+import json
+import mmap
+import time
+import hashlib
+from collections import namedtuple
+from ctypes import memset, addressof, sizeof
+from .cxl import CXLCommandError
+from .linux_cxl_ioctl import (
+    cxl_mem_command_id,
+    CXL_MBOX_CMD_RC_BUSY,
+    CXL_MBOX_CMD_RC_FW_IN_PROGRESS,
+    CXL_MBOX_CMD_RC_FW_OUT_OF_ORDER,
+    )
+from .firmware_management import (
+    cxlmi_cmd_transfer_fw_header,
+    cxlmi_cmd_activate_fw_input,
+    FW_TRANSFER_ACTION_FULL,
+    FW_TRANSFER_ACTION_INITIATE,
+    FW_TRANSFER_ACTION_CONTINUE,
+    FW_TRANSFER_ACTION_END,
+    FW_TRANSFER_ACTION_ABORT,
+    FW_TRANSFER_ALIGNMENT,
+    FW_ACTIVATE_ONLINE,
+    FW_ACTIVATE_ON_COLD_RESET,
+    )
+from .background_orchestrator import send_background
+from .metadata_cache import (
+    get_default_cache_dir,
+    atomic_write_json,
+    DeviceMetadataCache,
+    )
+
+## Transfer FW and Activate FW are re-sent while another transfer is in progress
+FW_RETRY_RETVALS = (CXL_MBOX_CMD_RC_BUSY, CXL_MBOX_CMD_RC_FW_IN_PROGRESS)
+TRANSFER_FW_HEADER_SIZE = sizeof(cxlmi_cmd_transfer_fw_header)
+
+
+class FWUpdateResult(namedtuple('FWUpdateResult', ['dev_name', 'size', 'transferred', 'resumed_from', 'elapsed', 'activated'])):
+    """
+    dev_name: the device updated.
+
+    size: the FW package size.
+
+    transferred: bytes sent by this update, less than size if it resumed a transfer.
+
+    resumed_from: the offset the transfer resumed from, 0 if it started over.
+
+    elapsed: seconds spent on the transfer and activation.
+
+    activated: True if the FW was activated.
+    """
+    __slots__ = ()
+
+    @property
+    def throughput(self):
+        return self.transferred / self.elapsed if self.elapsed > 0 else 0
+
+
+class FWTransferState(object):
+    """
+    The last offset of a FW package acknowledged by a device, kept on disk so an
+    interrupted transfer can resume from it.
+    """
+    def __init__(self, cxl_device, state_dir=None):
+        serial = cxl_device.cxl_bus_info.serial
+        if not DeviceMetadataCache.is_cacheable(serial, "-"):
+            # No serial number to tell the devices apart, use the device name
+            serial = cxl_device.dev_name
+        self._path = os.path.join(state_dir or get_default_cache_dir(), "fw-transfer-%s.json" % serial)
+
+    def load(self, digest, slot):
+        """
+        :return: the acknowledged offset of this package and slot, 0 if none
+        """
+        try:
+            with open(self._path, "r") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        if state.get("digest") == digest and state.get("slot") == slot:
+            return state.get("offset", 0)
+        return 0
+
+    def save(self, digest, slot, offset):
+        atomic_write_json(self._path, {"digest": digest, "slot": slot, "offset": offset})
+
+    def clear(self):
+        try:
+            os.unlink(self._path)
+        except FileNotFoundError:
+            pass
+
+
+def _get_transfer_action(offset, length, size):
+    if offset == 0:
+        return FW_TRANSFER_ACTION_FULL if length == size else FW_TRANSFER_ACTION_INITIATE
+    return FW_TRANSFER_ACTION_END if offset + length == size else FW_TRANSFER_ACTION_CONTINUE
+
+
+def _map_image(image_path):
+    """
+    :return: (the copy-on-write mapping of a FW package, a memoryview of it, its size)
+    """
+    with open(image_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            raise ValueError("FW package %s is empty" % image_path)
+        image = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    return image, memoryview(image), size
+
+
+def _unmap_image(image, view):
+    view.release()
+    try:
+        image.close()
+    except BufferError:
+        # A pending exception still references a part, the mapping goes with it
+        pass
+
+
+def transfer_firmware(cxl_device, image_path, slot, resume=True, state_dir=None, part_size=None, timeout=None):
+    """
+    Transfer a FW package to a device with Transfer FW, in parts of up to payload_max.
+
+    The package is mapped copy-on-write and every part is sent in place: the
+    128-byte Transfer FW header of a part is written over the tail of the previous
+    part, which has already been acknowledged. Only the first part is copied behind
+    a header. If the device dropped a resumed transfer, the package is mapped again
+    before starting over, as the headers overwrote FW data. The acknowledged offset
+    is saved after each part, so a later call with resume resumes an interrupted
+    transfer instead of starting over.
+
+    :param cxl_device: the CXLMemDevice
+    :param image_path: the FW package file
+    :param slot: the FW slot to transfer to
+    :param resume: resume an interrupted transfer of the same package to the same slot
+    :param state_dir: where to keep the transfer state, default the metadata cache directory
+    :param part_size: bytes of FW data per Transfer FW, default as much as payload_max allows
+    :param timeout: seconds to wait at most for each part
+    :return: (size, transferred, resumed_from)
+    """
+    max_part_size = (cxl_device.payload_max - TRANSFER_FW_HEADER_SIZE) // FW_TRANSFER_ALIGNMENT * FW_TRANSFER_ALIGNMENT
+    part_size = min(part_size or max_part_size, max_part_size) // FW_TRANSFER_ALIGNMENT * FW_TRANSFER_ALIGNMENT
+    if part_size <= 0:
+        raise ValueError("payload_max %d is too small to transfer FW" % cxl_device.payload_max)
+    image, view, size = _map_image(image_path)
+    try:
+        digest = hashlib.sha256(view).hexdigest()
+        state = FWTransferState(cxl_device, state_dir)
+        offset = state.load(digest, slot) if resume else 0
+        resumed_from = offset
+        while offset < size:
+            length = min(part_size, size - offset)
+            first_part = offset == 0
+            if first_part:
+                # Nothing in front of the first part to hold the header
+                payload = cxl_device.buffer_pool.acquire_payload(TRANSFER_FW_HEADER_SIZE + length)
+                memoryview(payload).cast('B')[TRANSFER_FW_HEADER_SIZE:] = view[:length]
+                header = cxlmi_cmd_transfer_fw_header.from_buffer(payload)
+            else:
+                payload = view[offset-TRANSFER_FW_HEADER_SIZE:offset+length]
+                header = cxlmi_cmd_transfer_fw_header.from_buffer(image, offset-TRANSFER_FW_HEADER_SIZE)
+                memset(addressof(header), 0, TRANSFER_FW_HEADER_SIZE)
+            header.action = _get_transfer_action(offset, length, size)
+            header.slot = slot
+            header.offset = offset // FW_TRANSFER_ALIGNMENT
+            restart = False
+            try:
+                send_background(cxl_device, cxl_mem_command_id.CXL_MEM_COMMAND_ID_TRANSFER_FW, payload, timeout, FW_RETRY_RETVALS)
+            except CXLCommandError as e:
+                if e.retval != CXL_MBOX_CMD_RC_FW_OUT_OF_ORDER or offset != resumed_from or offset == 0:
+                    raise
+                restart = True
+            finally:
+                del header
+                if first_part:
+                    cxl_device.buffer_pool.release(payload)
+                elif isinstance(payload, memoryview):
+                    payload.release()
+            if restart:
+                # The device dropped the interrupted transfer, start over from a clean
+                # mapping, this header was written over the FW data of the previous part
+                abort_transfer(cxl_device)
+                _unmap_image(image, view)
+                image, view, size = _map_image(image_path)
+                offset = resumed_from = 0
+                continue
+            offset += length
+            state.save(digest, slot, offset)
+        state.clear()
+    finally:
+        _unmap_image(image, view)
+    return size, size - resumed_from, resumed_from
+
+
+def abort_transfer(cxl_device):
+    """
+    Abort the FW transfer in progress.
+    """
+    header = cxlmi_cmd_transfer_fw_header()
+    header.action = FW_TRANSFER_ACTION_ABORT
+    try:
+        cxl_device.send(cxl_mem_command_id.CXL_MEM_COMMAND_ID_TRANSFER_FW, header, None)
+    except CXLCommandError:
+        pass
+
+
+def activate_firmware(cxl_device, slot, online=True, metadata_cache=None, timeout=None):
+    """
+    Activate the FW in a slot, online or on the next cold reset.
+
+    The cached metadata of the device is dropped, it may change with the FW.
+    """
+    in_buf = cxlmi_cmd_activate_fw_input()
+    in_buf.action = FW_ACTIVATE_ONLINE if online else FW_ACTIVATE_ON_COLD_RESET
+    in_buf.slot = slot
+    send_background(cxl_device, cxl_mem_command_id.CXL_MEM_COMMAND_ID_ACTIVATE_FW, in_buf, timeout, FW_RETRY_RETVALS)
+    if metadata_cache is not None:
+        metadata_cache.invalidate(cxl_device.cxl_bus_info.serial)
+    cxl_device.cxl_bus_info.invalidate()
+
+
+def get_inactive_slot(fw_info):
+    """
+    The first FW slot other than the active one.
+    """
+    for slot in range(1, fw_info.slots_supported + 1):
+        if slot != fw_info.active_slot:
+            return slot
+    raise ValueError("no inactive FW slot")
+
+
+def update_firmware(cxl_device, image_path, slot=None, activate=None, resume=True, metadata_cache=None, timeout=None):
+    """
+    Transfer a FW package and optionally activate it.
+
+    :param slot: the FW slot, default the first inactive one
+    :param activate: None to not activate, 'online' or 'reset'
+    :return: a FWUpdateResult
+    """
+    start = time.monotonic()
+    if slot is None:
+        slot = get_inactive_slot(cxl_device.get_fw_info())
+    size, transferred, resumed_from = transfer_firmware(cxl_device, image_path, slot, resume=resume, timeout=timeout)
+    if activate:
+        activate_firmware(cxl_device, slot, activate == "online", metadata_cache, timeout)
+    return FWUpdateResult(cxl_device.dev_name, size, transferred, resumed_from,
+                          time.monotonic() - start, bool(activate))
@@ -0,0 +1,57 @@
+import time
+from collections import namedtuple
+
+## Output file extension -> compression module
+compression_table = {
+    ".gz": "gzip",
+    ".bz2": "bz2",
+    ".xz": "lzma",
+}
+
+
+def open_output(path):
+    """
+    Open a binary output file, compressed on the fly according to its extension
+    (.gz, .bz2 or .xz).
+    """
+    for ext, module_name in compression_table.items():
+        if path.endswith(ext):
+            module = __import__(module_name)
+            return module.open(path, "wb")
+    return open(path, "wb")
+
+
+class LogSaveResult(namedtuple('LogSaveResult', ['path', 'size', 'elapsed'])):
+    """
+    path: the output file.
+
+    size: the log bytes read from the device.
+
+    elapsed: seconds spent.
+    """
+    __slots__ = ()
+
+    @property
+    def throughput(self):
+        return self.size / self.elapsed if self.elapsed > 0 else 0
+
+
+def save_log(cxl_device, uuid, path, log_size=None, chunk_size=None):
+    """
+    Stream a log from the device into a(possibly compressed) file, one chunk at
+    a time.
+
+    :param cxl_device: the CXLMemDevice
+    :param uuid: the log uuid, hex string
+    :param path: the output file
+    :param log_size: the log size, default the size reported by Get Supported Logs
+    :param chunk_size: the Get Log chunk size, default payload_max
+    :return: a LogSaveResult
+    """
+    start = time.monotonic()
+    size = 0
+    with open_output(path) as f:
+        for chunk in cxl_device.iter_log(uuid, log_size, chunk_size):
+            f.write(chunk)
+            size += chunk.nbytes
+    return LogSaveResult(path, size, time.monotonic() - start)
@@ -0,0 +1,19 @@
+from ctypes import *
+
+OPCode = 0x4200
+
+## device_temperature when the device does not report its temperature
+CXL_HEALTH_TEMPERATURE_UNSUPPORTED = 0x7FFF
+
+class cxlmi_cmd_get_health_info_payload(Structure):
+    _fields_ = [
+        ("health_status", c_uint8),
+        ("media_status", c_uint8),
+        ("additional_status", c_uint8),
+        ("life_used", c_uint8),
+        ("device_temperature", c_int16),
+        ("dirty_shutdown_count", c_uint32),
+        ("corrected_volatile_error_count", c_uint32),
+        ("corrected_persistent_error_count", c_uint32),
+    ]
+    _pack_ = 1
@@ -1,4 +1,4 @@
-from enum import Enum
+from enum import Enum, IntEnum
 
 class cxl_mem_command_ioctl(Enum):
     CXL_MEM_QUERY_COMMANDS = 0x8008ce01
@@ -37,3 +37,116 @@ cxl_command_names = ("Invalid Command",
                      "Get SLD QoS Status",
                      "invalid / last command",
                      )
+
+
+class cxl_mem_command_id(IntEnum):
+    """
+    The command ids of CXL_MEM_SEND_COMMAND, index of cxl_command_names.
+    """
+    CXL_MEM_COMMAND_ID_INVALID = 0
+    CXL_MEM_COMMAND_ID_IDENTIFY = 1
+    CXL_MEM_COMMAND_ID_RAW = 2
+    CXL_MEM_COMMAND_ID_GET_SUPPORTED_LOGS = 3
+    CXL_MEM_COMMAND_ID_GET_FW_INFO = 4
+    CXL_MEM_COMMAND_ID_GET_PARTITION_INFO = 5
+    CXL_MEM_COMMAND_ID_GET_LSA = 6
+    CXL_MEM_COMMAND_ID_GET_HEALTH_INFO = 7
+    CXL_MEM_COMMAND_ID_GET_LOG = 8
+    CXL_MEM_COMMAND_ID_SET_PARTITION_INFO = 9
+    CXL_MEM_COMMAND_ID_SET_LSA = 10
+    CXL_MEM_COMMAND_ID_GET_ALERT_CONFIG = 11
+    CXL_MEM_COMMAND_ID_SET_ALERT_CONFIG = 12
+    CXL_MEM_COMMAND_ID_GET_SHUTDOWN_STATE = 13
+    CXL_MEM_COMMAND_ID_SET_SHUTDOWN_STATE = 14
+    CXL_MEM_COMMAND_ID_GET_POISON = 15
+    CXL_MEM_COMMAND_ID_INJECT_POISON = 16
+    CXL_MEM_COMMAND_ID_CLEAR_POISON = 17
+    CXL_MEM_COMMAND_ID_GET_SCAN_MEDIA_CAPS = 18
+    CXL_MEM_COMMAND_ID_SCAN_MEDIA = 19
+    CXL_MEM_COMMAND_ID_GET_SCAN_MEDIA = 20
+    CXL_MEM_COMMAND_ID_GET_TIMESTAMP = 21
+    CXL_MEM_COMMAND_ID_SET_TIMESTAMP = 22
+    CXL_MEM_COMMAND_ID_GET_EVENT_RECORD = 23
+    CXL_MEM_COMMAND_ID_CLEAR_EVENT_RECORD = 24
+    CXL_MEM_COMMAND_ID_TRANSFER_FW = 25
+    CXL_MEM_COMMAND_ID_ACTIVATE_FW = 26
+    CXL_MEM_COMMAND_ID_SANITIZE = 27
+    CXL_MEM_COMMAND_ID_GET_SLD_QOS_CONTROL = 28
+    CXL_MEM_COMMAND_ID_SET_SLD_QOS_CONTROL = 29
+    CXL_MEM_COMMAND_ID_GET_SLD_QOS_STATUS = 30
+    CXL_MEM_COMMAND_ID_MAX = 31
+
+## The mailbox opcode of each command id, index of cxl_command_names, None for the raw command
+cxl_command_opcodes = (None,
+                       0x4000,
+                       None,
+                       0x0400,
+                       0x0200,
+                       0x4100,
+                       0x4102,
+                       0x4200,
+                       0x0401,
+                       0x4101,
+                       0x4103,
+                       0x4201,
+                       0x4202,
+                       0x4203,
+                       0x4204,
+                       0x4300,
+                       0x4301,
+                       0x4302,
+                       0x4303,
+                       0x4304,
+                       0x4305,
+                       0x0300,
+                       0x0301,
+                       0x0100,
+                       0x0101,
+                       0x0201,
+                       0x0202,
+                       0x4400,
+                       0x4700,
+                       0x4701,
+                       0x4702,
+                       None,
+                       )
+
+## cxl_command_info.flags
+CXL_MEM_COMMAND_FLAG_ENABLED = 0x01
+CXL_MEM_COMMAND_FLAG_EXCLUSIVE = 0x02
+
+## cxl_command_info.size_in/size_out of variable length commands
+CXL_VARIABLE_PAYLOAD_SIZE = 0xFFFFFFFF
+
+## Mailbox return codes, cxl_send_command.retval
+CXL_MBOX_CMD_RC_SUCCESS = 0x00
+CXL_MBOX_CMD_RC_BACKGROUND = 0x01
+CXL_MBOX_CMD_RC_UNSUPPORTED = 0x03
+CXL_MBOX_CMD_RC_BUSY = 0x06
+CXL_MBOX_CMD_RC_FW_IN_PROGRESS = 0x08
+CXL_MBOX_CMD_RC_FW_OUT_OF_ORDER = 0x09
+cxl_mbox_return_codes = {
+    0x00: "Success",
+    0x01: "Background Command Started",
+    0x02: "Invalid Input",
+    0x03: "Unsupported",
+    0x04: "Internal Error",
+    0x05: "Retry Required",
+    0x06: "Busy",
+    0x07: "Media Disabled",
+    0x08: "FW Transfer in Progress",
+    0x09: "FW Transfer Out of Order",
+    0x0A: "FW Verification Failed",
+    0x0B: "Invalid Slot",
+    0x0C: "Activation Failed, FW Rolled Back",
+    0x0D: "Activation Failed, Cold Reset Required",
+    0x0E: "Invalid Handle",
+    0x0F: "Invalid Physical Address",
+    0x10: "Inject Poison Limit Reached",
+    0x11: "Permanent Media Failure",
+    0x12: "Aborted",
+    0x13: "Invalid Security State",
+    0x14: "Incorrect Passphrase",
+    0x15: "Unsupported Mailbox or CCI",
+    0x16: "Invalid Payload Length",
+}
@@ -1,5 +1,7 @@
 from abc import ABCMeta, abstractmethod
 import os
+import time
+from .replug_monitor import get_replug_monitor
 
 def get_inode(file):
     #  type: (str) -> int
@@ -122,16 +124,25 @@ class LinIOCTLDevice(DeviceBase):
         - execute the command
         - close the device after all the commands.
     """
+    ## The default of replug_events
+    replug_events = True
+
     def __init__(self, 
                  device,
                  readwrite=True,
-                 detect_replugged=True):
+                 detect_replugged=True,
+                 replug_events=None,
+                 replug_poll_interval=0):
         """
         initialize a new instance of a LinIOCTLDevice
         :param device: the file descriptor
         :param readwrite: access type
         :param detect_replugged: detects device unplugged and plugged events and ensure executions will not fail
         silently due to replugged events
+        :param replug_events: learn about replug events from the kernel uevents(or inotify), instead of
+        checking the device node before every command, None for the class default
+        :param replug_poll_interval: if no replug event source is available, check the device node at most
+        once every this many seconds, 0 checks before every command
         """
         super(LinIOCTLDevice, self).__init__(device, readwrite, detect_replugged)
         ## init the ioctl engine
@@ -140,6 +151,17 @@ class LinIOCTLDevice(DeviceBase):
         ##
         self._file = None
         self._ino = None
+        ## replug detection
+        self._replug_monitor = None
+        if replug_events is None:
+            replug_events = self.replug_events
+        if detect_replugged and replug_events:
+            monitor = get_replug_monitor()
+            if monitor and monitor.watch(self._file_name):
+                self._replug_monitor = monitor
+        self._replug_generation = None
+        self._replug_poll_interval = replug_poll_interval
+        self._replug_checked = 0
         ## open device
         self.open()
 
@@ -149,6 +171,17 @@ class LinIOCTLDevice(DeviceBase):
 
         :return: True or False
         """
+        if self._replug_monitor is not None:
+            if not self._replug_monitor.failed:
+                return self._replug_monitor.generation(self._file_name) != self._replug_generation
+            # The event source is gone, events may have been missed, poll from now on
+            self._replug_monitor = None
+            self._replug_checked = 0
+        if self._replug_poll_interval:
+            now = time.monotonic()
+            if now - self._replug_checked < self._replug_poll_interval:
+                return False
+            self._replug_checked = now
         ino = get_inode(self._file_name)
         return ino != self._ino
 
@@ -169,9 +202,12 @@ class LinIOCTLDevice(DeviceBase):
         """
         if self._file:
             self.close()
+        if self._replug_monitor is not None:
+            self._replug_generation = self._replug_monitor.generation(self._file_name)
         self._file = open(self._file_name,
                           'w+b' if self._read_write else 'rb')
         self._ino = get_inode(self._file_name)
+        self._replug_checked = time.monotonic()
 
     def close(self):
         """
@@ -1,13 +1,186 @@
 import os
 import re
+import errno
+import time
+import threading
+from collections import namedtuple
+from types import MappingProxyType
 
-class CXLBusInfo(object):
+## Default lifetime (seconds) of a sysfs snapshot, 0 disables snapshot mode
+SYSFS_SNAPSHOT_TTL = 1.0
+## Where the CXL memory device nodes are
+CXL_DEV_DIR = "/dev/cxl/"
+
+
+def _read_sysfs_file(file_path, binary=False):
+    """
+    Read a sysfs attribute file.
+
+    :return: the stripped text (or raw bytes if binary), None if the file does not
+    exist or is not readable.
+    """
+    try:
+        with open(file_path, "rb" if binary else "r") as f:
+            data = f.read()
+    except OSError:
+        return None
+    return data if binary else data.strip()
+
+
+def _write_sysfs_file(file_path, value):
+    """
+    Write value to a sysfs attribute file in one write(2), the store method of
+    the attribute runs once.
+
+    Raises:
+        OSError: with the errno of the open or the write, e.g. ENOENT if the
+        attribute does not exist, EACCES without privilege, EINVAL, ENOTTY...
+    """
+    data = value if isinstance(value, bytes) else str(value).encode()
+    fd = os.open(file_path, os.O_WRONLY | getattr(os, "O_CLOEXEC", 0))
+    try:
+        written = os.write(fd, data)
+    except OSError as e:
+        raise OSError(e.errno, e.strerror, file_path)
+    finally:
+        os.close(fd)
+    if written != len(data):
+        raise OSError(errno.EIO, "short write of %d/%d bytes" % (written, len(data)), file_path)
+
+
+class SysfsSnapshot(namedtuple('SysfsSnapshot', ['path', 'attrs', 'timestamp'])):
+    """
+    Immutable record of the attributes of one sysfs device directory.
+
+    path: the sysfs directory.
+
+    attrs: mapping of attribute name to its stripped text (raw bytes for binary
+    attributes), attributes absent from the directory are absent from the mapping.
+
+    timestamp: time.monotonic() when the snapshot was taken.
+    """
+    __slots__ = ()
+
+    def get(self, name, default=None):
+        return self.attrs.get(name, default)
+
+    def expired(self, ttl):
+        return (time.monotonic() - self.timestamp) >= ttl
+
+
+def read_sysfs_snapshot(path, attrs, binary_attrs=()):
+    """
+    Read the given attributes of a sysfs directory in one os.scandir pass.
+
+    Args:
+        path (str): The sysfs directory.
+        attrs (tuple): Attribute names, 'dir/file' reads a file in a sub-directory.
+        binary_attrs (tuple): Attribute names to read as raw bytes.
+
+    Returns:
+        SysfsSnapshot: The snapshot, with empty attrs if path does not exist.
+    """
+    wanted = {}
+    for attr in attrs:
+        head, _, tail = attr.partition('/')
+        wanted.setdefault(head, []).append((attr, tail))
+    result = {}
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                for attr, tail in wanted.get(entry.name, ()):
+                    file_path = os.path.join(entry.path, tail) if tail else entry.path
+                    value = _read_sysfs_file(file_path, attr in binary_attrs)
+                    if value is not None:
+                        result[attr] = value
+    except (FileNotFoundError, NotADirectoryError):
+        pass
+    return SysfsSnapshot(path, MappingProxyType(result), time.monotonic())
+
+
+class SysfsAttrs(object):
+    """
+    Base class of the sysfs bus information classes.
+
+    All the attributes listed in snapshot_attrs are read together into a SysfsSnapshot,
+    which is reused until it is older than snapshot_ttl seconds or invalidate() is called.
+    With a snapshot_ttl of 0, every attribute access reads its own file. An attribute
+    that does not exist or can not be read is None.
+    """
+    snapshot_attrs = ()
+    binary_attrs = ()
+    snapshot_ttl = SYSFS_SNAPSHOT_TTL
+    bus_info_path = None
+
+    def __init__(self, ttl=None):
+        if ttl is not None:
+            self.snapshot_ttl = ttl
+        self._snapshot = None
+
+    @property
+    def snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.expired(self.snapshot_ttl):
+            snapshot = read_sysfs_snapshot(self.bus_info_path,
+                                           self.snapshot_attrs,
+                                           self.binary_attrs)
+            self._snapshot = snapshot
+        return snapshot
+
+    def invalidate(self):
+        """
+        Drop the cached snapshot, the next attribute access reads sysfs again.
+        """
+        self._snapshot = None
+
+    def _read_attr(self, name):
+        if self.snapshot_ttl > 0 and name in self.snapshot_attrs:
+            return self.snapshot.get(name)
+        return _read_sysfs_file(os.path.join(self.bus_info_path, name),
+                                name in self.binary_attrs)
+
+    def _get_value_form_file(self, file, base=10):
+        value = self._read_attr(file)
+        if value is not None:
+            return int(value, base)
+
+
+def _parse_key_value(text, sep=None):
+    result = {}
+    if text:
+        for i in text.split('\n'):
+            i_list = i.split(sep)
+            if len(i_list) == 2:
+                result[i_list[0].strip()] = i_list[1].strip()
+    return result
+
+
+def _parse_link_speed(text):
+    if text:
+        g = re.match(r'\d+\.?\d*', text)
+        if g:
+            return float(g.group())
+
+
+class CXLBusInfo(SysfsAttrs):
     """
     Class to hold CXL bus information by retirving the information in
     /sys/bus/cxl/devices/<dev_name>/*
     """
     bus_info_prefix = "/sys/bus/cxl/devices/"
-    def __init__(self, dev_name):
+    snapshot_attrs = ('dev',
+                      'firmware_version',
+                      'label_storage_size',
+                      'numa_node',
+                      'payload_max',
+                      'serial',
+                      'security/state',
+                      'ram/size',
+                      'pmem/size',
+                      'uevent',
+                      )
+    def __init__(self, dev_name, ttl=None):
+        super(CXLBusInfo, self).__init__(ttl)
         self._dev_name = dev_name
 
     @property
@@ -16,61 +189,43 @@ class CXLBusInfo(object):
 
     @property
     def dev_node(self):
-        with open(os.path.join(self.bus_info_path, 'dev'), "r") as f:
-            return f.read().strip()
+        return self._read_attr('dev')
 
     @property
     def firmware_version(self):
-        with open(os.path.join(self.bus_info_path, 'firmware_version'), "r") as f:
-            return f.read().strip()
+        return self._read_attr('firmware_version')
 
     @property
     def label_storage_size(self):
-        with open(os.path.join(self.bus_info_path, 'label_storage_size'), "r") as f:
-            return int(f.read().strip())
+        return self._get_value_form_file('label_storage_size')
 
     @property
     def numa_node(self):
-        with open(os.path.join(self.bus_info_path, 'numa_node'), "r") as f:
-            return f.read().strip()
+        return self._read_attr('numa_node')
 
     @property
     def payload_max(self):
-        with open(os.path.join(self.bus_info_path, 'payload_max'), "r") as f:
-            return int(f.read().strip())
+        return self._get_value_form_file('payload_max')
 
     @property
     def serial(self):
-        with open(os.path.join(self.bus_info_path, 'serial'), "r") as f:
-            return f.read().strip()
+        return self._read_attr('serial')
 
     @property
     def security_state(self):
-        with open(os.path.join(self.bus_info_path, 'security', 'state'), "r") as f:
-            return f.read().strip()
+        return self._read_attr('security/state')
 
     @property
     def ram_size(self):
-        with open(os.path.join(self.bus_info_path,'ram', 'size'), "r") as f:
-            return int(f.read().strip(), 16)
+        return self._get_value_form_file('ram/size', 16)
 
     @property
     def pmem_size(self):
-        with open(os.path.join(self.bus_info_path,'pmem','size'), "r") as f:
-            return int(f.read().strip(), 16)
+        return self._get_value_form_file('pmem/size', 16)
 
     @property
     def uevent(self):
-        result = {}
-        file_path = os.path.join(self.bus_info_path, 'uevent')
-        if os.path.exists(file_path):
-            with open(file_path, "r") as f:
-                temp = f.read()
-            for i in temp.split('\n'):
-                i_list = i.split('=')
-                if len(i_list) == 2:
-                    result[i_list[0].strip()] = i_list[1].strip()
-        return result
+        return _parse_key_value(self._read_attr('uevent'), '=')
 
 
 def get_cxl_mem_name():
@@ -78,107 +233,187 @@ def get_cxl_mem_name():
     Return a list of CXLBusInfo objects for all CXL devices"
     """
     cxl_dev_name = []
-    for dev_name in os.listdir("/dev/cxl/"):
+    if not os.path.isdir(CXL_DEV_DIR):
+        return cxl_dev_name
+    for dev_name in os.listdir(CXL_DEV_DIR):
         if dev_name.startswith("mem"):
             cxl_dev_name.append(dev_name)
     return cxl_dev_name
 
+def _scan_cxl_dev_bdf(pci_class=(0x050210,)):
+    """
+    Fallback of CXLMemBDFIndex, walk all the PCI devices of the given classes and
+    collect the CXL memory devices under them.
+
+    Returns:
+        dict: memdev name -> BDF
+    """
+    result = {}
+    # Iterate over all PCI devices in the system
+    for bdf in os.listdir(PCIBusInfo.bus_info_prefix):
+        # Read the class file of the current PCI device, and check if it matches any of the specified PCI classes
+        class_str = _read_sysfs_file(os.path.join(PCIBusInfo.bus_info_prefix, bdf, "class"))
+        if class_str and int(class_str, 16) in pci_class:
+            # Collect all the memory devices under the current PCI device
+            for dev in os.listdir(os.path.join(PCIBusInfo.bus_info_prefix, bdf)):
+                if re.fullmatch(r'mem\d+', dev):
+                    result[dev] = bdf
+    return result
+
+
+class CXLMemBDFIndex(object):
+    """
+    Index between CXL memory device names and the BDF of their PCI devices.
+
+    The index is built once from the /sys/bus/cxl/devices/memX symlink targets, whose
+    parent directory is the PCI device, memory devices not resolved that way are looked
+    up by a PCI scan. The index is rebuilt when the set of memory devices changes.
+    """
+    bdf_pattern = re.compile(r'[0-9a-fA-F]{4,}:[0-9a-fA-F]{2}:[0-9a-fA-F]{2}\.[0-7]')
+    def __init__(self, pci_class=(0x050210,)):
+        self._pci_class = pci_class
+        self._dev_set = None
+        self._mem_to_bdf = {}
+        self._bdf_to_mem = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _get_dev_set():
+        try:
+            return frozenset(i for i in os.listdir(CXLBusInfo.bus_info_prefix) if re.fullmatch(r'mem\d+', i))
+        except FileNotFoundError:
+            return frozenset()
+
+    def _build(self, dev_set):
+        mem_to_bdf = {}
+        for dev_name in dev_set:
+            target = os.path.realpath(os.path.join(CXLBusInfo.bus_info_prefix, dev_name))
+            parent = os.path.basename(os.path.dirname(target))
+            if CXLMemBDFIndex.bdf_pattern.fullmatch(parent):
+                mem_to_bdf[dev_name] = parent
+        if len(mem_to_bdf) < len(dev_set):
+            for dev_name, bdf in _scan_cxl_dev_bdf(self._pci_class).items():
+                mem_to_bdf.setdefault(dev_name, bdf)
+        bdf_to_mem = {}
+        for dev_name, bdf in mem_to_bdf.items():
+            bdf_to_mem.setdefault(bdf, []).append(dev_name)
+        for i in bdf_to_mem.values():
+            i.sort()
+        self._mem_to_bdf = mem_to_bdf
+        self._bdf_to_mem = bdf_to_mem
+
+    def refresh(self, force=False):
+        """
+        Rebuild the index if the memory devices changed since the last build.
+        """
+        dev_set = CXLMemBDFIndex._get_dev_set()
+        with self._lock:
+            if force or dev_set != self._dev_set:
+                self._build(dev_set)
+                self._dev_set = dev_set
+
+    def invalidate(self):
+        with self._lock:
+            self._dev_set = None
+
+    def get_bdf(self, dev_name):
+        self.refresh()
+        return self._mem_to_bdf.get(dev_name)
+
+    def get_mem_names(self, bdf):
+        self.refresh()
+        return list(self._bdf_to_mem.get(bdf, ()))
+
+
+## The index shared by get_cxl_dev_bdf_by_name and PCIBusInfo.get_mem_bus_info
+cxl_mem_bdf_index = CXLMemBDFIndex()
+
 def get_cxl_dev_bdf_by_name(dev_name:str, pci_class=(0x050210,)):
     """
     Return the BDF of the CXL device
 
     Args:
         dev_name (str): The name of the CXL device.
-        pci_class (tuple): A tuple of PCI class codes to match. Default is (0x050210,).
+        pci_class (tuple): A tuple of PCI class codes to match when falling back to a
+        PCI scan. Default is (0x050210,).
 
     Returns:
         str: The BDF (Bus:Device.Function) of the CXL device if found, otherwise None.
     """
-    # Iterate over all PCI devices in the system
-    for bdf in os.listdir("/sys/bus/pci/devices/"):
-        # Construct the path to the class file for the current PCI device
-        class_file = os.path.join("/sys/bus/pci/devices/", bdf, "class")
-        # Check if the class file exists
-        if os.path.isfile(class_file):
-            # Open the class file and read its contents
-            with open(class_file, "r") as f:
-                class_str = f.read().strip()
-            # Convert the class string to an integer and check if it matches any of the specified PCI classes
-            if int(class_str, 16) in pci_class:
-                # Iterate over all files and directories under the current PCI device
-                for dev in os.listdir(os.path.join("/sys/bus/pci/devices/", bdf)):
-                    # Check if the device name matches the specified device name
-                    if dev == dev_name:
-                        # If a match is found, return the BDF of the PCI device
-                        return bdf
-
-
-class PCIBusInfo(object):
+    if pci_class == cxl_mem_bdf_index._pci_class:
+        return cxl_mem_bdf_index.get_bdf(dev_name)
+    return _scan_cxl_dev_bdf(pci_class).get(dev_name)
+
+
+class PCIBusInfo(SysfsAttrs):
     """
     Class to hold PCI bus information by retirving the information in
     /sys/bus/pci/devices/<dev_name>/*
     """
     bus_info_prefix = "/sys/bus/pci/devices/"
-    def __init__(self, bdf):
+    snapshot_attrs = ('aer_dev_correctable',
+                      'aer_dev_fatal',
+                      'aer_dev_nonfatal',
+                      'ari_enabled',
+                      'broken_parity_status',
+                      'class',
+                      'consistent_dma_mask_bits',
+                      'max_link_speed',
+                      'max_link_width',
+                      'current_link_speed',
+                      'current_link_width',
+                      'd3cold_allowed',
+                      'vendor',
+                      'device',
+                      'subsystem_vendor',
+                      'subsystem_device',
+                      'dma_mask_bits',
+                      'enable',
+                      'irq',
+                      'local_cpulist',
+                      'local_cpus',
+                      'numa_node',
+                      'revision',
+                      'power_state',
+                      'reset_method',
+                      )
+    ## config is read on demand only, reading it costs config cycles on the device
+    binary_attrs = ('config',)
+    def __init__(self, bdf, ttl=None):
+        super(PCIBusInfo, self).__init__(ttl)
         self._bdf = bdf
         self.bus_info_path = os.path.join(PCIBusInfo.bus_info_prefix, self._bdf)
 
-    def _get_value_form_file(self, file, base=10):
-        file_path = os.path.join(self.bus_info_path, file)
-        if os.path.exists(file_path):
-            with open(file_path, "r") as f:
-                return int(f.read().strip(), base)
+    @property
+    def bdf(self):
+        return self._bdf
 
     def _echo_to_file(self, file, value):
-        ret = 255
-        file_path = os.path.join(self.bus_info_path, file)
-        if os.path.isfile(file_path):
-            try:
-                ret = os.system("echo %s > %s" % (value, file_path))
-                # with open(file_path, "w") as f:
-                #     f.write(value)
-            except Exception as e:
-                pass
-        return ret
+        """
+        Write value to an attribute of the device, raise OSError if it fails.
+
+        :return: 0
+        """
+        try:
+            _write_sysfs_file(os.path.join(self.bus_info_path, file), value)
+        finally:
+            self.invalidate()
+        return 0
+
+    def _get_counters(self, file):
+        return {k: int(v) for k, v in _parse_key_value(self._read_attr(file)).items()}
 
     @property
     def aer_dev_correctable(self):
-        result = {}
-        file_path = os.path.join(self.bus_info_path, 'aer_dev_correctable')
-        if os.path.exists(file_path):
-            with open(file_path, "r") as f:
-                temp = f.read()
-            for i in temp.split('\n'):
-                i_list = i.split()
-                if len(i_list) == 2:
-                    result[i_list[0].strip()] = int(i_list[1])
-        return result
+        return self._get_counters('aer_dev_correctable')
 
     @property
     def aer_dev_fatal(self):
-        result = {}
-        file_path = os.path.join(self.bus_info_path, 'aer_dev_fatal')
-        if os.path.exists(file_path):
-            with open(file_path, "r") as f:
-                temp = f.read()
-            for i in temp.split('\n'):
-                i_list = i.split()
-                if len(i_list) == 2:
-                    result[i_list[0].strip()] = int(i_list[1])
-        return result
+        return self._get_counters('aer_dev_fatal')
 
     @property
     def aer_dev_nonfatal(self):
-        result = {}
-        file_path = os.path.join(self.bus_info_path, 'aer_dev_nonfatal')
-        if os.path.exists(file_path):
-            with open(file_path, "r") as f:
-                temp = f.read()
-            for i in temp.split('\n'):
-                i_list = i.split()
-                if len(i_list) == 2:
-                    result[i_list[0].strip()] = int(i_list[1].strip())
-        return result
+        return self._get_counters('aer_dev_nonfatal')
 
     @property
     def ari_enabled(self):
@@ -194,10 +429,7 @@ class PCIBusInfo(object):
 
     @property
     def config(self):
-        file_path = os.path.join(self.bus_info_path, 'config')
-        if os.path.exists(file_path):
-            with open(file_path, "rb") as f:
-                return f.read()
+        return self._read_attr('config')
 
     @property
     def consistent_dma_mask_bits(self):
@@ -205,13 +437,7 @@ class PCIBusInfo(object):
 
     @property
     def max_link_speed(self):
-        file_path = os.path.join(self.bus_info_path, 'max_link_speed')
-        if os.path.exists(file_path):
-            with open(file_path, "r") as f:
-                temp = f.read()
-            g = re.match(r'\d+\.?\d*', temp)
-            if g:
-                return float(g.group())
+        return _parse_link_speed(self._read_attr('max_link_speed'))
 
     @property
     def max_link_width(self):
@@ -219,13 +445,7 @@ class PCIBusInfo(object):
 
     @property
     def current_link_speed(self):
-        file_path = os.path.join(self.bus_info_path, 'current_link_speed')
-        if os.path.exists(file_path):
-            with open(file_path, "r") as f:
-                temp = f.read()
-            g = re.match(r'\d+\.?\d*', temp)
-            if g:
-                return float(g.group())
+        return _parse_link_speed(self._read_attr('current_link_speed'))
 
     @property
     def current_link_width(self):
@@ -265,17 +485,11 @@ class PCIBusInfo(object):
 
     @property
     def local_cpulist(self):
-        file_path = os.path.join(self.bus_info_path, 'local_cpulist')
-        if os.path.exists(file_path):
-            with open(file_path, "r") as f:
-                return f.read().strip()
+        return self._read_attr('local_cpulist')
 
     @property
     def local_cpus(self):
-        file_path = os.path.join(self.bus_info_path, 'local_cpus')
-        if os.path.exists(file_path):
-            with open(file_path, "r") as f:
-                return f.read().strip()
+        return self._read_attr('local_cpus')
 
     @property
     def numa_node(self):
@@ -287,38 +501,45 @@ class PCIBusInfo(object):
 
     @property
     def power_state(self):
-        file_path = os.path.join(self.bus_info_path, 'power_state')
-        if os.path.exists(file_path):
-            with open(file_path, "r") as f:
-                return f.read().strip()
+        return self._read_attr('power_state')
 
     def set_remove(self):
+        from .pci_config import pci_config_cache
         self._echo_to_file('remove', '1')
+        pci_config_cache.invalidate(self._bdf)
 
     def set_rescan(self):
+        from .pci_config import pci_config_cache
         self._echo_to_file('rescan', '1')
+        pci_config_cache.invalidate()
 
     @property
     def reset_method(self):
-        file_path = os.path.join(self.bus_info_path, 'reset_method')
-        if os.path.exists(file_path):
-            with open(file_path, "r") as f:
-                return f.read().strip()
+        return self._read_attr('reset_method')
 
     def set_reset(self):
+        from .pci_config import pci_config_cache
         self._echo_to_file('reset', '1')
+        pci_config_cache.invalidate(self._bdf)
 
     def get_mem_bus_info(self):
-        result = []
-        for f in os.listdir(self.bus_info_path):
-            if re.fullmatch(r'mem\d+', f):
-                result.append(CXLBusInfo(f))
-        return result
+        return [CXLBusInfo(i) for i in cxl_mem_bdf_index.get_mem_names(self._bdf)]
 
     def decode_pci_config(self):
-        # TODO
-        pass
+        """
+        The decoded configuration space(pci_config.PCIConfig): capabilities, link,
+        CXL DVSECs, cached until the device is removed, rescanned or reset.
+
+        :return: the PCIConfig, None if the config can not be read
+        """
+        from .pci_config import pci_config_cache
+        return pci_config_cache.get(self._bdf)
 
     def decode_pci_bar(self):
-        # TODO
-        pass
+        """
+        Map the register blocks of the Register Locator DVSEC through the resourceN files.
+
+        :return: a pci_bar.CXLRegisterMap, None without Register Locator DVSEC
+        """
+        from .pci_bar import CXLRegisterMap
+        return CXLRegisterMap.from_bdf(self._bdf)
@@ -1,4 +1,5 @@
 from ctypes import *
+from .command_structure import get_variable_length_type
 
 class cxlmi_supported_log_entry(Structure):
     _fields_ = [
@@ -19,6 +20,40 @@ LogUUIDTable = {
 }
 
 
+## Short names of the logs, for the command line
+LogNameTable = {
+    "cel": "0da9c0b5bf414b788f7996b1623b3f17",
+    "vendor-debug": "5e1819d911a9400c811fd60719403d86",
+    "state-dump": "b3fab4cf01b64332943e5e9962f23567",
+    "ecs": "f1720d60a7a94306a00311948f9e077c",
+    "media-test-cap": "e6dfa32cd13e4a5c8ca899bebbf731a4",
+    "media-test-short": "2c2555228ce411ecb9090242ac120002",
+    "media-test-long": "c1fe0b3e7a00448ea24ea6aabbfe587a",
+}
+
+
+def get_log_uuid(log):
+    """
+    Return the uuid(hex string) of a log given by short name or uuid
+    """
+    if log in LogNameTable:
+        return LogNameTable[log]
+    uuid = log.replace("-", "").lower()
+    if len(uuid) != 32:
+        raise ValueError("Invalid log %s, give a log uuid or one of %s" % (log, ", ".join(LogNameTable)))
+    int(uuid, 16)
+    return uuid
+
+
+class cxlmi_cmd_get_log_input(Structure):
+    _fields_ = [
+        ("uuid", c_uint8 * 0x10),
+        ("offset", c_uint32),
+        ("length", c_uint32),
+    ]
+    _pack_ = 1
+
+
 class GetSupportedLogsPayload(Structure):
     _fields_ = [
         ("num_supported_log_entries", c_uint16),
@@ -28,12 +63,14 @@ class GetSupportedLogsPayload(Structure):
     _pack_ = 1
 
 
+def get_supported_logs_payload_type(log_entry_num):
+    return get_variable_length_type("GetSupportedLogsPayload",
+                                    (("num_supported_log_entries", c_uint16),
+                                     ("reserved", c_uint8 * 6)),
+                                    "entries",
+                                    cxlmi_supported_log_entry,
+                                    log_entry_num)
+
+
 def get_supported_logs_payload(log_entry_num):
-    class GetSupportedLogsPayload(Structure):
-        _fields_ = [
-            ("num_supported_log_entries", c_uint16),
-            ("reserved", c_uint8 * 6),
-            ("entries", cxlmi_supported_log_entry * log_entry_num), 
-        ]
-        _pack_ = 1
-    return GetSupportedLogsPayload()
+    return get_supported_logs_payload_type(log_entry_num)()
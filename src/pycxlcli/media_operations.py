@@ -0,0 +1,102 @@
+from ctypes import *
+
+GetPoisonListOPCode = 0x4300
+InjectPoisonOPCode = 0x4301
+ClearPoisonOPCode = 0x4302
+GetScanMediaCapabilitiesOPCode = 0x4303
+ScanMediaOPCode = 0x4304
+GetScanMediaResultsOPCode = 0x4305
+SanitizeOPCode = 0x4400
+
+## Media error records address and length are in units of 64 bytes
+CXL_POISON_ALIGNMENT = 0x40
+
+## Identify capacities are in units of 256MB
+CXL_CAPACITY_MULTIPLIER = 0x10000000
+
+## cxlmi_poison_list_header.flags
+CXL_POISON_FLAG_MORE_RECORDS = 0x01
+CXL_POISON_FLAG_OVERFLOW = 0x02
+CXL_POISON_FLAG_SCANNING = 0x04
+
+## Media error record source, bits 2:0 of the address
+PoisonSourceNames = {
+    0: "unknown",
+    1: "external",
+    2: "internal",
+    3: "injected",
+    7: "vendor",
+}
+
+
+class cxlmi_cmd_poison_list_input(Structure):
+    """
+    address: the starting device physical address, 64 bytes aligned.
+
+    length: the range length, in units of 64 bytes.
+    """
+    _fields_ = [
+        ("address", c_uint64),
+        ("length", c_uint64),
+    ]
+    _pack_ = 1
+
+
+class cxlmi_media_error_record(Structure):
+    _fields_ = [
+        ("address", c_uint64),
+        ("length", c_uint32),
+        ("rsvd", c_uint32),
+    ]
+    _pack_ = 1
+
+
+class cxlmi_poison_list_header(Structure):
+    _fields_ = [
+        ("flags", c_uint8),
+        ("rsvd", c_uint8),
+        ("overflow_timestamp", c_uint64),
+        ("count", c_uint16),
+        ("rsvd2", c_uint8 * 0x14),
+    ]
+    _pack_ = 1
+
+
+## cxlmi_cmd_scan_media_input.flags
+CXL_SCAN_MEDIA_FLAG_NO_EVENT_LOG = 0x01
+
+## cxlmi_scan_media_results_header.flags
+CXL_SCAN_MEDIA_FLAG_MORE_RECORDS = 0x01
+CXL_SCAN_MEDIA_FLAG_STOPPED = 0x02
+
+
+class cxlmi_cmd_scan_media_input(Structure):
+    """
+    address: the starting device physical address, 64 bytes aligned.
+
+    length: the range length, in units of 64 bytes.
+
+    flags: bit 0, do not add Media Error events to the event log.
+    """
+    _fields_ = [
+        ("address", c_uint64),
+        ("length", c_uint64),
+        ("flags", c_uint8),
+    ]
+    _pack_ = 1
+
+
+class cxlmi_scan_media_results_header(Structure):
+    """
+    restart_address/restart_length: where to scan again if the scan stopped
+    prematurely, length in units of 64 bytes.
+    """
+    _fields_ = [
+        ("restart_address", c_uint64),
+        ("restart_length", c_uint64),
+        ("flags", c_uint8),
+        ("rsvd", c_uint8),
+        ("count", c_uint16),
+        ("rsvd2", c_uint8 * 0xC),
+    ]
+    _pack_ = 1
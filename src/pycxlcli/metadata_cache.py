@@ -0,0 +1,147 @@
+import os
+import json
+import tempfile
+import threading
+
+
+def get_default_cache_dir():
+    """
+    $PYCXL_CACHE_DIR, or pycxlcli under $XDG_CACHE_HOME (default ~/.cache)
+    """
+    cache_dir = os.environ.get("PYCXL_CACHE_DIR")
+    if cache_dir:
+        return cache_dir
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "pycxlcli")
+
+
+def atomic_write_text(path, text, mode=None):
+    """
+    Write text to path through a temporary file and a rename, readers see
+    either the old or the new file, never a partial one.
+
+    :param mode: the file permissions, default readable by the owner only
+    """
+    dir_name = os.path.dirname(path) or "."
+    os.makedirs(dir_name, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dir_name, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        if mode is not None:
+            os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def atomic_write_json(path, obj):
+    """
+    Write obj as JSON to path atomically, see atomic_write_text()
+    """
+    atomic_write_text(path, json.dumps(obj))
+
+
+class DeviceMetadataCache(object):
+    """
+    On-disk cache of the static metadata of CXL memory devices: the command table,
+    the Identify payload and the supported logs.
+
+    There is one JSON file per device serial number, holding the firmware version the
+    metadata was read with, a lookup with another firmware version is a miss. Files
+    are written atomically(temporary file + rename) and kept in memory after the
+    first lookup, so repeated lookups do not touch the disk.
+
+    The kernel only reads the firmware version at probe time, call invalidate()
+    after activating a new firmware.
+    """
+    def __init__(self, cache_dir=None):
+        self._cache_dir = cache_dir or get_default_cache_dir()
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @property
+    def cache_dir(self):
+        return self._cache_dir
+
+    @staticmethod
+    def is_cacheable(serial, firmware_version):
+        """
+        Devices without a serial number(0) can not be told apart, do not cache them.
+        """
+        if not serial or not firmware_version:
+            return False
+        try:
+            return int(serial, 0) != 0
+        except ValueError:
+            return True
+
+    def _get_file_path(self, serial):
+        return os.path.join(self._cache_dir, "%s.json" % serial.replace(os.sep, "_"))
+
+    def _load(self, serial):
+        entry = self._entries.get(serial)
+        if entry is None:
+            try:
+                with open(self._get_file_path(serial), "r") as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                entry = {}
+            self._entries[serial] = entry
+        return entry
+
+    def get(self, serial, firmware_version, key):
+        """
+        Return the cached value of key('commands', 'identify', 'supported_logs'),
+        None if not cached for this firmware version.
+        """
+        if not DeviceMetadataCache.is_cacheable(serial, firmware_version):
+            return None
+        with self._lock:
+            entry = self._load(serial)
+        if entry.get("firmware_version") != firmware_version:
+            return None
+        return entry.get(key)
+
+    def put(self, serial, firmware_version, key, value):
+        """
+        Store value under key, value must be JSON serializable.
+        """
+        if not DeviceMetadataCache.is_cacheable(serial, firmware_version):
+            return
+        with self._lock:
+            entry = self._load(serial)
+            if entry.get("firmware_version") != firmware_version:
+                entry = {"firmware_version": firmware_version}
+            else:
+                entry = dict(entry)
+            entry[key] = value
+            atomic_write_json(self._get_file_path(serial), entry)
+            self._entries[serial] = entry
+
+    def invalidate(self, serial):
+        """
+        Drop everything cached for a device, e.g. after firmware activation.
+        """
+        with self._lock:
+            self._entries.pop(serial, None)
+            try:
+                os.unlink(self._get_file_path(serial))
+            except FileNotFoundError:
+                pass
+
+
+_default_cache = None
+
+def get_default_metadata_cache():
+    """
+    The process wide DeviceMetadataCache in get_default_cache_dir()
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = DeviceMetadataCache()
+    return _default_cache
@@ -0,0 +1,254 @@
+import time
+import threading
+import socketserver
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from .linux_utils import get_cxl_dev_bdf_by_name, PCIBusInfo
+from .health_info import CXL_HEALTH_TEMPERATURE_UNSUPPORTED
+from .metadata_cache import atomic_write_text
+from .parallel import run_on_devices, DEFAULT_JOBS
+
+## Content type of the Prometheus text exposition format
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_LISTEN_PORT = 9813
+
+## metric name -> (type, help)
+MetricTable = {
+    "pycxl_up": ("gauge", "1 if the last collection of the device succeeded"),
+    "pycxl_device_collection_duration_seconds": ("gauge", "Seconds spent collecting the metrics of the device"),
+    "pycxl_info": ("gauge", "Static information of the device"),
+    "pycxl_ram_size_bytes": ("gauge", "Volatile capacity"),
+    "pycxl_pmem_size_bytes": ("gauge", "Persistent capacity"),
+    "pycxl_health_status": ("gauge", "Health Status of Get Health Info, a bitmask"),
+    "pycxl_media_status": ("gauge", "Media Status of Get Health Info"),
+    "pycxl_additional_status": ("gauge", "Additional Status of Get Health Info, a bitmask"),
+    "pycxl_life_used_ratio": ("gauge", "Life used of the device, 0 to 1"),
+    "pycxl_temperature_celsius": ("gauge", "Device temperature"),
+    "pycxl_dirty_shutdowns_total": ("counter", "Dirty shutdown count"),
+    "pycxl_corrected_volatile_errors_total": ("counter", "Corrected volatile error count"),
+    "pycxl_corrected_persistent_errors_total": ("counter", "Corrected persistent error count"),
+    "pycxl_pcie_aer_correctable_errors_total": ("counter", "PCIe AER correctable errors"),
+    "pycxl_pcie_aer_nonfatal_errors_total": ("counter", "PCIe AER non-fatal errors"),
+    "pycxl_pcie_aer_fatal_errors_total": ("counter", "PCIe AER fatal errors"),
+    "pycxl_pcie_link_speed_gts": ("gauge", "PCIe link speed in GT/s"),
+    "pycxl_pcie_link_width": ("gauge", "PCIe link width"),
+    "pycxl_collection_duration_seconds": ("gauge", "Seconds spent by the last collection of all the devices"),
+    "pycxl_last_collection_timestamp_seconds": ("gauge", "Unix time of the last collection"),
+}
+
+
+def _escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_metrics(samples):
+    """
+    Format samples in the Prometheus text exposition format.
+
+    :param samples: a list of (metric name, labels dict, value), grouped by metric
+    name in the order of MetricTable
+    :return: the text
+    """
+    by_name = {}
+    for name, labels, value in samples:
+        by_name.setdefault(name, []).append((labels, value))
+    lines = []
+    for name, (metric_type, metric_help) in MetricTable.items():
+        if name not in by_name:
+            continue
+        lines.append("# HELP %s %s" % (name, metric_help))
+        lines.append("# TYPE %s %s" % (name, metric_type))
+        for labels, value in by_name[name]:
+            label_text = ",".join('%s="%s"' % (k, _escape_label_value(v)) for k, v in sorted(labels.items()))
+            lines.append("%s%s %s" % (name,
+                                      "{%s}" % label_text if label_text else "",
+                                      repr(value) if isinstance(value, float) else value))
+    return "\n".join(lines) + "\n"
+
+
+class _DeviceCollector(object):
+    """
+    Collect the samples of one device, keeping the device open between collections.
+
+    A collection abandoned on timeout keeps running in its worker, the lock keeps
+    the next ones off the device(and its buffers) until it returns.
+    """
+    def __init__(self, dev_name, open_device):
+        self._dev_name = dev_name
+        self._lock = threading.Lock()
+        self._open_device = open_device
+        self._cxl_device = None
+        self._bdf = None
+        self._pci_bus_info = None
+
+    @property
+    def busy(self):
+        """ True while a collection is running """
+        return self._lock.locked()
+
+    def collect(self):
+        if not self._lock.acquire(False):
+            raise RuntimeError("the previous collection of %s is still running" % self._dev_name)
+        try:
+            return self._collect()
+        finally:
+            self._lock.release()
+
+    def _collect(self):
+        if self._cxl_device is None:
+            self._cxl_device = self._open_device(self._dev_name)
+            self._bdf = get_cxl_dev_bdf_by_name(self._dev_name)
+            self._pci_bus_info = PCIBusInfo(self._bdf) if self._bdf else None
+        labels = {"device": self._dev_name}
+        samples = []
+        try:
+            health = self._cxl_device.get_health_info()
+        except Exception:
+            # Reopen the device next time, it may have been replugged
+            self._cxl_device = None
+            raise
+        samples.append(("pycxl_health_status", labels, health.health_status))
+        samples.append(("pycxl_media_status", labels, health.media_status))
+        samples.append(("pycxl_additional_status", labels, health.additional_status))
+        samples.append(("pycxl_life_used_ratio", labels, health.life_used / 100))
+        if health.device_temperature != CXL_HEALTH_TEMPERATURE_UNSUPPORTED:
+            samples.append(("pycxl_temperature_celsius", labels, health.device_temperature))
+        samples.append(("pycxl_dirty_shutdowns_total", labels, health.dirty_shutdown_count))
+        samples.append(("pycxl_corrected_volatile_errors_total", labels, health.corrected_volatile_error_count))
+        samples.append(("pycxl_corrected_persistent_errors_total", labels, health.corrected_persistent_error_count))
+        cxl_bus_info = self._cxl_device.cxl_bus_info
+        cxl_bus_info.invalidate()
+        samples.append(("pycxl_info", dict(labels,
+                                           serial=cxl_bus_info.serial or "",
+                                           firmware_version=cxl_bus_info.firmware_version or "",
+                                           bdf=self._bdf or ""), 1))
+        if cxl_bus_info.ram_size is not None:
+            samples.append(("pycxl_ram_size_bytes", labels, cxl_bus_info.ram_size))
+        if cxl_bus_info.pmem_size is not None:
+            samples.append(("pycxl_pmem_size_bytes", labels, cxl_bus_info.pmem_size))
+        if self._pci_bus_info is not None:
+            pci = self._pci_bus_info
+            pci.invalidate()
+            for metric, counters in (("pycxl_pcie_aer_correctable_errors_total", pci.aer_dev_correctable),
+                                     ("pycxl_pcie_aer_nonfatal_errors_total", pci.aer_dev_nonfatal),
+                                     ("pycxl_pcie_aer_fatal_errors_total", pci.aer_dev_fatal)):
+                for error, count in counters.items():
+                    samples.append((metric, dict(labels, error=error), count))
+            for metric, kind, value in (("pycxl_pcie_link_speed_gts", "current", pci.current_link_speed),
+                                        ("pycxl_pcie_link_speed_gts", "max", pci.max_link_speed),
+                                        ("pycxl_pcie_link_width", "current", pci.current_link_width),
+                                        ("pycxl_pcie_link_width", "max", pci.max_link_width)):
+                if value is not None:
+                    samples.append((metric, dict(labels, kind=kind), value))
+        return samples
+
+
+class HealthCollector(object):
+    """
+    Collect the health metrics of many devices in a background thread, every
+    interval seconds, and keep the formatted text, a scrape returns it at once
+    and never waits on a mailbox round trip.
+    """
+    def __init__(self, dev_names, open_device, interval=15.0, jobs=DEFAULT_JOBS, timeout=None, on_collected=None):
+        """
+        :param open_device: open_device(dev_name) returns a CXLMemDevice
+        :param timeout: per-device timeout in seconds, default the interval
+        :param on_collected: on_collected(text) is called after each collection
+        """
+        self._collectors = {i: _DeviceCollector(i, open_device) for i in dev_names}
+        self._dev_names = list(dev_names)
+        self.interval = interval
+        self._jobs = jobs
+        self._timeout = timeout or interval
+        self._on_collected = on_collected
+        self._text = ""
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def text(self):
+        """ The metrics of the last collection """
+        with self._lock:
+            return self._text
+
+    def collect(self):
+        """
+        Collect all the devices once.
+
+        :return: the formatted metrics
+        """
+        start = time.monotonic()
+        samples = []
+        # A device still busy with an abandoned collection is reported down, not
+        # collected again
+        busy = [i for i in self._dev_names if self._collectors[i].busy]
+        for dev_name in busy:
+            samples.append(("pycxl_up", {"device": dev_name}, 0))
+        dev_names = [i for i in self._dev_names if i not in busy]
+        for result in run_on_devices(dev_names, lambda i: self._collectors[i].collect(), self._jobs, self._timeout):
+            labels = {"device": result.dev_name}
+            samples.append(("pycxl_up", labels, 1 if result.ok else 0))
+            samples.append(("pycxl_device_collection_duration_seconds", labels, result.elapsed))
+            if result.ok:
+                samples.extend(result.value)
+        samples.append(("pycxl_collection_duration_seconds", {}, time.monotonic() - start))
+        samples.append(("pycxl_last_collection_timestamp_seconds", {}, time.time()))
+        text = format_metrics(samples)
+        with self._lock:
+            self._text = text
+        if self._on_collected is not None:
+            self._on_collected(text)
+        return text
+
+    def _run(self):
+        while not self._stop.is_set():
+            start = time.monotonic()
+            self.collect()
+            self._stop.wait(max(0, self.interval - (time.monotonic() - start)))
+
+    def start(self):
+        """ Collect once, then keep collecting in a daemon thread """
+        self.collect()
+        self._thread = threading.Thread(target=self._run, name="pycxl-collector")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def write_textfile(path, text):
+    """
+    Write the metrics for the node_exporter textfile collector, atomically and
+    readable by everyone.
+    """
+    atomic_write_text(path, text, 0o644)
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_metrics_server(collector, host="127.0.0.1", port=DEFAULT_LISTEN_PORT):
+    """
+    An HTTP server answering GET /metrics with the text of collector, call
+    serve_forever() on it.
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = collector.text.encode()
+            self.send_response(200)
+            self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return _ThreadingHTTPServer((host, port), MetricsHandler)
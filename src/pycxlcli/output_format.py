@@ -0,0 +1,122 @@
+from abc import ABCMeta, abstractmethod
+import csv
+import json
+import threading
+from ctypes import Array, Structure, c_char
+
+def _ctypes_value(value):
+    if isinstance(value, Structure):
+        return structure_to_dict(value)
+    if isinstance(value, Array):
+        return [_ctypes_value(i) for i in value]
+    if isinstance(value, bytes):
+        return value.decode(errors="replace")
+    return value
+
+
+def structure_fields(ctype):
+    """
+    The field names of a ctypes structure, without the reserved ones.
+    """
+    return [name for name, *_ in ctype._fields_ if not name.startswith("rsvd")]
+
+
+def structure_to_dict(structure):
+    """
+    Serialize a ctypes structure by its _fields_, without the reserved fields.
+    Nested structures become dicts, arrays lists and char arrays strings.
+    """
+    result = {}
+    for name, ctype, *_ in structure._fields_:
+        if name.startswith("rsvd"):
+            continue
+        value = getattr(structure, name)
+        if isinstance(ctype, type) and issubclass(ctype, Array) and ctype._type_ is c_char:
+            value = value.decode(errors="replace")
+        result[name] = _ctypes_value(value)
+    return result
+
+
+class RecordWriter(object, metaclass=ABCMeta):
+    """
+    Base class of the writers of a stream of records(dicts), each record is
+    written as soon as it is given, nothing is held back but the file buffer.
+    Writers are thread safe.
+    """
+    def __init__(self, f):
+        self._f = f
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def _write(self, record):
+        """ Write one record to the file, called with the lock held. """
+
+    def write(self, record):
+        with self._lock:
+            self._write(record)
+
+    def flush(self):
+        with self._lock:
+            self._f.flush()
+
+    def close(self):
+        """ Finish the stream, the file is left open """
+        self.flush()
+
+
+class NDJSONWriter(RecordWriter):
+    """
+    One JSON object per line.
+    """
+    def _write(self, record):
+        self._f.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+
+class JSONWriter(RecordWriter):
+    """
+    A JSON array of the records, written one element at a time.
+    """
+    def __init__(self, f):
+        super(JSONWriter, self).__init__(f)
+        self._count = 0
+
+    def _write(self, record):
+        self._f.write("[\n" if self._count == 0 else ",\n")
+        self._f.write(json.dumps(record))
+        self._count += 1
+
+    def close(self):
+        with self._lock:
+            self._f.write("[]\n" if self._count == 0 else "\n]\n")
+        self.flush()
+
+
+class CSVWriter(RecordWriter):
+    """
+    CSV with a header row, the columns are fieldnames or the keys of the first
+    record. Lists and dicts are written as JSON.
+    """
+    def __init__(self, f, fieldnames=None):
+        super(CSVWriter, self).__init__(f)
+        self._fieldnames = fieldnames
+        self._writer = None
+
+    def _write(self, record):
+        if self._writer is None:
+            self._writer = csv.DictWriter(self._f, self._fieldnames or list(record), extrasaction="ignore")
+            self._writer.writeheader()
+        self._writer.writerow({k: json.dumps(v) if isinstance(v, (list, dict)) else v for k, v in record.items()})
+
+
+def get_record_writer(output_format, f, fieldnames=None):
+    """
+    :param output_format: json, ndjson or csv
+    :param fieldnames: the CSV columns
+    """
+    if output_format == "json":
+        return JSONWriter(f)
+    if output_format == "ndjson":
+        return NDJSONWriter(f)
+    if output_format == "csv":
+        return CSVWriter(f, fieldnames)
+    raise ValueError("unknown output format %s" % output_format)
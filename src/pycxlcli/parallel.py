@@ -0,0 +1,114 @@
+import time
+import threading
+from collections import namedtuple, deque
+
+## Default number of devices handled concurrently
+DEFAULT_JOBS = 8
+
+
+class DeviceTimeoutError(TimeoutError):
+    """ The work on one device did not finish within its timeout. """
+
+
+class DeviceResult(namedtuple('DeviceResult', ['dev_name', 'value', 'error', 'elapsed'])):
+    """
+    The outcome of running a function against one device.
+
+    dev_name: the device the function ran against.
+
+    value: the function return value, None if it failed.
+
+    error: the exception raised (DeviceTimeoutError on timeout), None on success.
+
+    elapsed: seconds spent on the device.
+    """
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class _DeviceTask(object):
+    __slots__ = ('dev_name', 'started', 'result', 'done')
+
+    def __init__(self, dev_name):
+        self.dev_name = dev_name
+        self.started = None
+        self.result = None
+        self.done = threading.Event()
+
+
+def run_on_devices(dev_names, func, jobs=DEFAULT_JOBS, timeout=None):
+    """
+    Run func(dev_name) for every device on a bounded pool of worker threads.
+
+    Results are yielded in the order of dev_names, each one as soon as it and all
+    the devices before it are finished, so callers can stream them. A device that
+    does not finish within timeout seconds (counted from when a worker picks it up)
+    is reported with a DeviceTimeoutError, and its worker is replaced so a hung
+    mailbox never stalls the rest of the sweep. Workers are daemon threads, a hung
+    ioctl does not keep the process alive.
+
+    Args:
+        dev_names (list): The device names, e.g. ['mem0', 'mem1'].
+        func (callable): Called with one device name, must open its own device.
+        jobs (int): Maximum number of devices handled concurrently.
+        timeout (float): Per-device timeout in seconds, None to wait forever.
+
+    Yields:
+        DeviceResult: One per device, in input order.
+    """
+    tasks = [_DeviceTask(dev_name) for dev_name in dev_names]
+    pending = deque(tasks)
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                task = pending.popleft()
+                task.started = time.monotonic()
+            try:
+                result = DeviceResult(task.dev_name, func(task.dev_name), None,
+                                      time.monotonic() - task.started)
+            except Exception as e:
+                result = DeviceResult(task.dev_name, None, e,
+                                      time.monotonic() - task.started)
+            with lock:
+                if task.done.is_set():
+                    # Timed out, a replacement worker already took over this slot
+                    return
+                task.result = result
+                task.done.set()
+
+    def start_worker():
+        t = threading.Thread(target=worker, name="pycxl-worker")
+        t.daemon = True
+        t.start()
+
+    for _ in range(max(1, min(jobs or 1, len(tasks)))):
+        start_worker()
+    try:
+        for task in tasks:
+            while not task.done.is_set():
+                started = task.started
+                if timeout is None:
+                    task.done.wait()
+                elif started is None:
+                    task.done.wait(timeout)
+                elif not task.done.wait(max(0, started + timeout - time.monotonic())):
+                    with lock:
+                        if not task.done.is_set():
+                            task.result = DeviceResult(task.dev_name,
+                                                       None,
+                                                       DeviceTimeoutError("%s timed out after %ss" % (task.dev_name, timeout)),
+                                                       time.monotonic() - started)
+                            task.done.set()
+                            # The worker is stuck in this device, give its slot to a new one
+                            start_worker()
+            yield task.result
+    finally:
+        with lock:
+            pending.clear()
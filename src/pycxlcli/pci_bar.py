@@ -0,0 +1,355 @@
+import os
+import mmap
+import threading
+from ctypes import Structure, c_uint32, c_uint64, sizeof
+from .pci_config import (
+    CXL_REGLOC_RBI_COMPONENT,
+    CXL_REGLOC_RBI_MEMDEV,
+    )
+
+## Component registers, CXL 3.0 8.2.3: the CXL.cache and CXL.mem registers start at
+## 4KB, with the CXL Capability Header array
+CXL_CM_OFFSET = 0x1000
+CXL_CM_CAP_HDR_ID_MASK = 0xFFFF
+CXL_CM_CAP_CAP_ID_RAS = 0x2
+CXL_CM_CAP_CAP_ID_HDM = 0x5
+## Device registers, CXL 3.0 8.2.8: the Device Capabilities Array
+CXL_DEV_CAP_ARRAY_OFFSET = 0x0
+CXL_DEV_CAP_HEADER_OFFSET = 0x10
+CXL_DEV_CAP_HEADER_SIZE = 0x10
+CXL_DEV_CAP_CAP_ID_DEVICE_STATUS = 0x1
+CXL_DEV_CAP_CAP_ID_PRIMARY_MAILBOX = 0x2
+CXL_DEV_CAP_CAP_ID_SECONDARY_MAILBOX = 0x3
+CXL_DEV_CAP_CAP_ID_MEMDEV = 0x4000
+## HDM decoders, CXL 3.0 8.2.4.19
+CXL_HDM_DECODER0_OFFSET = 0x10
+CXL_HDM_DECODER_SIZE = 0x20
+
+
+class cxl_ras_capability_regs(Structure):
+    """
+    CXL RAS Capability Structure, CXL 3.0 8.2.4.16
+    """
+    _fields_ = [
+        ("uncorrectable_error_status", c_uint32),
+        ("uncorrectable_error_mask", c_uint32),
+        ("uncorrectable_error_severity", c_uint32),
+        ("correctable_error_status", c_uint32),
+        ("correctable_error_mask", c_uint32),
+        ("error_capability_control", c_uint32),
+        ("header_log", c_uint32 * 16),
+    ]
+    _pack_ = 1
+
+    @property
+    def first_error_pointer(self):
+        return self.error_capability_control & 0x3F
+
+
+class cxl_hdm_decoder_capability_regs(Structure):
+    """
+    CXL HDM Decoder Capability and Global Control registers
+    """
+    _fields_ = [
+        ("capability", c_uint32),
+        ("global_control", c_uint32),
+        ("rsvd", c_uint32 * 2),
+    ]
+    _pack_ = 1
+
+    @property
+    def decoder_count(self):
+        count = self.capability & 0xF
+        return count * 2 if count else 1
+
+    @property
+    def target_count(self):
+        return (self.capability >> 4) & 0xF
+
+    @property
+    def enabled(self):
+        return bool(self.global_control & 0x2)
+
+
+class cxl_hdm_decoder_regs(Structure):
+    """
+    One CXL HDM Decoder, target_list is the DPA Skip of a device decoder
+    """
+    _fields_ = [
+        ("base_low", c_uint32),
+        ("base_high", c_uint32),
+        ("size_low", c_uint32),
+        ("size_high", c_uint32),
+        ("control", c_uint32),
+        ("target_list_low", c_uint32),
+        ("target_list_high", c_uint32),
+        ("rsvd", c_uint32),
+    ]
+    _pack_ = 1
+
+    @property
+    def base(self):
+        return (self.base_high << 32) | (self.base_low & 0xF0000000)
+
+    @property
+    def size(self):
+        return (self.size_high << 32) | (self.size_low & 0xF0000000)
+
+    @property
+    def interleave_granularity(self):
+        return 256 << (self.control & 0xF)
+
+    @property
+    def interleave_ways(self):
+        ways = (self.control >> 4) & 0xF
+        return 1 << ways if ways < 8 else 3 << (ways - 8)
+
+    @property
+    def committed(self):
+        return bool(self.control & 0x400)
+
+    @property
+    def error_not_committed(self):
+        return bool(self.control & 0x800)
+
+
+class cxl_mailbox_regs(Structure):
+    """
+    The registers of a Mailbox, CXL 3.0 8.2.8.4, without the Command Payload
+    """
+    _fields_ = [
+        ("capabilities", c_uint32),
+        ("control", c_uint32),
+        ("command", c_uint64),
+        ("status", c_uint64),
+        ("background_command_status", c_uint64),
+    ]
+    _pack_ = 1
+
+    @property
+    def payload_size(self):
+        return 1 << (self.capabilities & 0x1F)
+
+    @property
+    def doorbell(self):
+        return bool(self.control & 0x1)
+
+    @property
+    def background_operation(self):
+        return bool(self.status & 0x1)
+
+    @property
+    def return_code(self):
+        return (self.status >> 32) & 0xFFFF
+
+    @property
+    def background_opcode(self):
+        return self.background_command_status & 0xFFFF
+
+    @property
+    def background_percentage(self):
+        return (self.background_command_status >> 16) & 0x7F
+
+    @property
+    def background_return_code(self):
+        return (self.background_command_status >> 32) & 0xFFFF
+
+
+class cxl_memdev_status_regs(Structure):
+    """
+    Memory Device Status register, CXL 3.0 8.2.8.5.1
+    """
+    _fields_ = [
+        ("status", c_uint64),
+    ]
+    _pack_ = 1
+
+    @property
+    def fatal(self):
+        return bool(self.status & 0x1)
+
+    @property
+    def fw_halt(self):
+        return bool(self.status & 0x2)
+
+    @property
+    def media_status(self):
+        return (self.status >> 2) & 0x3
+
+    @property
+    def mailbox_ready(self):
+        return bool(self.status & 0x10)
+
+    @property
+    def reset_needed(self):
+        return (self.status >> 5) & 0x7
+
+
+class PCIBar(object):
+    """
+    A BAR mapped through its sysfs resourceN file, or any file standing in for one.
+
+    Typed views are ctypes structures over the mapping, reading a field reads the
+    register, nothing is copied. ctypes only maps writable buffers, so the file is
+    opened read-write if possible(root), else the mapping is read-only and views are
+    copies taken when view() is called.
+    """
+    def __init__(self, path):
+        self.path = path
+        try:
+            fd = os.open(path, os.O_RDWR | getattr(os, "O_CLOEXEC", 0))
+            access = mmap.ACCESS_WRITE
+        except PermissionError:
+            fd = os.open(path, os.O_RDONLY | getattr(os, "O_CLOEXEC", 0))
+            access = mmap.ACCESS_READ
+        try:
+            self.size = os.fstat(fd).st_size
+            if self.size == 0:
+                raise ValueError("%s is empty, not a memory BAR" % path)
+            self._map = mmap.mmap(fd, self.size, access=access)
+        finally:
+            os.close(fd)
+        self.writable = access == mmap.ACCESS_WRITE
+
+    def view(self, ctype, offset):
+        """
+        The registers of type ctype at offset in the BAR.
+        """
+        if offset < 0 or offset + sizeof(ctype) > self.size:
+            raise ValueError("registers at %#x-%#x are out of the BAR of %#x bytes" % (offset, offset + sizeof(ctype), self.size))
+        if self.writable:
+            return ctype.from_buffer(self._map, offset)
+        return ctype.from_buffer_copy(self._map, offset)
+
+    def read32(self, offset):
+        return self.view(c_uint32, offset).value
+
+    def read64(self, offset):
+        return self.view(c_uint64, offset).value
+
+    def close(self):
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # Views are still referenced, the mapping goes with the last one
+                pass
+            self._map = None
+
+
+class CXLRegisterMap(object):
+    """
+    The register blocks of a CXL device found by the Register Locator DVSEC, with
+    typed views of the RAS capability, the HDM decoders and the mailbox status.
+
+    The capability arrays are read once when a block is first used, then each view
+    is a direct read of the BAR, no mailbox command is involved.
+    """
+    def __init__(self, register_blocks, open_bar):
+        """
+        :param register_blocks: the pci_config.CXLRegisterBlock list
+        :param open_bar: open_bar(bir) returns the PCIBar of a BAR
+        """
+        self._blocks = {i.block_id: i for i in register_blocks}
+        self._open_bar = open_bar
+        self._bars = {}
+        self._component_caps = None
+        self._device_caps = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_bdf(cls, bdf):
+        """
+        :return: the CXLRegisterMap of a PCI device, None without Register Locator DVSEC
+        """
+        from .linux_utils import PCIBusInfo
+        config = PCIBusInfo(bdf).decode_pci_config()
+        if config is None or not config.register_blocks:
+            return None
+        bar_prefix = os.path.join(PCIBusInfo.bus_info_prefix, bdf, "resource")
+        return cls(config.register_blocks, lambda bir: PCIBar("%s%d" % (bar_prefix, bir)))
+
+    def _get_block(self, block_id):
+        """
+        :return: (the PCIBar, the offset of the block), raise LookupError if absent
+        """
+        block = self._blocks.get(block_id)
+        if block is None:
+            raise LookupError("no register block %d" % block_id)
+        with self._lock:
+            bar = self._bars.get(block.bir)
+            if bar is None:
+                bar = self._bars[block.bir] = self._open_bar(block.bir)
+        return bar, block.offset
+
+    @property
+    def component_capabilities(self):
+        """
+        The CXL.cache/CXL.mem capabilities, capability ID -> offset in the BAR
+        """
+        if self._component_caps is None:
+            bar, base = self._get_block(CXL_REGLOC_RBI_COMPONENT)
+            base += CXL_CM_OFFSET
+            header = bar.read32(base)
+            caps = {}
+            for i in range(1, ((header >> 24) & 0xFF) + 1):
+                cap_header = bar.read32(base + 4 * i)
+                caps.setdefault(cap_header & CXL_CM_CAP_HDR_ID_MASK, base + (cap_header >> 20))
+            self._component_caps = caps
+        return self._component_caps
+
+    @property
+    def device_capabilities(self):
+        """
+        The device capabilities, capability ID -> (offset in the BAR, length)
+        """
+        if self._device_caps is None:
+            bar, base = self._get_block(CXL_REGLOC_RBI_MEMDEV)
+            count = (bar.read64(base + CXL_DEV_CAP_ARRAY_OFFSET) >> 32) & 0xFFFF
+            caps = {}
+            for i in range(count):
+                header = base + CXL_DEV_CAP_HEADER_OFFSET + i * CXL_DEV_CAP_HEADER_SIZE
+                caps[bar.read32(header) & 0xFFFF] = (base + bar.read32(header + 4), bar.read32(header + 8))
+            self._device_caps = caps
+        return self._device_caps
+
+    def _component_view(self, cap_id, ctype, offset=0):
+        cap_offset = self.component_capabilities.get(cap_id)
+        if cap_offset is None:
+            raise LookupError("no component capability %d" % cap_id)
+        bar, _ = self._get_block(CXL_REGLOC_RBI_COMPONENT)
+        return bar.view(ctype, cap_offset + offset)
+
+    def _device_view(self, cap_id, ctype):
+        cap = self.device_capabilities.get(cap_id)
+        if cap is None:
+            raise LookupError("no device capability %#x" % cap_id)
+        bar, _ = self._get_block(CXL_REGLOC_RBI_MEMDEV)
+        return bar.view(ctype, cap[0])
+
+    def get_ras(self):
+        """ :return: the cxl_ras_capability_regs """
+        return self._component_view(CXL_CM_CAP_CAP_ID_RAS, cxl_ras_capability_regs)
+
+    def get_hdm_decoders(self):
+        """ :return: (the cxl_hdm_decoder_capability_regs, a list of cxl_hdm_decoder_regs) """
+        capability = self._component_view(CXL_CM_CAP_CAP_ID_HDM, cxl_hdm_decoder_capability_regs)
+        decoders = [self._component_view(CXL_CM_CAP_CAP_ID_HDM, cxl_hdm_decoder_regs,
+                                         CXL_HDM_DECODER0_OFFSET + i * CXL_HDM_DECODER_SIZE)
+                    for i in range(capability.decoder_count)]
+        return capability, decoders
+
+    def get_mailbox(self, secondary=False):
+        """ :return: the cxl_mailbox_regs of the primary(or secondary) mailbox """
+        return self._device_view(CXL_DEV_CAP_CAP_ID_SECONDARY_MAILBOX if secondary else CXL_DEV_CAP_CAP_ID_PRIMARY_MAILBOX,
+                                 cxl_mailbox_regs)
+
+    def get_memdev_status(self):
+        """ :return: the cxl_memdev_status_regs """
+        return self._device_view(CXL_DEV_CAP_CAP_ID_MEMDEV, cxl_memdev_status_regs)
+
+    def close(self):
+        with self._lock:
+            for bar in self._bars.values():
+                bar.close()
+            self._bars = {}
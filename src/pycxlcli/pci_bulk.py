@@ -0,0 +1,134 @@
+import os
+import re
+import time
+from collections import namedtuple
+from .linux_utils import (
+    PCIBusInfo,
+    CXLMemBDFIndex,
+    cxl_mem_bdf_index,
+    _read_sysfs_file,
+    _write_sysfs_file,
+    )
+from .parallel import run_on_devices, DEFAULT_JOBS
+
+## Seconds to wait at most for a device to come back
+DEFAULT_READY_TIMEOUT = 30.0
+## The readiness polls start at the first interval and double up to the maximum
+READY_POLL_INTERVAL = 0.001
+READY_MAX_POLL_INTERVAL = 0.1
+## The operations of bulk_pci_operation
+PCI_OPERATION_RESET = "reset"
+PCI_OPERATION_REMOVE_RESCAN = "remove-rescan"
+
+
+class PCIOperationResult(namedtuple('PCIOperationResult', ['bdf', 'operation', 'memdevs_before', 'memdevs_after', 'ready_time'])):
+    """
+    bdf: the PCI device.
+
+    operation: 'reset' or 'remove-rescan'.
+
+    memdevs_before, memdevs_after: the CXL memory devices of the PCI device before
+    the operation and once it is ready again, the names may change on a rescan.
+
+    ready_time: seconds from the operation to the device being ready.
+    """
+    __slots__ = ()
+
+
+def get_memdev_names(bdf):
+    """
+    The CXL memory devices(memX) bound under a PCI device.
+    """
+    try:
+        return sorted(i for i in os.listdir(os.path.join(PCIBusInfo.bus_info_prefix, bdf)) if re.fullmatch(r'mem\d+', i))
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+
+
+def get_rescan_path(bdf):
+    """
+    The rescan attribute bringing a removed device back: the one of its parent
+    bridge, or of the whole bus for a device right below a host bridge.
+    """
+    parent = os.path.basename(os.path.dirname(os.path.realpath(os.path.join(PCIBusInfo.bus_info_prefix, bdf))))
+    if CXLMemBDFIndex.bdf_pattern.fullmatch(parent):
+        return os.path.join(PCIBusInfo.bus_info_prefix, parent, "rescan")
+    return os.path.join(os.path.dirname(PCIBusInfo.bus_info_prefix.rstrip(os.sep)), "rescan")
+
+
+def is_device_ready(bdf, n_memdevs=0):
+    """
+    A device is ready when its config space answers(vendor ID not all ones) and
+    at least n_memdevs memory devices are bound under it.
+    """
+    config = _read_sysfs_file(os.path.join(PCIBusInfo.bus_info_prefix, bdf, "config"), True)
+    if not config or len(config) < 2 or config[:2] == b"\xff\xff":
+        return False
+    return len(get_memdev_names(bdf)) >= n_memdevs
+
+
+def wait_for_device(bdf, n_memdevs=0, timeout=DEFAULT_READY_TIMEOUT):
+    """
+    Poll is_device_ready() with an exponential backoff.
+
+    :return: the seconds waited
+    :raise TimeoutError: if the device is not ready within timeout seconds
+    """
+    start = time.monotonic()
+    interval = READY_POLL_INTERVAL
+    while not is_device_ready(bdf, n_memdevs):
+        elapsed = time.monotonic() - start
+        if elapsed >= timeout:
+            raise TimeoutError("%s not ready after %.1fs" % (bdf, elapsed))
+        time.sleep(min(interval, timeout - elapsed))
+        interval = min(interval * 2, READY_MAX_POLL_INTERVAL)
+    return time.monotonic() - start
+
+
+def reset_device(bdf, timeout=DEFAULT_READY_TIMEOUT):
+    """
+    Reset a function through its reset attribute and wait for it to be ready.
+
+    :return: a PCIOperationResult
+    """
+    memdevs = get_memdev_names(bdf)
+    start = time.monotonic()
+    PCIBusInfo(bdf).set_reset()
+    wait_for_device(bdf, len(memdevs), timeout)
+    return PCIOperationResult(bdf, PCI_OPERATION_RESET, memdevs, get_memdev_names(bdf), time.monotonic() - start)
+
+
+def remove_rescan_device(bdf, timeout=DEFAULT_READY_TIMEOUT):
+    """
+    Remove a device, rescan its parent and wait for it to be back and ready.
+
+    :return: a PCIOperationResult
+    """
+    memdevs = get_memdev_names(bdf)
+    rescan_path = get_rescan_path(bdf)
+    start = time.monotonic()
+    PCIBusInfo(bdf).set_remove()
+    _write_sysfs_file(rescan_path, "1")
+    wait_for_device(bdf, len(memdevs), timeout)
+    cxl_mem_bdf_index.invalidate()
+    return PCIOperationResult(bdf, PCI_OPERATION_REMOVE_RESCAN, memdevs, get_memdev_names(bdf), time.monotonic() - start)
+
+
+## operation name -> function(bdf, timeout)
+pci_operations = {
+    PCI_OPERATION_RESET: reset_device,
+    PCI_OPERATION_REMOVE_RESCAN: remove_rescan_device,
+}
+
+
+def bulk_pci_operation(bdfs, operation, jobs=DEFAULT_JOBS, timeout=DEFAULT_READY_TIMEOUT):
+    """
+    Reset or remove and rescan many devices, at most jobs of them at a time.
+
+    :param operation: 'reset' or 'remove-rescan'
+    :param timeout: seconds each device has to be ready again
+    :return: a generator yielding a parallel.DeviceResult per device in the order of
+    bdfs(dev_name is the BDF, value a PCIOperationResult)
+    """
+    func = pci_operations[operation]
+    return run_on_devices(bdfs, lambda bdf: func(bdf, timeout), jobs)
@@ -0,0 +1,509 @@
+import os
+import struct
+import threading
+from collections import namedtuple
+
+## Standard configuration header
+PCI_VENDOR_ID = 0x00
+PCI_DEVICE_ID = 0x02
+PCI_STATUS = 0x06
+PCI_STATUS_CAP_LIST = 0x10
+PCI_CLASS_REVISION = 0x08
+PCI_HEADER_TYPE = 0x0E
+PCI_CAPABILITY_LIST = 0x34
+PCI_STD_HEADER_SIZE = 0x40
+PCI_CFG_SPACE_SIZE = 0x100
+PCI_CFG_SPACE_EXP_SIZE = 0x1000
+## Capability chains longer than these loop
+PCI_FIND_CAP_TTL = 48
+PCI_FIND_EXT_CAP_TTL = (PCI_CFG_SPACE_EXP_SIZE - PCI_CFG_SPACE_SIZE) // 8
+
+## Capability IDs
+PCI_CAP_ID_PM = 0x01
+PCI_CAP_ID_MSI = 0x05
+PCI_CAP_ID_VNDR = 0x09
+PCI_CAP_ID_EXP = 0x10
+PCI_CAP_ID_MSIX = 0x11
+PCICapabilityNames = {
+    0x01: "Power Management",
+    0x05: "MSI",
+    0x09: "Vendor Specific",
+    0x0D: "Bridge Subsystem Vendor ID",
+    0x10: "PCI Express",
+    0x11: "MSI-X",
+    0x13: "Advanced Features",
+}
+
+## Extended capability IDs
+PCI_EXT_CAP_ID_ERR = 0x01
+PCI_EXT_CAP_ID_DSN = 0x03
+PCI_EXT_CAP_ID_DVSEC = 0x23
+PCIExtCapabilityNames = {
+    0x01: "Advanced Error Reporting",
+    0x02: "Virtual Channel",
+    0x03: "Device Serial Number",
+    0x04: "Power Budgeting",
+    0x0B: "Vendor Specific",
+    0x0D: "Access Control Services",
+    0x0E: "Alternative Routing-ID",
+    0x10: "Single Root I/O Virtualization",
+    0x15: "Resizable BAR",
+    0x18: "Latency Tolerance Reporting",
+    0x19: "Secondary PCI Express",
+    0x1D: "Downstream Port Containment",
+    0x1E: "L1 PM Substates",
+    0x23: "Designated Vendor-Specific",
+    0x25: "Data Link Feature",
+    0x26: "Physical Layer 16.0 GT/s",
+    0x27: "Lane Margining at the Receiver",
+    0x2A: "Physical Layer 32.0 GT/s",
+    0x2E: "Data Object Exchange",
+    0x31: "Physical Layer 64.0 GT/s",
+}
+
+## PCI Express capability registers, offsets from the capability
+PCI_EXP_FLAGS = 0x02
+PCI_EXP_LNKCAP = 0x0C
+PCI_EXP_LNKSTA = 0x12
+## Link speed encoding of LNKCAP and LNKSTA, GT/s
+PCIeLinkSpeeds = {1: 2.5, 2: 5.0, 3: 8.0, 4: 16.0, 5: 32.0, 6: 64.0}
+PCIeDevicePortTypes = {
+    0x0: "Endpoint",
+    0x1: "Legacy Endpoint",
+    0x4: "Root Port",
+    0x5: "Upstream Port",
+    0x6: "Downstream Port",
+    0x7: "PCIe to PCI Bridge",
+    0x8: "PCI to PCIe Bridge",
+    0x9: "Root Complex Integrated Endpoint",
+    0xA: "Root Complex Event Collector",
+}
+
+## CXL DVSECs, CXL 3.0 8.1
+CXL_DVSEC_VENDOR_ID = 0x1E98
+CXL_DVSEC_PCIE_DEVICE = 0x0
+CXL_DVSEC_FUNCTION_MAP = 0x2
+CXL_DVSEC_PORT_EXTENSIONS = 0x3
+CXL_DVSEC_PORT_GPF = 0x4
+CXL_DVSEC_DEVICE_GPF = 0x5
+CXL_DVSEC_PCIE_FLEXBUS_PORT = 0x7
+CXL_DVSEC_REG_LOCATOR = 0x8
+CXL_DVSEC_MLD = 0x9
+CXL_DVSEC_PCIE_TEST_CAP = 0xA
+CXLDVSECNames = {
+    0x0: "PCIe DVSEC for CXL Devices",
+    0x2: "Non-CXL Function Map",
+    0x3: "CXL Extensions DVSEC for Ports",
+    0x4: "GPF DVSEC for CXL Ports",
+    0x5: "GPF DVSEC for CXL Devices",
+    0x7: "PCIe DVSEC for Flex Bus Port",
+    0x8: "Register Locator DVSEC",
+    0x9: "MLD DVSEC",
+    0xA: "PCIe DVSEC for Test Capability",
+}
+## Register Locator DVSEC register block identifiers
+CXL_REGLOC_RBI_EMPTY = 0
+CXL_REGLOC_RBI_COMPONENT = 1
+CXL_REGLOC_RBI_VIRT = 2
+CXL_REGLOC_RBI_MEMDEV = 3
+CXL_REGLOC_RBI_PMU = 4
+CXLRegisterBlockNames = {
+    0: "Empty",
+    1: "Component Registers",
+    2: "BAR Virtualization ACL Registers",
+    3: "CXL Memory Device Registers",
+    4: "CPMU Registers",
+}
+CXL_REGLOC_ENTRIES_OFFSET = 0x0C
+CXL_REGLOC_ENTRY_SIZE = 8
+
+## Capability bits of the PCIe DVSEC for CXL Devices and the Flex Bus Port DVSEC
+CXLDeviceCapabilityFlags = (("cache_capable", 0x1), ("io_capable", 0x2), ("mem_capable", 0x4), ("mem_hwinit_mode", 0x8))
+CXLFlexBusFlags = (("cache", 0x1), ("io", 0x2), ("mem", 0x4), ("flit_68b_vh", 0x20), ("mld", 0x40))
+
+_u16 = struct.Struct("<H")
+_u32 = struct.Struct("<I")
+
+
+class PCICapability(namedtuple('PCICapability', ['id', 'offset', 'version', 'extended'])):
+    """
+    A capability of the standard(extended False) or the extended(extended True)
+    capability chain, version is 0 for standard capabilities.
+    """
+    __slots__ = ()
+
+    @property
+    def name(self):
+        names = PCIExtCapabilityNames if self.extended else PCICapabilityNames
+        return names.get(self.id, "Unknown %#x" % self.id)
+
+
+class PCILinkInfo(namedtuple('PCILinkInfo', ['port_type', 'max_speed', 'max_width', 'speed', 'width'])):
+    """
+    The link capabilities and status of the PCI Express capability, speeds in
+    GT/s(None if the encoding is unknown), port_type the Device/Port Type.
+    """
+    __slots__ = ()
+
+    @property
+    def port_type_name(self):
+        return PCIeDevicePortTypes.get(self.port_type, "Unknown %#x" % self.port_type)
+
+    @property
+    def link_down(self):
+        """ The link is not trained, Link Status reads an unknown speed or a width of 0 """
+        return bool(self.max_speed and not self.speed) or bool(self.max_width and not self.width)
+
+    @property
+    def degraded(self):
+        return bool(self.max_speed) and (not self.speed or self.speed < self.max_speed) or \
+            bool(self.max_width) and (not self.width or self.width < self.max_width)
+
+    def with_status(self, link_status):
+        """
+        :return: the PCILinkInfo with the speed and width of a Link Status register value
+        """
+        return self._replace(speed=PCIeLinkSpeeds.get(link_status & 0xF), width=(link_status >> 4) & 0x3F)
+
+
+class CXLDVSEC(namedtuple('CXLDVSEC', ['dvsec_id', 'revision', 'offset', 'length', 'fields'])):
+    """
+    A CXL DVSEC, offset is where the capability header is, fields the decoded
+    registers of the DVSECs known here, else empty.
+    """
+    __slots__ = ()
+
+    @property
+    def name(self):
+        return CXLDVSECNames.get(self.dvsec_id, "Unknown CXL DVSEC %#x" % self.dvsec_id)
+
+
+class CXLRegisterBlock(namedtuple('CXLRegisterBlock', ['block_id', 'bir', 'offset'])):
+    """
+    A register block of the Register Locator DVSEC: the BAR(bir) holding it and
+    its offset in the BAR.
+    """
+    __slots__ = ()
+
+    @property
+    def name(self):
+        return CXLRegisterBlockNames.get(self.block_id, "Unknown %#x" % self.block_id)
+
+
+class PCIConfig(namedtuple('PCIConfig', ['vendor_id', 'device_id', 'revision', 'class_code', 'header_type',
+                                         'capabilities', 'link', 'serial', 'cxl_dvsecs', 'size'])):
+    """
+    The decoded configuration space of a PCI function.
+
+    capabilities: the PCICapability of both chains, in chain order.
+
+    link: a PCILinkInfo, None without PCI Express capability.
+
+    serial: the Device Serial Number, None if absent.
+
+    cxl_dvsecs: the CXL DVSECs(CXLDVSEC).
+
+    size: bytes of configuration space decoded, 64 when read without privilege.
+    """
+    __slots__ = ()
+
+    def get_dvsec(self, dvsec_id):
+        for i in self.cxl_dvsecs:
+            if i.dvsec_id == dvsec_id:
+                return i
+
+    @property
+    def register_blocks(self):
+        """ The CXLRegisterBlock of the Register Locator DVSEC """
+        dvsec = self.get_dvsec(CXL_DVSEC_REG_LOCATOR)
+        return dvsec.fields["blocks"] if dvsec else []
+
+    def to_dict(self):
+        return {"vendor_id": self.vendor_id,
+                "device_id": self.device_id,
+                "revision": self.revision,
+                "class_code": self.class_code,
+                "header_type": self.header_type,
+                "capabilities": [{"id": i.id, "name": i.name, "offset": i.offset, "version": i.version, "extended": i.extended}
+                                 for i in self.capabilities],
+                "link": dict(self.link._asdict(), port_type_name=self.link.port_type_name) if self.link else None,
+                "serial": self.serial,
+                "cxl_dvsecs": [{"id": i.dvsec_id, "name": i.name, "revision": i.revision, "offset": i.offset,
+                                "length": i.length,
+                                "fields": {k: ([j._asdict() for j in v] if k == "blocks" else v) for k, v in i.fields.items()}}
+                               for i in self.cxl_dvsecs],
+                "size": self.size,
+                }
+
+
+def _get_flags(value, flags):
+    return {name: bool(value & mask) for name, mask in flags}
+
+
+def _decode_cxl_device_dvsec(view, offset, length):
+    capability = _u16.unpack_from(view, offset + 0x0A)[0]
+    control = _u16.unpack_from(view, offset + 0x0C)[0]
+    fields = _get_flags(capability, CXLDeviceCapabilityFlags)
+    fields["hdm_count"] = (capability >> 4) & 0x3
+    fields["mem_enable"] = bool(control & 0x4)
+    ranges = []
+    for range_offset in (0x18, 0x28):
+        if range_offset + 0x10 > length:
+            break
+        size_high, size_low, base_high, base_low = struct.unpack_from("<4I", view, offset + range_offset)
+        ranges.append({"size": (size_high << 32) | (size_low & 0xF0000000),
+                       "base": (base_high << 32) | (base_low & 0xF0000000),
+                       "memory_info_valid": bool(size_low & 0x1),
+                       "memory_active": bool(size_low & 0x2),
+                       })
+    fields["ranges"] = ranges[:max(1, fields["hdm_count"])]
+    return fields
+
+
+def _decode_flexbus_port_dvsec(view, offset, length):
+    capability, control, status = struct.unpack_from("<3H", view, offset + 0x0A)
+    return {"capable": _get_flags(capability, CXLFlexBusFlags),
+            "enabled": _get_flags(status, CXLFlexBusFlags),
+            "control": control,
+            }
+
+
+def _decode_register_locator_dvsec(view, offset, length):
+    blocks = []
+    for entry in range(offset + CXL_REGLOC_ENTRIES_OFFSET, offset + length - CXL_REGLOC_ENTRY_SIZE + 1, CXL_REGLOC_ENTRY_SIZE):
+        low, high = struct.unpack_from("<II", view, entry)
+        blocks.append(CXLRegisterBlock((low >> 8) & 0xFF, low & 0x7, (high << 32) | (low & 0xFFFF0000)))
+    return {"blocks": blocks}
+
+
+## DVSEC ID -> decoder(view, offset, length) returning the fields
+_cxl_dvsec_decoders = {
+    CXL_DVSEC_PCIE_DEVICE: _decode_cxl_device_dvsec,
+    CXL_DVSEC_PCIE_FLEXBUS_PORT: _decode_flexbus_port_dvsec,
+    CXL_DVSEC_REG_LOCATOR: _decode_register_locator_dvsec,
+}
+
+
+def iter_capabilities(view):
+    """
+    Walk the standard capability chain.
+
+    :param view: a memoryview(or any buffer) of the configuration space
+    :return: a generator yielding PCICapability
+    """
+    size = len(view)
+    if size < PCI_STD_HEADER_SIZE or not _u16.unpack_from(view, PCI_STATUS)[0] & PCI_STATUS_CAP_LIST:
+        return
+    offset = view[PCI_CAPABILITY_LIST] & ~0x3
+    ttl = PCI_FIND_CAP_TTL
+    while offset >= PCI_STD_HEADER_SIZE and offset + 2 <= size and ttl:
+        cap_id, next_offset = view[offset], view[offset + 1]
+        if cap_id == 0xFF:
+            break
+        yield PCICapability(cap_id, offset, 0, False)
+        offset = next_offset & ~0x3
+        ttl -= 1
+
+
+def iter_ext_capabilities(view):
+    """
+    Walk the extended capability chain, empty if only 256 bytes or less are readable.
+
+    :return: a generator yielding PCICapability
+    """
+    size = len(view)
+    offset = PCI_CFG_SPACE_SIZE
+    ttl = PCI_FIND_EXT_CAP_TTL
+    while offset >= PCI_CFG_SPACE_SIZE and offset + 4 <= size and ttl:
+        header = _u32.unpack_from(view, offset)[0]
+        if header == 0 or header == 0xFFFFFFFF:
+            break
+        yield PCICapability(header & 0xFFFF, offset, (header >> 16) & 0xF, True)
+        offset = (header >> 20) & ~0x3
+        ttl -= 1
+
+
+def decode_link(view, offset):
+    """
+    Decode the link registers of the PCI Express capability at offset.
+    """
+    if offset + PCI_EXP_LNKSTA + 2 > len(view):
+        return None
+    flags = _u16.unpack_from(view, offset + PCI_EXP_FLAGS)[0]
+    link_cap = _u32.unpack_from(view, offset + PCI_EXP_LNKCAP)[0]
+    link_status = _u16.unpack_from(view, offset + PCI_EXP_LNKSTA)[0]
+    return PCILinkInfo((flags >> 4) & 0xF,
+                       PCIeLinkSpeeds.get(link_cap & 0xF),
+                       (link_cap >> 4) & 0x3F,
+                       None, None).with_status(link_status)
+
+
+def decode_dvsec(view, offset):
+    """
+    Decode the DVSEC at offset.
+
+    :return: a CXLDVSEC, None if it is not a CXL DVSEC
+    """
+    if offset + 0x0A > len(view):
+        return None
+    header1 = _u32.unpack_from(view, offset + 4)[0]
+    if header1 & 0xFFFF != CXL_DVSEC_VENDOR_ID:
+        return None
+    revision = (header1 >> 16) & 0xF
+    length = min(header1 >> 20, len(view) - offset)
+    dvsec_id = _u16.unpack_from(view, offset + 8)[0]
+    decoder = _cxl_dvsec_decoders.get(dvsec_id)
+    fields = {}
+    if decoder is not None:
+        try:
+            fields = decoder(view, offset, length)
+        except struct.error:
+            # Shorter than the registers decoded
+            fields = {}
+    return CXLDVSEC(dvsec_id, revision, offset, length, fields)
+
+
+def decode_pci_config(config):
+    """
+    Decode a configuration space in place, nothing is copied out of it.
+
+    :param config: the configuration space, bytes or any buffer(e.g. the sysfs config file)
+    :return: a PCIConfig
+    """
+    view = memoryview(config).cast('B')
+    size = len(view)
+    if size < PCI_STD_HEADER_SIZE:
+        raise ValueError("configuration space of %d bytes is too short" % size)
+    vendor_id, device_id = struct.unpack_from("<HH", view, PCI_VENDOR_ID)
+    class_revision = _u32.unpack_from(view, PCI_CLASS_REVISION)[0]
+    capabilities = list(iter_capabilities(view))
+    link = None
+    for cap in capabilities:
+        if cap.id == PCI_CAP_ID_EXP:
+            link = decode_link(view, cap.offset)
+            break
+    serial = None
+    cxl_dvsecs = []
+    for cap in iter_ext_capabilities(view):
+        capabilities.append(cap)
+        if cap.id == PCI_EXT_CAP_ID_DSN and cap.offset + 12 <= size:
+            serial = struct.unpack_from("<Q", view, cap.offset + 4)[0]
+        elif cap.id == PCI_EXT_CAP_ID_DVSEC:
+            dvsec = decode_dvsec(view, cap.offset)
+            if dvsec is not None:
+                cxl_dvsecs.append(dvsec)
+    return PCIConfig(vendor_id, device_id, class_revision & 0xFF, class_revision >> 8,
+                     view[PCI_HEADER_TYPE] & 0x7F, capabilities, link, serial, cxl_dvsecs, size)
+
+
+def _read_config_u16(config_path, offset):
+    """
+    Read a 16-bit register of a sysfs config file, None if it can not be read.
+    """
+    try:
+        fd = os.open(config_path, os.O_RDONLY | getattr(os, "O_CLOEXEC", 0))
+    except OSError:
+        return None
+    try:
+        data = os.pread(fd, 2, offset)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+    return _u16.unpack(data)[0] if len(data) == 2 else None
+
+
+class PCIConfigCache(object):
+    """
+    The decoded configuration space of each BDF, read and decoded once. An entry
+    is used as long as the sysfs directory of the device is the same one(same
+    inode), a remove and rescan creates a new one, so the device is decoded again.
+    The Link Status register changes with link retraining, it is read again on
+    each get().
+    """
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, bdf):
+        """
+        :return: the PCIConfig of the device, None if its config can not be read
+        """
+        from .linux_utils import PCIBusInfo, _read_sysfs_file
+        path = os.path.join(PCIBusInfo.bus_info_prefix, bdf)
+        try:
+            ino = os.stat(path).st_ino
+        except OSError:
+            self.invalidate(bdf)
+            return None
+        config_path = os.path.join(path, "config")
+        entry = self._entries.get(bdf)
+        if entry is not None and entry[0] == ino:
+            _, decoded, link_status_offset = entry
+            if link_status_offset is None:
+                return decoded
+            link_status = _read_config_u16(config_path, link_status_offset)
+            if link_status is None:
+                return decoded
+            return decoded._replace(link=decoded.link.with_status(link_status))
+        config = _read_sysfs_file(config_path, True)
+        if not config or len(config) < PCI_STD_HEADER_SIZE:
+            return None
+        decoded = decode_pci_config(config)
+        link_status_offset = None
+        if decoded.link is not None:
+            link_status_offset = next(i.offset for i in decoded.capabilities if i.id == PCI_CAP_ID_EXP) + PCI_EXP_LNKSTA
+        with self._lock:
+            self._entries[bdf] = (ino, decoded, link_status_offset)
+        return decoded
+
+    def invalidate(self, bdf=None):
+        """
+        Drop the entry of a device, or all of them.
+        """
+        with self._lock:
+            if bdf is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(bdf, None)
+
+
+## The cache shared by PCIBusInfo.decode_pci_config
+pci_config_cache = PCIConfigCache()
+
+
+def format_pci_config(config):
+    """
+    Render a PCIConfig as text lines.
+    """
+    lines = ["Vendor/Device: %04x:%04x rev %02x, class %06x, header type %d" % (config.vendor_id, config.device_id,
+                                                                               config.revision, config.class_code,
+                                                                               config.header_type)]
+    if config.serial is not None:
+        lines.append("Serial Number: %016x" % config.serial)
+    if config.link is not None:
+        link = config.link
+        lines.append("Link: %s, %s GT/s x%d (max %s GT/s x%d)%s" % (link.port_type_name, link.speed, link.width,
+                                                                   link.max_speed, link.max_width,
+                                                                   ", DOWN" if link.link_down else ", DEGRADED" if link.degraded else ""))
+    lines.append("Capabilities:")
+    for cap in config.capabilities:
+        lines.append("  [%03x] %s%s" % (cap.offset, cap.name, " v%d" % cap.version if cap.extended else ""))
+    for dvsec in config.cxl_dvsecs:
+        lines.append("CXL DVSEC [%03x] %s rev %d" % (dvsec.offset, dvsec.name, dvsec.revision))
+        for key, value in dvsec.fields.items():
+            if key == "blocks":
+                for block in value:
+                    lines.append("  %s: BAR %d offset %#x" % (block.name, block.bir, block.offset))
+            elif key == "ranges":
+                for index, i in enumerate(value):
+                    lines.append("  range%d: base %#x size %#x%s%s" % (index + 1, i["base"], i["size"],
+                                                                       " valid" if i["memory_info_valid"] else "",
+                                                                       " active" if i["memory_active"] else ""))
+            elif isinstance(value, dict):
+                lines.append("  %s: %s" % (key, ", ".join(k for k, v in value.items() if v) or "none"))
+            else:
+                lines.append("  %s: %s" % (key, value))
+    if config.size < PCI_CFG_SPACE_SIZE:
+        lines.append("(only %d bytes of configuration space readable, run as root for the rest)" % config.size)
+    return lines
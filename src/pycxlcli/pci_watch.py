@@ -0,0 +1,177 @@
+import os
+import time
+from collections import namedtuple
+from .linux_utils import PCIBusInfo, _parse_link_speed
+
+## Bytes read from each watched attribute, the AER files are about 300 bytes
+WATCH_READ_SIZE = 4096
+## The AER counter files watched, the key prefix of their counters
+AER_COUNTER_FILES = (("correctable", "aer_dev_correctable"),
+                     ("nonfatal", "aer_dev_nonfatal"),
+                     ("fatal", "aer_dev_fatal"))
+
+
+class SysfsAttrReader(object):
+    """
+    A sysfs attribute kept open and re-read with os.pread() from offset 0, the
+    kernel regenerates the content on each read. The file is reopened after a
+    failed read, e.g. when the device was removed and came back.
+    """
+    __slots__ = ("path", "_fd")
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def read(self):
+        """
+        :return: the raw bytes, None if the attribute can not be read
+        """
+        if self._fd is None:
+            try:
+                self._fd = os.open(self.path, os.O_RDONLY | getattr(os, "O_CLOEXEC", 0))
+            except OSError:
+                return None
+        try:
+            return os.pread(self._fd, WATCH_READ_SIZE, 0)
+        except OSError:
+            self.close()
+            return None
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def _parse_counters(data, prefix, counters):
+    """
+    Parse 'name value' lines of an AER counter file into counters['prefix.name'].
+    """
+    for line in data.split(b"\n"):
+        name, _, value = line.partition(b" ")
+        if value:
+            counters["%s.%s" % (prefix, name.decode())] = int(value)
+
+
+class LinkWatchSample(namedtuple('LinkWatchSample', ['bdf', 'timestamp', 'counters', 'rates',
+                                                     'link_speed', 'link_width',
+                                                     'max_link_speed', 'max_link_width'])):
+    """
+    bdf: the PCI device.
+
+    timestamp: time.monotonic() of the sample.
+
+    counters: AER counter name('correctable.RxErr', 'fatal.TOTAL_ERR_FATAL'...) -> value.
+
+    rates: counter name -> increments per second since the previous sample, empty for
+    the first sample.
+
+    link_speed, link_width: the current link speed(GT/s) and width, None if unknown,
+    a link down reads an unknown speed and a width of 0.
+
+    max_link_speed, max_link_width: the link capabilities.
+    """
+    __slots__ = ()
+
+    @property
+    def link_down(self):
+        return bool(self.max_link_speed and not self.link_speed) or bool(self.max_link_width and not self.link_width)
+
+    @property
+    def speed_degraded(self):
+        return bool(self.max_link_speed) and (not self.link_speed or self.link_speed < self.max_link_speed)
+
+    @property
+    def width_degraded(self):
+        return bool(self.max_link_width) and (not self.link_width or self.link_width < self.max_link_width)
+
+    @property
+    def degraded(self):
+        return self.speed_degraded or self.width_degraded
+
+    def to_dict(self):
+        return {"bdf": self.bdf,
+                "link_speed": self.link_speed,
+                "link_width": self.link_width,
+                "max_link_speed": self.max_link_speed,
+                "max_link_width": self.max_link_width,
+                "link_down": self.link_down,
+                "speed_degraded": self.speed_degraded,
+                "width_degraded": self.width_degraded,
+                "counters": self.counters,
+                "rates": self.rates,
+                }
+
+
+class LinkWatcher(object):
+    """
+    Sample the AER counters and the current link speed and width of one PCI device
+    through attributes kept open, the link capabilities are read once.
+    """
+    def __init__(self, bdf):
+        self.bdf = bdf
+        path = os.path.join(PCIBusInfo.bus_info_prefix, bdf)
+        self._aer = [(prefix, SysfsAttrReader(os.path.join(path, name))) for prefix, name in AER_COUNTER_FILES]
+        self._link_speed = SysfsAttrReader(os.path.join(path, "current_link_speed"))
+        self._link_width = SysfsAttrReader(os.path.join(path, "current_link_width"))
+        pci_bus_info = PCIBusInfo(bdf, ttl=0)
+        self.max_link_speed = pci_bus_info.max_link_speed
+        self.max_link_width = pci_bus_info.max_link_width
+        self._last = None
+
+    def sample(self):
+        """
+        :return: a LinkWatchSample, with the rates against the previous sample
+        """
+        counters = {}
+        for prefix, reader in self._aer:
+            data = reader.read()
+            if data:
+                _parse_counters(data, prefix, counters)
+        data = self._link_speed.read()
+        link_speed = _parse_link_speed(data.decode()) if data else None
+        data = self._link_width.read()
+        link_width = int(data) if data and data.strip().isdigit() else None
+        now = time.monotonic()
+        rates = {}
+        last = self._last
+        if last is not None and now > last.timestamp:
+            elapsed = now - last.timestamp
+            for name, value in counters.items():
+                previous = last.counters.get(name, 0)
+                # A counter going backwards was reset, e.g. by a device reset
+                rates[name] = (value - previous if value >= previous else value) / elapsed
+        self._last = LinkWatchSample(self.bdf, now, counters, rates, link_speed, link_width,
+                                     self.max_link_speed, self.max_link_width)
+        return self._last
+
+    def close(self):
+        for _, reader in self._aer:
+            reader.close()
+        self._link_speed.close()
+        self._link_width.close()
+
+
+def watch_links(bdfs, interval=1.0, count=None):
+    """
+    Sample many devices on the calling thread every interval seconds, the sampling
+    time is taken out of the interval.
+
+    :param count: the number of samples of each device, None for ever
+    :return: a generator yielding the list of LinkWatchSample of each round
+    """
+    watchers = [LinkWatcher(i) for i in bdfs]
+    try:
+        n = 0
+        next_due = time.monotonic()
+        while count is None or n < count:
+            yield [i.sample() for i in watchers]
+            n += 1
+            if count is not None and n >= count:
+                break
+            next_due += interval
+            time.sleep(max(0, next_due - time.monotonic()))
+    finally:
+        for i in watchers:
+            i.close()
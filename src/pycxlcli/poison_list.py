@@ -0,0 +1,178 @@
+import csv
+import json
+from array import array
+from bisect import bisect_left, bisect_right
+from ctypes import sizeof, c_uint8
+from .linux_cxl_ioctl import cxl_mem_command_id
+from .media_operations import (
+    cxlmi_cmd_poison_list_input,
+    cxlmi_media_error_record,
+    cxlmi_poison_list_header,
+    PoisonSourceNames,
+    CXL_POISON_ALIGNMENT,
+    CXL_CAPACITY_MULTIPLIER,
+    CXL_POISON_FLAG_MORE_RECORDS,
+    CXL_POISON_FLAG_OVERFLOW,
+    )
+
+MEDIA_ERROR_RECORD_SIZE = sizeof(cxlmi_media_error_record)
+POISON_LIST_HEADER_SIZE = sizeof(cxlmi_poison_list_header)
+
+
+class PoisonRecordStore(object):
+    """
+    Poisoned DPA ranges kept in three parallel arrays(address, length in bytes,
+    source) instead of one object per record.
+    """
+    __slots__ = ('address', 'length', 'source', '_sorted')
+
+    def __init__(self):
+        self.address = array('Q')
+        self.length = array('Q')
+        self.source = array('B')
+        self._sorted = True
+
+    def __len__(self):
+        return len(self.address)
+
+    def __iter__(self):
+        return zip(self.address, self.length, self.source)
+
+    @property
+    def total_bytes(self):
+        return sum(self.length)
+
+    def append(self, address, length, source=0):
+        if self._sorted and self.address and address < self.address[-1]:
+            self._sorted = False
+        self.address.append(address)
+        self.length.append(length)
+        self.source.append(source)
+
+    def extend_from_payload(self, records, count):
+        """
+        Append count media error records from the records of a Get Poison List
+        output payload, read as arrays of words instead of one ctypes object per record.
+        """
+        records = memoryview(records).cast('B')[:count*MEDIA_ERROR_RECORD_SIZE]
+        raw_address = records.cast('Q')[0::2]
+        mask = ~(CXL_POISON_ALIGNMENT - 1)
+        first = len(self.address)
+        self.address.extend([i & mask for i in raw_address])
+        self.length.extend([i * CXL_POISON_ALIGNMENT for i in records.cast('I')[2::4]])
+        self.source.extend([i & 0x7 for i in raw_address])
+        if self._sorted:
+            address = self.address
+            self._sorted = all(address[i-1] <= address[i] for i in range(max(1, first), len(address)))
+
+    def sort(self):
+        """
+        Sort the ranges by address, in place.
+        """
+        if self._sorted:
+            return
+        order = sorted(range(len(self.address)), key=self.address.__getitem__)
+        self.address = array('Q', [self.address[i] for i in order])
+        self.length = array('Q', [self.length[i] for i in order])
+        self.source = array('B', [self.source[i] for i in order])
+        self._sorted = True
+
+    def merged(self):
+        """
+        Return a new store of the ranges sorted and coalesced, overlapping or
+        adjacent ranges become one range, with the source of the first one.
+        """
+        self.sort()
+        result = PoisonRecordStore()
+        end = None
+        for address, length, source in self:
+            if end is not None and address <= end:
+                if address + length > end:
+                    end = address + length
+                    result.length[-1] = end - result.address[-1]
+                continue
+            result.address.append(address)
+            result.length.append(length)
+            result.source.append(source)
+            end = address + length
+        return result
+
+    def query(self, start, end):
+        """
+        Return a new store of the ranges overlapping [start, end), the store must
+        not hold overlapping ranges, see merged().
+        """
+        self.sort()
+        # Ranges do not overlap, the first candidate is the last range starting before start
+        first = max(0, bisect_right(self.address, start) - 1)
+        last = bisect_left(self.address, end)
+        result = PoisonRecordStore()
+        for i in range(first, last):
+            if self.address[i] + self.length[i] > start:
+                result.address.append(self.address[i])
+                result.length.append(self.length[i])
+                result.source.append(self.source[i])
+        return result
+
+    def export_csv(self, f):
+        writer = csv.writer(f)
+        writer.writerow(("address", "length", "source"))
+        writer.writerows(("%#x" % a, l, PoisonSourceNames.get(s, s)) for a, l, s in self)
+
+    def export_json(self, f):
+        json.dump({"address": self.address.tolist(),
+                   "length": self.length.tolist(),
+                   "source": self.source.tolist()}, f)
+
+
+def iter_poison_payloads(cxl_device, start=0, length=None):
+    """
+    Send Get Poison List for [start, start+length) bytes, and re-send it while
+    the device reports more media error records.
+
+    :param length: bytes, default up to the total capacity of the device
+    :return: a generator yielding (output header, memoryview of its records), valid
+    until the next one is requested
+    """
+    if length is None:
+        length = cxl_device.get_identify().total_capacity * CXL_CAPACITY_MULTIPLIER - start
+    in_buf = cxlmi_cmd_poison_list_input()
+    in_buf.address = start // CXL_POISON_ALIGNMENT * CXL_POISON_ALIGNMENT
+    in_buf.length = -(-length // CXL_POISON_ALIGNMENT)
+    max_records = (cxl_device.payload_max - POISON_LIST_HEADER_SIZE) // MEDIA_ERROR_RECORD_SIZE
+    with cxl_device.buffer_pool.borrow(c_uint8 * (POISON_LIST_HEADER_SIZE + max_records * MEDIA_ERROR_RECORD_SIZE)) as out_buf:
+        header = cxlmi_poison_list_header.from_buffer(out_buf)
+        view = memoryview(out_buf).cast('B')
+        while True:
+            cxl_device.send(cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_POISON, in_buf, out_buf)
+            count = min(header.count, max_records)
+            yield header, view[POISON_LIST_HEADER_SIZE:POISON_LIST_HEADER_SIZE+count*MEDIA_ERROR_RECORD_SIZE]
+            if count == 0 or not (header.flags & CXL_POISON_FLAG_MORE_RECORDS):
+                break
+
+
+def iter_poison_records(cxl_device, start=0, length=None):
+    """
+    Iterate the media error records of a DPA range, following continuations.
+
+    :return: a generator yielding (address, length in bytes, source)
+    """
+    for _, records in iter_poison_payloads(cxl_device, start, length):
+        store = PoisonRecordStore()
+        store.extend_from_payload(records, records.nbytes // MEDIA_ERROR_RECORD_SIZE)
+        for record in store:
+            yield record
+
+
+def read_poison_list(cxl_device, start=0, length=None):
+    """
+    Read the poison list of a DPA range into a PoisonRecordStore.
+
+    :return: (the store, True if the device reported the list overflowed)
+    """
+    store = PoisonRecordStore()
+    overflow = False
+    for header, records in iter_poison_payloads(cxl_device, start, length):
+        store.extend_from_payload(records, records.nbytes // MEDIA_ERROR_RECORD_SIZE)
+        overflow = overflow or bool(header.flags & CXL_POISON_FLAG_OVERFLOW)
+    return store, overflow
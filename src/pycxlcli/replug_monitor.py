@@ -0,0 +1,193 @@
+import os
+import errno
+import socket
+import struct
+import threading
+import ctypes
+
+NETLINK_KOBJECT_UEVENT = 15
+## The multicast group of the uevents sent by the kernel
+UEVENT_KERNEL_GROUP = 1
+
+## inotify masks
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_CLOEXEC = 0o2000000
+inotify_event_header = struct.Struct("iIII")
+
+
+def parse_uevent(data: bytes):
+    """
+    Parse a kernel uevent message, b"action@devpath\\0KEY=VALUE\\0..."
+
+    :return: a dict of the KEY=VALUE pairs
+    """
+    result = {}
+    for i in data.split(b'\0')[1:]:
+        key, sep, value = i.partition(b'=')
+        if sep:
+            result[key.decode(errors="replace")] = value.decode(errors="replace")
+    return result
+
+
+class ReplugMonitor(object):
+    """
+    Learn about device nodes being removed and added again from the kernel uevent
+    netlink socket, or from inotify on the device node directories if netlink is not
+    available, in a background thread.
+
+    Every device node path has a generation, bumped on each add/remove event of
+    that node. A handle opened at one generation is stale once the generation
+    moved on, checking that is a dict lookup instead of an os.stat.
+    """
+    def __init__(self):
+        self._generations = {}
+        self._lock = threading.Lock()
+        self._source = None
+        self._inotify_fd = None
+        self._inotify_watches = {}
+        self._libc = None
+        self._thread = None
+        self._failed = False
+
+    @property
+    def source(self):
+        """ 'netlink', 'inotify', or None if the monitor is not running. """
+        return self._source
+
+    @property
+    def failed(self):
+        """ True once the event source failed, its generations are not updated any more """
+        return self._failed
+
+    def _fail(self):
+        self._failed = True
+        self._source = None
+
+    def generation(self, dev_path):
+        generation = self._generations.get(dev_path)
+        if generation is None:
+            # Register the path, so it is bumped if events are lost
+            with self._lock:
+                generation = self._generations.setdefault(dev_path, 0)
+        return generation
+
+    def _bump(self, dev_path):
+        with self._lock:
+            self._generations[dev_path] = self._generations.get(dev_path, 0) + 1
+
+    def start(self):
+        """
+        Start the monitor thread.
+
+        :return: True if an event source is available
+        """
+        if self._thread is not None:
+            return True
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+            sock.bind((0, UEVENT_KERNEL_GROUP))
+        except (OSError, AttributeError):
+            sock = None
+        if sock is not None:
+            self._source = "netlink"
+            target, arg = self._netlink_loop, sock
+        else:
+            try:
+                self._libc = ctypes.CDLL(None, use_errno=True)
+                fd = self._libc.inotify_init1(IN_CLOEXEC)
+            except (OSError, AttributeError):
+                fd = -1
+            if fd < 0:
+                return False
+            self._inotify_fd = fd
+            self._source = "inotify"
+            target, arg = self._inotify_loop, fd
+        self._thread = threading.Thread(target=target, args=(arg,), name="pycxl-replug-monitor")
+        self._thread.daemon = True
+        self._thread.start()
+        return True
+
+    def watch(self, dev_path):
+        """
+        Make sure events of dev_path are seen, only inotify needs to watch its directory.
+
+        :return: False if the events of dev_path can not be monitored
+        """
+        if self._source == "netlink":
+            # uevents only name the nodes created under /dev
+            return os.path.abspath(dev_path).startswith("/dev/")
+        if self._source != "inotify":
+            return False
+        dir_name = os.path.dirname(os.path.abspath(dev_path))
+        with self._lock:
+            if dir_name in self._inotify_watches.values():
+                return True
+            wd = self._libc.inotify_add_watch(self._inotify_fd,
+                                              os.fsencode(dir_name),
+                                              IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO)
+            if wd < 0:
+                return False
+            self._inotify_watches[wd] = dir_name
+        return True
+
+    def _netlink_loop(self, sock):
+        while True:
+            try:
+                data = sock.recv(16384)
+            except OSError as e:
+                if e.errno == errno.ENOBUFS:
+                    # Events were dropped, consider every device replugged
+                    with self._lock:
+                        for i in self._generations:
+                            self._generations[i] += 1
+                    continue
+                if e.errno == errno.EINTR:
+                    continue
+                # The socket is unusable, the devices fall back to polling
+                self._fail()
+                sock.close()
+                return
+            event = parse_uevent(data)
+            if event.get("ACTION") in ("add", "remove") and "DEVNAME" in event:
+                self._bump(os.path.join("/dev", event["DEVNAME"]))
+
+    def _inotify_loop(self, fd):
+        while True:
+            try:
+                data = os.read(fd, 16384)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                self._fail()
+                os.close(fd)
+                return
+            offset = 0
+            while offset + inotify_event_header.size <= len(data):
+                wd, mask, cookie, length = inotify_event_header.unpack_from(data, offset)
+                offset += inotify_event_header.size
+                name = data[offset:offset+length].rstrip(b'\0')
+                offset += length
+                dir_name = self._inotify_watches.get(wd)
+                if dir_name and name:
+                    self._bump(os.path.join(dir_name, os.fsdecode(name)))
+
+
+_monitor = None
+_monitor_lock = threading.Lock()
+
+def get_replug_monitor():
+    """
+    Return the process wide ReplugMonitor, started on first use, None if neither
+    netlink nor inotify is available, or the monitor failed.
+    """
+    global _monitor
+    with _monitor_lock:
+        if _monitor is None:
+            monitor = ReplugMonitor()
+            _monitor = monitor if monitor.start() else False
+    if not _monitor or _monitor.failed:
+        return None
+    return _monitor
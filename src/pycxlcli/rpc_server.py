@@ -0,0 +1,451 @@
+import os
+import json
+import time
+import queue
+import socket
+import stat
+import base64
+import threading
+import socketserver
+import inspect
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from .linux_utils import get_cxl_mem_name, CXLBusInfo
+from .output_format import structure_to_dict
+from .command_stats import get_command_stats
+from .linux_cxl_ioctl import cxl_mem_command_id
+
+## JSON-RPC 2.0 error codes
+JSONRPC_PARSE_ERROR = -32700
+JSONRPC_INVALID_REQUEST = -32600
+JSONRPC_METHOD_NOT_FOUND = -32601
+JSONRPC_INVALID_PARAMS = -32602
+JSONRPC_INTERNAL_ERROR = -32603
+## Server defined error codes
+RPC_DEVICE_ERROR = -32000
+RPC_DEVICE_NOT_FOUND = -32001
+RPC_TIMEOUT = -32002
+RPC_NOT_ALLOWED = -32003
+
+## Seconds a request waits at most for its device
+DEFAULT_REQUEST_TIMEOUT = 60.0
+## The commands send accepts without allow_raw, they only read the device
+ReadOnlyCommandIds = frozenset((
+    cxl_mem_command_id.CXL_MEM_COMMAND_ID_IDENTIFY,
+    cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_SUPPORTED_LOGS,
+    cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_FW_INFO,
+    cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_PARTITION_INFO,
+    cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_LSA,
+    cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_HEALTH_INFO,
+    cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_LOG,
+    cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_ALERT_CONFIG,
+    cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_SHUTDOWN_STATE,
+    cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_POISON,
+    cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_SCAN_MEDIA_CAPS,
+    cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_SCAN_MEDIA,
+    cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_TIMESTAMP,
+    cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_EVENT_RECORD,
+    cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_SLD_QOS_CONTROL,
+    cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_SLD_QOS_STATUS,
+    ))
+
+
+def get_default_socket_path():
+    """
+    $PYCXL_SOCKET, or pycxl.sock under $XDG_RUNTIME_DIR, /run for root, or /tmp
+    """
+    path = os.environ.get("PYCXL_SOCKET")
+    if path:
+        return path
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "pycxl.sock")
+    if os.geteuid() == 0:
+        return "/run/pycxl.sock"
+    return "/tmp/pycxl-%d.sock" % os.geteuid()
+
+
+class CXLRPCError(Exception):
+    """
+    A JSON-RPC error, raised by the handlers and by CXLRPCClient.call().
+    """
+    def __init__(self, code, message, data=None):
+        super(CXLRPCError, self).__init__(message)
+        self.code = code
+        self.data = data
+
+
+class _DeviceQueue(object):
+    """
+    One thread per device running its requests in order, the mailbox of a device
+    only ever sees one command at a time.
+    """
+    def __init__(self, dev_name, cxl_device):
+        self.dev_name = dev_name
+        self._cxl_device = cxl_device
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="pycxl-serve-%s" % dev_name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def submit(self, func):
+        """
+        Queue func(cxl_device).
+
+        :return: a concurrent.futures.Future of its result
+        """
+        future = Future()
+        self._queue.put((func, future))
+        return future
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            func, future = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func(self._cxl_device))
+            except BaseException as e:
+                future.set_exception(e)
+        self._cxl_device.close()
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+
+class CXLRPCService(object):
+    """
+    The methods served over JSON-RPC. Static data(command table, Identify,
+    supported logs) is kept in memory after the first request and answered
+    without going through the device queue, sysfs attributes come from the
+    CXLBusInfo snapshots, everything else runs on the queue of its device.
+    """
+    ## Methods whose results are kept until invalidate
+    static_methods = ("query_commands", "identify", "supported_logs")
+
+    def __init__(self, open_device, request_timeout=DEFAULT_REQUEST_TIMEOUT, allow_raw=False):
+        """
+        :param open_device: open_device(dev_name) returns a CXLMemDevice, raises
+        FileNotFoundError if the device does not exist
+        :param allow_raw: let send pass any command or raw opcode, else only the
+        ReadOnlyCommandIds
+        """
+        self._open_device = open_device
+        self._request_timeout = request_timeout
+        self._allow_raw = allow_raw
+        self._queues = {}
+        self._bus_info = {}
+        self._static = {}
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "cache_hits": 0, "errors": 0}
+        self._started = time.monotonic()
+
+    def _get_queue(self, dev_name):
+        with self._lock:
+            device_queue = self._queues.get(dev_name)
+            if device_queue is None:
+                try:
+                    cxl_device = self._open_device(dev_name)
+                except FileNotFoundError:
+                    raise CXLRPCError(RPC_DEVICE_NOT_FOUND, "Device %s not exist" % dev_name)
+                device_queue = _DeviceQueue(dev_name, cxl_device)
+                self._queues[dev_name] = device_queue
+            return device_queue
+
+    def _run_on_device(self, dev_name, func):
+        future = self._get_queue(dev_name).submit(func)
+        try:
+            return future.result(self._request_timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise CXLRPCError(RPC_TIMEOUT, "device %s did not answer in %ss" % (dev_name, self._request_timeout))
+
+    def _get_static(self, dev_name, method, func):
+        key = (dev_name, method)
+        with self._lock:
+            if key in self._static:
+                self._stats["cache_hits"] += 1
+                return self._static[key]
+        result = self._run_on_device(dev_name, func)
+        with self._lock:
+            self._static[key] = result
+        return result
+
+    ## The JSON-RPC methods, params are passed by name
+
+    def rpc_list_devices(self):
+        return sorted(get_cxl_mem_name())
+
+    def rpc_query_commands(self, device):
+        from .linux_cxl_ioctl import cxl_command_names
+        def func(cxl_device):
+            return [{"id": i.id,
+                     "name": cxl_command_names[i.id],
+                     "flags": i.flags,
+                     "size_in": i.size_in,
+                     "size_out": i.size_out,
+                     } for i in cxl_device.get_query_commands().commands if i.id != 0]
+        return self._get_static(device, "query_commands", func)
+
+    def rpc_identify(self, device):
+        return self._get_static(device, "identify", lambda cxl_device: structure_to_dict(cxl_device.get_identify()))
+
+    def rpc_supported_logs(self, device):
+        return self._get_static(device, "supported_logs",
+                                lambda cxl_device: [{"uuid": uuid, "size": size} for uuid, size in cxl_device.get_supported_logs()])
+
+    def rpc_sysfs(self, device):
+        with self._lock:
+            bus_info = self._bus_info.get(device)
+            if bus_info is None:
+                bus_info = CXLBusInfo(device)
+                self._bus_info[device] = bus_info
+        snapshot = bus_info.snapshot
+        if not snapshot.attrs:
+            raise CXLRPCError(RPC_DEVICE_NOT_FOUND, "Device %s not exist" % device)
+        return dict(snapshot.attrs)
+
+    def rpc_fw_info(self, device):
+        return self._run_on_device(device, lambda cxl_device: structure_to_dict(cxl_device.get_fw_info()))
+
+    def rpc_health_info(self, device):
+        return self._run_on_device(device, lambda cxl_device: structure_to_dict(cxl_device.get_health_info()))
+
+    def rpc_send(self, device, command_id, input=None, out_size=None, opcode=None):
+        """
+        A raw mailbox command, input and output are base64. Only the ReadOnlyCommandIds
+        are sent unless the service allows raw commands.
+        """
+        if not self._allow_raw and command_id not in ReadOnlyCommandIds:
+            raise CXLRPCError(RPC_NOT_ALLOWED, "command %s is not allowed, the server does not allow raw commands" % command_id)
+        in_buf = bytearray(base64.b64decode(input)) if input else None
+        def func(cxl_device):
+            out_buf = bytearray(out_size if out_size is not None else cxl_device.payload_max)
+            cmd = cxl_device.send(command_id, in_buf, out_buf, opcode=opcode, check_retval=False)
+            return {"retval": cmd.retval,
+                    "output": base64.b64encode(out_buf[:cmd.out_size]).decode()}
+        return self._run_on_device(device, func)
+
+    def rpc_invalidate(self, device=None):
+        """
+        Drop the cached static data of a device, or of all devices.
+        """
+        with self._lock:
+            for key in list(self._static):
+                if device is None or key[0] == device:
+                    del self._static[key]
+            for dev_name, bus_info in self._bus_info.items():
+                if device is None or dev_name == device:
+                    bus_info.invalidate()
+        return True
+
+    def rpc_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["uptime"] = time.monotonic() - self._started
+            stats["queue_depth"] = {k: v.depth for k, v in self._queues.items()}
+        command_stats = get_command_stats()
+        if command_stats is not None:
+            stats["commands"] = command_stats.to_dict()
+        return stats
+
+    def handle(self, request):
+        """
+        Handle one decoded JSON-RPC request.
+
+        :return: the response object, None for a notification
+        """
+        if not isinstance(request, dict) or request.get("jsonrpc") != "2.0" or not isinstance(request.get("method"), str):
+            return _error_response(None, JSONRPC_INVALID_REQUEST, "Invalid Request")
+        request_id = request.get("id")
+        params = request.get("params") or {}
+        with self._lock:
+            self._stats["requests"] += 1
+        method = getattr(self, "rpc_" + request["method"], None)
+        try:
+            if method is None:
+                raise CXLRPCError(JSONRPC_METHOD_NOT_FOUND, "Method not found: %s" % request["method"])
+            if not isinstance(params, dict):
+                raise CXLRPCError(JSONRPC_INVALID_PARAMS, "params must be an object")
+            try:
+                inspect.signature(method).bind(**params)
+            except TypeError as e:
+                raise CXLRPCError(JSONRPC_INVALID_PARAMS, str(e))
+            result = method(**params)
+            response = {"jsonrpc": "2.0", "id": request_id, "result": result}
+        except CXLRPCError as e:
+            response = _error_response(request_id, e.code, str(e), e.data)
+        except FileNotFoundError as e:
+            response = _error_response(request_id, RPC_DEVICE_NOT_FOUND, "Device not exist: %s" % e)
+        except Exception as e:
+            response = _error_response(request_id, RPC_DEVICE_ERROR, str(e), {"retval": getattr(e, "retval", None)})
+        if "error" in response:
+            with self._lock:
+                self._stats["errors"] += 1
+        return response if "id" in request else None
+
+    def close(self):
+        with self._lock:
+            queues, self._queues = self._queues, {}
+        for device_queue in queues.values():
+            device_queue.stop()
+
+
+def _error_response(request_id, code, message, data=None):
+    error = {"code": code, "message": message}
+    if data is not None:
+        error["data"] = data
+    return {"jsonrpc": "2.0", "id": request_id, "error": error}
+
+
+class _RPCRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Newline delimited JSON-RPC requests and responses, a client may send
+    requests back to back on one connection.
+    """
+    def handle(self):
+        service = self.server.service
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line.decode())
+            except ValueError:
+                response = _error_response(None, JSONRPC_PARSE_ERROR, "Parse error")
+            else:
+                response = service.handle(request)
+            if response is not None:
+                self.wfile.write(json.dumps(response, separators=(",", ":")).encode() + b"\n")
+
+
+class CXLRPCServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, service, mode=0o660):
+        """
+        :param socket_path: the Unix socket to listen on, a stale socket file is replaced
+        :param service: the CXLRPCService
+        :param mode: the permissions of the socket file
+        """
+        self.service = service
+        self.socket_path = socket_path
+        _remove_stale_socket(socket_path)
+        socketserver.UnixStreamServer.__init__(self, socket_path, _RPCRequestHandler)
+        os.chmod(socket_path, mode)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        self.service.close()
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+
+def _remove_stale_socket(socket_path):
+    try:
+        st = os.lstat(socket_path)
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(st.st_mode):
+        # Never unlink anything but a socket left by a previous server
+        raise OSError("%s exists and is not a socket" % socket_path)
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(socket_path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        os.unlink(socket_path)
+    else:
+        raise OSError("%s is in use by another server" % socket_path)
+    finally:
+        s.close()
+
+
+class CXLRPCClient(object):
+    """
+    Client of pycxl serve:
+
+        with CXLRPCClient() as client:
+            client.identify("mem0")
+    """
+    def __init__(self, socket_path=None, timeout=None):
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        self._sock.connect(socket_path or get_default_socket_path())
+        self._rfile = self._sock.makefile("rb")
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._rfile.close()
+        self._sock.close()
+
+    def call(self, method, **params):
+        """
+        :return: the result, raise CXLRPCError on an error response
+        """
+        with self._lock:
+            self._next_id += 1
+            request = {"jsonrpc": "2.0", "id": self._next_id, "method": method, "params": params}
+            self._sock.sendall(json.dumps(request, separators=(",", ":")).encode() + b"\n")
+            line = self._rfile.readline()
+        if not line:
+            raise ConnectionError("the server closed the connection")
+        response = json.loads(line.decode())
+        if "error" in response:
+            error = response["error"]
+            raise CXLRPCError(error["code"], error["message"], error.get("data"))
+        return response["result"]
+
+    def list_devices(self):
+        return self.call("list_devices")
+
+    def query_commands(self, device):
+        return self.call("query_commands", device=device)
+
+    def identify(self, device):
+        return self.call("identify", device=device)
+
+    def supported_logs(self, device):
+        return self.call("supported_logs", device=device)
+
+    def sysfs(self, device):
+        return self.call("sysfs", device=device)
+
+    def fw_info(self, device):
+        return self.call("fw_info", device=device)
+
+    def health_info(self, device):
+        return self.call("health_info", device=device)
+
+    def send(self, device, command_id, input=None, out_size=None, opcode=None):
+        """
+        :param input: the input payload, bytes
+        :return: (retval, the output payload)
+        """
+        result = self.call("send",
+                           device=device,
+                           command_id=command_id,
+                           input=base64.b64encode(input).decode() if input else None,
+                           out_size=out_size,
+                           opcode=opcode)
+        return result["retval"], base64.b64decode(result["output"])
+
+    def invalidate(self, device=None):
+        return self.call("invalidate", device=device)
+
+    def stats(self):
+        return self.call("stats")
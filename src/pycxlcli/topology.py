@@ -0,0 +1,384 @@
+import os
+import re
+import threading
+from .linux_utils import CXLBusInfo, CXLMemBDFIndex, _read_sysfs_file
+
+## The kind of a CXL bus device, by the prefix of its name
+CXL_NODE_ROOT = "root"
+CXL_NODE_PORT = "port"
+CXL_NODE_ENDPOINT = "endpoint"
+CXL_NODE_DECODER = "decoder"
+CXL_NODE_REGION = "region"
+CXL_NODE_MEMDEV = "mem"
+_node_name_pattern = re.compile(r'([a-z_-]+?)(\d+)(?:\.(\d+))?')
+## Attributes read for each kind of node
+_node_attrs = {
+    CXL_NODE_MEMDEV: ("serial", "numa_node", "firmware_version"),
+    CXL_NODE_DECODER: ("region", "start", "size", "interleave_ways", "interleave_granularity", "mode", "target_list"),
+    CXL_NODE_REGION: ("uuid", "resource", "size", "interleave_ways", "interleave_granularity", "mode", "commit"),
+}
+## Region targets are read from target0 up to this
+CXL_MAX_REGION_TARGETS = 16
+
+
+def get_node_type(name):
+    """
+    The kind of a CXL bus device from its name: root0 -> 'root', decoder2.1 -> 'decoder'.
+    """
+    match = _node_name_pattern.fullmatch(name)
+    return match.group(1) if match else name
+
+
+class TopologyNode(object):
+    """
+    A device of /sys/bus/cxl/devices.
+
+    parent: the nearest CXL device above it in the sysfs device tree, None for the
+    roots and the memory devices(which live under their PCI device).
+
+    uport: the name of the device behind a port(the PCI device of a switch or host
+    bridge, the memdev of an endpoint).
+
+    bdf: the PCI device of a memdev or of a port, None if not on a PCI device.
+
+    links: the nodes related beyond the parent, e.g. the memdev of an endpoint, the
+    region of a decoder, the decoders of a region.
+    """
+    __slots__ = ("name", "type", "path", "parent", "children", "links", "uport", "bdf", "attrs")
+
+    def __init__(self, name, path):
+        self.name = name
+        self.type = get_node_type(name)
+        self.path = path
+        self.parent = None
+        self.children = []
+        self.links = []
+        self.uport = None
+        self.bdf = None
+        self.attrs = {}
+
+    @property
+    def serial(self):
+        return self.attrs.get("serial")
+
+    @property
+    def numa_node(self):
+        value = self.attrs.get("numa_node")
+        return int(value) if value and value.lstrip("-").isdigit() else None
+
+    def to_dict(self, recursive=True):
+        result = {"name": self.name,
+                  "type": self.type,
+                  "bdf": self.bdf,
+                  "uport": self.uport,
+                  "attrs": dict(self.attrs),
+                  "links": [i.name for i in self.links],
+                  }
+        if recursive:
+            result["children"] = [i.to_dict() for i in self.children]
+        return result
+
+    def __repr__(self):
+        return "TopologyNode(%s)" % self.name
+
+
+def _get_link_components(bus_dir, name):
+    """
+    The path components of the device a bus entry links to, from one readlink.
+    """
+    try:
+        target = os.readlink(os.path.join(bus_dir, name))
+    except OSError:
+        return []
+    return [i for i in os.path.normpath(os.path.join(bus_dir, target)).split(os.sep) if i]
+
+
+class CXLTopology(object):
+    """
+    The graph of the ports, endpoints, decoders, regions and memory devices of
+    /sys/bus/cxl/devices, with indexes by name, serial, BDF and NUMA node.
+
+    The graph is built by one scan: a listdir of the bus, one readlink per device
+    for its place in the device tree, and the few attributes of _node_attrs.
+    refresh() only loads the devices added since the last scan and drops those
+    removed, refresh_subtree() re-reads the attributes below one device.
+    """
+    def __init__(self, bus_dir=None):
+        self._bus_dir = bus_dir
+        self._nodes = {}
+        self._by_serial = {}
+        self._by_bdf = {}
+        self._by_numa = {}
+        self._lock = threading.RLock()
+
+    @property
+    def bus_dir(self):
+        return self._bus_dir or CXLBusInfo.bus_info_prefix
+
+    def _list_names(self):
+        try:
+            return set(os.listdir(self.bus_dir))
+        except FileNotFoundError:
+            return set()
+
+    def _read_attrs(self, node):
+        attrs = {}
+        for attr in _node_attrs.get(node.type, ()):
+            value = _read_sysfs_file(os.path.join(self.bus_dir, node.name, attr))
+            if value is not None:
+                attrs[attr] = value
+        if node.type == CXL_NODE_REGION:
+            targets = []
+            for i in range(min(int(attrs.get("interleave_ways") or 0), CXL_MAX_REGION_TARGETS)):
+                target = _read_sysfs_file(os.path.join(self.bus_dir, node.name, "target%d" % i))
+                if target:
+                    targets.append(target)
+            attrs["targets"] = " ".join(targets)
+        node.attrs = attrs
+
+    def _read_uport(self, node):
+        if node.type not in (CXL_NODE_ROOT, CXL_NODE_PORT, CXL_NODE_ENDPOINT):
+            return
+        try:
+            target = os.readlink(os.path.join(self.bus_dir, node.name, "uport"))
+        except OSError:
+            return
+        node.uport = os.path.basename(target)
+        if CXLMemBDFIndex.bdf_pattern.fullmatch(node.uport):
+            node.bdf = node.uport
+
+    def _attach(self, node):
+        """
+        Find the parent of a node: the nearest ancestor directory that is a CXL device.
+        """
+        for component in reversed(node.path.split(os.sep)[:-1]):
+            parent = self._nodes.get(component)
+            if parent is not None:
+                node.parent = parent
+                parent.children.append(node)
+                break
+
+    def _add(self, names):
+        """
+        Load new nodes, then attach them.
+        """
+        for name in names:
+            components = _get_link_components(self.bus_dir, name)
+            node = TopologyNode(name, os.sep + os.sep.join(components))
+            if node.type == CXL_NODE_MEMDEV and len(components) >= 2 and \
+                    CXLMemBDFIndex.bdf_pattern.fullmatch(components[-2]):
+                node.bdf = components[-2]
+            self._read_uport(node)
+            self._read_attrs(node)
+            self._nodes[name] = node
+        for name in names:
+            self._attach(self._nodes[name])
+        for name in names:
+            self._index(self._nodes[name])
+
+    def _link_all(self):
+        """
+        Rebuild the links: endpoint <-> memdev by the endpoint uport, decoder <-> region
+        by the region targets and the decoder region attribute.
+        """
+        for node in self._nodes.values():
+            node.links = []
+        def link(a, b):
+            if b not in a.links:
+                a.links.append(b)
+            if a not in b.links:
+                b.links.append(a)
+        for node in self._nodes.values():
+            if node.type == CXL_NODE_ENDPOINT and node.uport in self._nodes:
+                link(node, self._nodes[node.uport])
+            elif node.type == CXL_NODE_DECODER and node.attrs.get("region") in self._nodes:
+                link(node, self._nodes[node.attrs["region"]])
+            elif node.type == CXL_NODE_REGION:
+                for target in node.attrs.get("targets", "").split():
+                    if target in self._nodes:
+                        link(node, self._nodes[target])
+
+    def _index(self, node):
+        if node.serial:
+            self._by_serial.setdefault(node.serial, []).append(node)
+        if node.bdf:
+            self._by_bdf.setdefault(node.bdf, []).append(node)
+        if node.numa_node is not None:
+            self._by_numa.setdefault(node.numa_node, []).append(node)
+
+    def _unindex(self, node):
+        for index, key in ((self._by_serial, node.serial), (self._by_bdf, node.bdf), (self._by_numa, node.numa_node)):
+            nodes = index.get(key)
+            if nodes and node in nodes:
+                nodes.remove(node)
+                if not nodes:
+                    del index[key]
+
+    def _remove(self, names):
+        for name in names:
+            node = self._nodes.pop(name, None)
+            if node is None:
+                continue
+            self._unindex(node)
+            if node.parent is not None and node in node.parent.children:
+                node.parent.children.remove(node)
+            for child in node.children:
+                child.parent = None
+        self._link_all()
+
+    def scan(self):
+        """
+        Build the graph from scratch.
+        """
+        with self._lock:
+            self._nodes = {}
+            self._by_serial = {}
+            self._by_bdf = {}
+            self._by_numa = {}
+            self._add(sorted(self._list_names()))
+            self._link_all()
+        return self
+
+    def refresh(self):
+        """
+        Load the devices added and drop the devices removed since the last scan,
+        the others are kept as they are.
+
+        :return: (names added, names removed)
+        """
+        with self._lock:
+            names = self._list_names()
+            added = sorted(names - set(self._nodes))
+            removed = sorted(set(self._nodes) - names)
+            if removed:
+                self._remove(removed)
+            if added:
+                self._add(added)
+                # Devices whose parent was missing may find it among the added ones
+                added_set = set(added)
+                for node in list(self._nodes.values()):
+                    if node.parent is None and node.name not in added_set:
+                        self._attach(node)
+            if added or removed:
+                # Decoders gain or lose their region with the regions
+                for node in self._nodes.values():
+                    if node.type == CXL_NODE_DECODER:
+                        self._read_attrs(node)
+                self._link_all()
+        return added, removed
+
+    def refresh_subtree(self, name):
+        """
+        Re-read the attributes of a device and of all the devices below it, e.g.
+        after committing a region or reconfiguring decoders.
+        """
+        with self._lock:
+            node = self._nodes.get(name)
+            if node is None:
+                raise KeyError(name)
+            stack = [node]
+            while stack:
+                node = stack.pop()
+                self._unindex(node)
+                self._read_attrs(node)
+                self._index(node)
+                stack.extend(node.children)
+            self._link_all()
+
+    ## Lookups
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __contains__(self, name):
+        return name in self._nodes
+
+    def get(self, name):
+        return self._nodes.get(name)
+
+    def nodes(self, node_type=None):
+        """ The nodes, of one type('port', 'mem', ...) or all, sorted by name """
+        return sorted((i for i in self._nodes.values() if node_type is None or i.type == node_type),
+                      key=lambda i: i.name)
+
+    @property
+    def roots(self):
+        """ The nodes without parent: the CXL roots, and the memdevs not under one """
+        return sorted((i for i in self._nodes.values() if i.parent is None), key=lambda i: i.name)
+
+    def find_by_serial(self, serial):
+        return list(self._by_serial.get(serial, ()))
+
+    def find_by_bdf(self, bdf):
+        return list(self._by_bdf.get(bdf, ()))
+
+    def find_by_numa_node(self, numa_node):
+        return list(self._by_numa.get(numa_node, ()))
+
+    def get_endpoint(self, memdev):
+        """ The endpoint port of a memdev, None if it has none """
+        node = self._nodes.get(memdev)
+        if node is not None:
+            for i in node.links:
+                if i.type == CXL_NODE_ENDPOINT:
+                    return i
+
+    def get_backing(self, memdev):
+        """
+        What backs a memdev: the ports from its endpoint up to the root, the decoders
+        of its endpoint and the regions they belong to.
+
+        :return: a dict with the memdev, endpoint, ports(endpoint up to root), decoders
+        and regions nodes
+        """
+        node = self._nodes.get(memdev)
+        if node is None:
+            raise KeyError(memdev)
+        endpoint = self.get_endpoint(memdev)
+        ports = []
+        current = endpoint
+        while current is not None:
+            ports.append(current)
+            current = current.parent
+        decoders = [i for i in endpoint.children if i.type == CXL_NODE_DECODER] if endpoint else []
+        regions = []
+        for decoder in decoders:
+            for i in decoder.links:
+                if i.type == CXL_NODE_REGION and i not in regions:
+                    regions.append(i)
+        return {"memdev": node, "endpoint": endpoint, "ports": ports, "decoders": decoders, "regions": regions}
+
+    def to_dict(self):
+        return [i.to_dict() for i in self.roots]
+
+
+def _describe_node(node):
+    details = []
+    if node.bdf:
+        details.append(node.bdf)
+    if node.type == CXL_NODE_MEMDEV:
+        details.append("serial %s" % node.serial)
+        if node.numa_node is not None:
+            details.append("numa %d" % node.numa_node)
+    elif node.type == CXL_NODE_DECODER:
+        if node.attrs.get("size") not in (None, "0x0"):
+            details.append("%s+%s" % (node.attrs.get("start"), node.attrs.get("size")))
+    elif node.type == CXL_NODE_REGION:
+        details.append("%s ways %s" % (node.attrs.get("mode"), node.attrs.get("interleave_ways")))
+    elif node.uport and not node.bdf and node.type != CXL_NODE_ENDPOINT:
+        details.append(node.uport)
+    details.extend("-> %s" % i.name for i in node.links if i.type in (CXL_NODE_MEMDEV, CXL_NODE_REGION))
+    return "%s%s" % (node.name, " (%s)" % ", ".join(details) if details else "")
+
+
+def format_topology(topology, root=None):
+    """
+    Render the graph, or the subtree of one node, as indented text lines.
+    """
+    lines = []
+    stack = [(i, 0) for i in reversed([topology.get(root)] if root else topology.roots) if i is not None]
+    while stack:
+        node, depth = stack.pop()
+        lines.append("%s%s" % ("  " * depth, _describe_node(node)))
+        stack.extend((i, depth + 1) for i in sorted(node.children, key=lambda i: i.name, reverse=True))
+    return lines
@@ -0,0 +1,28 @@
+import os
+import sys
+import subprocess
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+
+def _run_cli(cache_dir, *argv):
+    """
+    Run pycxl against one emulated device, with an empty metadata cache.
+    """
+    env = dict(os.environ, PYTHONPATH=SRC_DIR, PYCXL_EMULATE="1", PYCXL_CACHE_DIR=str(cache_dir))
+    code = "import sys; from pycxlcli.cxl_cli import CXLCli; sys.argv = ['pycxl'] + sys.argv[1:]; CXLCli()"
+    return subprocess.run([sys.executable, "-c", code] + list(argv), env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+
+
+def test_stats(tmp_path):
+    result = _run_cli(tmp_path, "--stats", "identify", "mem0")
+    assert result.returncode == 0
+    assert "Identify Command" in result.stderr
+
+
+def test_stats_without_sub_command(tmp_path):
+    result = _run_cli(tmp_path, "--stats")
+    assert result.returncode == 0
+    assert result.stdout.startswith("usage:")
+    assert "Traceback" not in result.stderr
@@ -0,0 +1,101 @@
+import errno
+import struct
+import threading
+import pytest
+from pycxlcli.cxl import CXLMemDevice
+from pycxlcli.emulated_device import EmulatedCXLBus
+from pycxlcli.identify_memory_device import cxlmi_cmd_memdev_identify_payload
+from pycxlcli.logs_gcc import LogNameTable
+from pycxlcli.linux_cxl_ioctl import (
+    cxl_mem_command_id,
+    CXL_MBOX_CMD_RC_UNSUPPORTED,
+    )
+from pycxlcli.media_operations import CXL_POISON_FLAG_MORE_RECORDS
+from pycxlcli.poison_list import iter_poison_payloads, read_poison_list
+
+## Room for 14 media error records behind the Get Poison List header
+PAYLOAD_MAX = 256
+
+
+@pytest.fixture
+def bus():
+    with EmulatedCXLBus(2, payload_max=PAYLOAD_MAX) as bus:
+        yield bus
+
+
+def test_identify(bus):
+    cxl_device = CXLMemDevice("mem1")
+    assert cxl_device.payload_max == PAYLOAD_MAX
+    assert cxl_device.get_identify().fw_revision == b"EMU-1.0"
+
+
+def test_unsupported_opcode(bus):
+    cxl_device = CXLMemDevice("mem0")
+    result = cxl_device.send(cxl_mem_command_id.CXL_MEM_COMMAND_ID_RAW, opcode=0xCAFE, check_retval=False)
+    assert result.retval == CXL_MBOX_CMD_RC_UNSUPPORTED
+
+
+def test_busy(bus):
+    cxl_device = CXLMemDevice("mem0")
+    bus.devices["mem0"].inject_busy()
+    with pytest.raises(OSError) as e:
+        cxl_device.get_health_info()
+    assert e.value.errno == errno.EBUSY
+    cxl_device.get_health_info()
+
+
+def test_poison_list_continuation(bus):
+    bus.devices["mem0"].poison = [(i * 0x1000, 1, 0) for i in range(40)]
+    cxl_device = CXLMemDevice("mem0")
+    payloads = [(header.flags, records.nbytes // 0x10) for header, records in iter_poison_payloads(cxl_device)]
+    assert payloads == [(CXL_POISON_FLAG_MORE_RECORDS, 14), (CXL_POISON_FLAG_MORE_RECORDS, 14), (0, 12)]
+    store, overflow = read_poison_list(cxl_device)
+    assert list(store.address) == [i * 0x1000 for i in range(40)]
+    assert not overflow
+
+
+def test_send_from_many_threads(bus):
+    cxl_device = CXLMemDevice("mem0")
+    failed = []
+    def send_identify():
+        for _ in range(200):
+            out_buf = bytearray(PAYLOAD_MAX)
+            result = cxl_device.send(cxl_mem_command_id.CXL_MEM_COMMAND_ID_IDENTIFY, None, out_buf)
+            if (result.id, result.retval, result.out_size) != (cxl_mem_command_id.CXL_MEM_COMMAND_ID_IDENTIFY, 0, 0x43):
+                failed.append(result)
+    threads = [threading.Thread(target=send_identify) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not failed
+
+
+def test_bytes_input_buffer(bus):
+    cxl_device = CXLMemDevice("mem0")
+    cel = bytearray(8)
+    in_buf = bytes.fromhex(LogNameTable["cel"]) + struct.pack("<II", 0, len(cel))
+    result = cxl_device.send(cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_LOG, in_buf, cel)
+    assert result.out_size == len(cel)
+    assert struct.unpack_from("<H", cel)[0] != 0
+
+
+def test_read_only_output_buffer(bus):
+    cxl_device = CXLMemDevice("mem0")
+    out_buf = bytes(0x43)
+    for buf in (out_buf, memoryview(out_buf)):
+        with pytest.raises(TypeError):
+            cxl_device.send(cxl_mem_command_id.CXL_MEM_COMMAND_ID_IDENTIFY, None, buf)
+    assert out_buf == bytes(0x43)
+    with pytest.raises(TypeError):
+        cxl_device.read_chunked(cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_LOG,
+                                lambda offset, length: bytes(0x18), bytes(16))
+
+
+def test_identify_returns_the_command(bus):
+    cxl_device = CXLMemDevice("mem0")
+    data_buffer = cxlmi_cmd_memdev_identify_payload()
+    cmd = cxl_device.identify(data_buffer)
+    cxl_device.get_health_info()
+    assert (cmd.retval, cmd.out.size) == (0, 0x43)
+    assert data_buffer.fw_revision == b"EMU-1.0"
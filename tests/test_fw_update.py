@@ -0,0 +1,101 @@
+import os
+import errno
+from collections import namedtuple
+import pytest
+from pycxlcli.buffer_pool import CommandBufferPool
+from pycxlcli.cxl import CXLCommandError, CXLSendResult
+from pycxlcli.linux_cxl_ioctl import cxl_mem_command_id, CXL_MBOX_CMD_RC_FW_OUT_OF_ORDER
+from pycxlcli.firmware_management import (
+    cxlmi_cmd_transfer_fw_header,
+    FW_TRANSFER_ACTION_FULL,
+    FW_TRANSFER_ACTION_INITIATE,
+    FW_TRANSFER_ACTION_END,
+    FW_TRANSFER_ACTION_ABORT,
+    FW_TRANSFER_ALIGNMENT,
+    )
+from pycxlcli.fw_update import (
+    transfer_firmware,
+    TRANSFER_FW_HEADER_SIZE,
+    )
+
+PAYLOAD_MAX = 1024
+## FW data per Transfer FW with PAYLOAD_MAX, a multiple of FW_TRANSFER_ALIGNMENT
+PART_SIZE = PAYLOAD_MAX - TRANSFER_FW_HEADER_SIZE
+
+
+class FakeFWDevice(object):
+    """
+    Receive Transfer FW like a device, keeping the FW data that reached it.
+    """
+    cxl_bus_info = namedtuple('BusInfo', ['serial'])("0x1234")
+    dev_name = dev_path = "mem0"
+    payload_max = PAYLOAD_MAX
+
+    def __init__(self):
+        self.buffer_pool = CommandBufferPool()
+        self.received = bytearray()
+        self.in_progress = False
+        ## Raise EIO on the Transfer FW of this offset
+        self.fail_at = None
+
+    def send(self, command_id, in_buf=None, out_buf=None):
+        assert command_id == cxl_mem_command_id.CXL_MEM_COMMAND_ID_TRANSFER_FW
+        data = bytes(in_buf)
+        header = cxlmi_cmd_transfer_fw_header.from_buffer_copy(data)
+        offset = header.offset * FW_TRANSFER_ALIGNMENT
+        if header.action == FW_TRANSFER_ACTION_ABORT:
+            self.in_progress = False
+            return CXLSendResult(command_id, 0, 0)
+        if offset == self.fail_at:
+            self.fail_at = None
+            raise OSError(errno.EIO, "interrupted")
+        if header.action in (FW_TRANSFER_ACTION_FULL, FW_TRANSFER_ACTION_INITIATE):
+            self.received = bytearray()
+        elif not self.in_progress or offset != len(self.received):
+            raise CXLCommandError(command_id, CXL_MBOX_CMD_RC_FW_OUT_OF_ORDER)
+        self.received += data[TRANSFER_FW_HEADER_SIZE:]
+        self.in_progress = header.action not in (FW_TRANSFER_ACTION_FULL, FW_TRANSFER_ACTION_END)
+        return CXLSendResult(command_id, 0, 0)
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = str(tmp_path / "fw.bin")
+    with open(path, "wb") as f:
+        f.write(os.urandom(PART_SIZE * 5 + 100))
+    return path
+
+
+def _interrupt(cxl_device, image, state_dir):
+    cxl_device.fail_at = PART_SIZE * 2
+    with pytest.raises(OSError):
+        transfer_firmware(cxl_device, image, 1, state_dir=state_dir)
+
+
+def test_transfer(image, tmp_path):
+    cxl_device = FakeFWDevice()
+    size, transferred, resumed_from = transfer_firmware(cxl_device, image, 1, state_dir=str(tmp_path))
+    with open(image, "rb") as f:
+        assert cxl_device.received == f.read()
+    assert (transferred, resumed_from) == (size, 0)
+
+
+def test_resume(image, tmp_path):
+    cxl_device = FakeFWDevice()
+    _interrupt(cxl_device, image, str(tmp_path))
+    size, transferred, resumed_from = transfer_firmware(cxl_device, image, 1, state_dir=str(tmp_path))
+    with open(image, "rb") as f:
+        assert cxl_device.received == f.read()
+    assert resumed_from == PART_SIZE * 2
+    assert transferred == size - resumed_from
+
+
+def test_resume_out_of_order_restarts(image, tmp_path):
+    cxl_device = FakeFWDevice()
+    _interrupt(cxl_device, image, str(tmp_path))
+    # The device dropped the transfer, e.g. it was reset
+    cxl_device.in_progress = False
+    size, transferred, resumed_from = transfer_firmware(cxl_device, image, 1, state_dir=str(tmp_path))
+    with open(image, "rb") as f:
+        assert cxl_device.received == f.read()
+    assert (transferred, resumed_from) == (size, 0)
@@ -0,0 +1,32 @@
+import threading
+import time
+from pycxlcli.metrics_exporter import HealthCollector
+
+
+class HungDevice(object):
+    """
+    A device whose Get Health Info hangs until released, then fails.
+    """
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = 0
+
+    def get_health_info(self):
+        self.calls += 1
+        self.release.wait(5)
+        raise OSError("device gone")
+
+
+def test_busy_device_is_not_collected_again():
+    device = HungDevice()
+    collector = HealthCollector(["mem0"], lambda dev_name: device, interval=1.0, timeout=0.05)
+    assert 'pycxl_up{device="mem0"} 0' in collector.collect()
+    assert 'pycxl_up{device="mem0"} 0' in collector.collect()
+    assert device.calls == 1
+    # Once the hung collection returns, the device is collected again
+    device.release.set()
+    deadline = time.monotonic() + 5
+    while device.calls < 2 and time.monotonic() < deadline:
+        collector.collect()
+        time.sleep(0.01)
+    assert device.calls == 2
@@ -0,0 +1,59 @@
+import os
+import struct
+import pytest
+from pycxlcli.linux_utils import PCIBusInfo
+from pycxlcli.pci_config import PCIConfigCache, PCI_EXP_LNKSTA
+
+BDF = "0000:01:00.0"
+## Where the PCI Express capability is in the configuration space
+PCIE_CAP_OFFSET = 0x40
+
+
+def _link_status(speed, width):
+    return struct.pack("<H", speed | (width << 4))
+
+
+def _build_config():
+    config = bytearray(4096)
+    struct.pack_into("<HH", config, 0, 0x1e98, 0x0d93)
+    struct.pack_into("<H", config, 6, 0x10)
+    struct.pack_into("<I", config, 8, (0x050210 << 8) | 1)
+    config[0x34] = PCIE_CAP_OFFSET
+    config[PCIE_CAP_OFFSET] = 0x10
+    struct.pack_into("<H", config, PCIE_CAP_OFFSET + 2, 0x0002)
+    # 32 GT/s x16 capable, trained at 32 GT/s x16
+    struct.pack_into("<I", config, PCIE_CAP_OFFSET + 0x0C, 5 | (16 << 4))
+    config[PCIE_CAP_OFFSET+PCI_EXP_LNKSTA:PCIE_CAP_OFFSET+PCI_EXP_LNKSTA+2] = _link_status(5, 16)
+    return bytes(config)
+
+
+@pytest.fixture
+def config_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(PCIBusInfo, "bus_info_prefix", str(tmp_path) + os.sep)
+    os.makedirs(str(tmp_path / BDF))
+    path = str(tmp_path / BDF / "config")
+    with open(path, "wb") as f:
+        f.write(_build_config())
+    return path
+
+
+def test_link_status_is_read_again(config_path):
+    cache = PCIConfigCache()
+    link = cache.get(BDF).link
+    assert (link.speed, link.width, link.degraded) == (32.0, 16, False)
+    # The link retrained at 16 GT/s x8
+    with open(config_path, "r+b") as f:
+        f.seek(PCIE_CAP_OFFSET + PCI_EXP_LNKSTA)
+        f.write(_link_status(4, 8))
+    link = cache.get(BDF).link
+    assert (link.speed, link.width, link.degraded) == (16.0, 8, True)
+    assert (link.max_speed, link.max_width) == (32.0, 16)
+
+
+def test_link_down(config_path):
+    with open(config_path, "r+b") as f:
+        f.seek(PCIE_CAP_OFFSET + PCI_EXP_LNKSTA)
+        f.write(_link_status(0, 0))
+    link = PCIConfigCache().get(BDF).link
+    assert (link.speed, link.width) == (None, 0)
+    assert link.link_down and link.degraded
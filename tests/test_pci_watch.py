@@ -0,0 +1,30 @@
+from pycxlcli.pci_watch import LinkWatchSample
+
+
+def _sample(link_speed, link_width, max_link_speed=32.0, max_link_width=16):
+    return LinkWatchSample("0000:01:00.0", 0.0, {}, {}, link_speed, link_width, max_link_speed, max_link_width)
+
+
+def test_link_up():
+    sample = _sample(32.0, 16)
+    assert not sample.link_down
+    assert not sample.degraded
+
+
+def test_link_degraded():
+    sample = _sample(16.0, 8)
+    assert not sample.link_down
+    assert sample.speed_degraded and sample.width_degraded
+
+
+def test_link_down():
+    # current_link_speed reads "Unknown" and current_link_width 0
+    sample = _sample(None, 0)
+    assert sample.link_down
+    assert sample.speed_degraded and sample.width_degraded
+
+
+def test_link_capabilities_unknown():
+    sample = _sample(None, None, None, None)
+    assert not sample.link_down
+    assert not sample.degraded
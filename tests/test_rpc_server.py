@@ -0,0 +1,64 @@
+import os
+import socket
+import pytest
+from pycxlcli.cxl import CXLMemDevice
+from pycxlcli.emulated_device import EmulatedCXLMemdev
+from pycxlcli.linux_cxl_ioctl import cxl_mem_command_id
+from pycxlcli.rpc_server import (
+    CXLRPCService,
+    CXLRPCError,
+    RPC_NOT_ALLOWED,
+    _remove_stale_socket,
+    )
+
+
+def _make_service(allow_raw=False):
+    return CXLRPCService(lambda dev_name: CXLMemDevice(dev_name, transport=EmulatedCXLMemdev(dev_name)),
+                         allow_raw=allow_raw)
+
+
+def test_stale_socket_is_removed(tmp_path):
+    path = str(tmp_path / "pycxl.sock")
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.bind(path)
+    s.close()
+    _remove_stale_socket(path)
+    assert not os.path.exists(path)
+
+
+def test_regular_file_is_kept(tmp_path):
+    path = str(tmp_path / "data")
+    with open(path, "w") as f:
+        f.write("keep")
+    with pytest.raises(OSError):
+        _remove_stale_socket(path)
+    assert os.path.exists(path)
+
+
+def test_send_read_only_command():
+    service = _make_service()
+    try:
+        result = service.rpc_send("mem0", cxl_mem_command_id.CXL_MEM_COMMAND_ID_GET_HEALTH_INFO)
+        assert result["retval"] == 0
+    finally:
+        service.close()
+
+
+def test_send_refuses_raw_commands():
+    service = _make_service()
+    try:
+        for command_id in (cxl_mem_command_id.CXL_MEM_COMMAND_ID_RAW, cxl_mem_command_id.CXL_MEM_COMMAND_ID_SET_LSA):
+            with pytest.raises(CXLRPCError) as e:
+                service.rpc_send("mem0", command_id, opcode=0x4102)
+            assert e.value.code == RPC_NOT_ALLOWED
+    finally:
+        service.close()
+
+
+def test_send_allow_raw():
+    service = _make_service(allow_raw=True)
+    try:
+        result = service.rpc_send("mem0", cxl_mem_command_id.CXL_MEM_COMMAND_ID_RAW, opcode=0xCAFE)
+        assert result["retval"] != 0
+    finally:
+        service.close()
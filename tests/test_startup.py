@@ -0,0 +1,49 @@
+import os
+import sys
+import subprocess
+import pytest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+## Microseconds importing the CLI may take at most, the timing depends on the
+## machine so it is only checked when set
+IMPORT_TIME_BUDGET = os.environ.get("PYCXL_IMPORT_TIME_BUDGET")
+## Modules the CLI only imports in the sub-commands needing them
+LAZY_MODULES = (
+    "ctypes",
+    "pycxlcli.cxl",
+    "pycxlcli.linux_utils",
+    "pycxlcli.linux_device",
+    "pycxlcli.command_structure",
+    "pycxlcli.identify",
+    "pycxlcli.identify_memory_device",
+    "pycxlcli.health_info",
+    "pycxlcli.firmware_management",
+    "pycxlcli.event_records",
+    "pycxlcli.media_operations",
+    "pycxlcli.logs_gcc",
+)
+
+
+def _run_python(*args):
+    env = dict(os.environ, PYTHONPATH=SRC_DIR)
+    return subprocess.run([sys.executable] + list(args), env=env, check=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+
+
+@pytest.mark.skipif(not IMPORT_TIME_BUDGET, reason="set PYCXL_IMPORT_TIME_BUDGET(microseconds) to check the import time")
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="-X importtime needs Python 3.7")
+def test_import_time():
+    stderr = _run_python("-X", "importtime", "-c", "import pycxlcli.cxl_cli").stderr
+    for line in stderr.splitlines():
+        fields = [i.strip() for i in line.split("|")]
+        if len(fields) == 3 and fields[2] == "pycxlcli.cxl_cli":
+            assert int(fields[1]) < int(IMPORT_TIME_BUDGET)
+            break
+    else:
+        pytest.fail("pycxlcli.cxl_cli not in the -X importtime output")
+
+
+def test_lazy_imports():
+    stdout = _run_python("-c", "import sys, pycxlcli.cxl_cli; print('\\n'.join(sys.modules))").stdout
+    loaded = set(stdout.splitlines())
+    assert not loaded.intersection(LAZY_MODULES)